@@ -2,62 +2,71 @@
 Title: Lunar Lander Game
 Authors: Alec Swainston, Nathan Page, Jordan Huffaker, Samuel Omondi
 """
+import argparse
 import math
 from typing import Optional
 import arcade
 import os
+import sys
+import numpy as np
+
+from constants import (SCREEN_TITLE, SCREEN_WIDTH, SCREEN_HEIGHT, SPRITE_SIZE,
+                       SPRITE_SCALING_PLAYER, SPRITE_SCALING_TILES,
+                       PLAYER_START_GRID_X, PLAYER_START_GRID_Y,
+                       GRAVITY, DEFAULT_DAMPING, PLAYER_FRICTION,
+                       PLAYER_MASS, PLAYER_MAX_HORIZONTAL_SPEED,
+                       PLAYER_MAX_VERTICAL_SPEED, PLAYER_MOVE_FORCE,
+                       TICK_RATE, FRAME_RATE, FUEL_BURN_RATE, MAX_CATCH_UP_STEPS,
+                       MAP_FILE_NAME, CRASH_LAYER, LAND_LAYER)
+from assets import AssetCache, get_assets
+from autopilot import Autopilot
+from camera import Camera
+from crowd import LanderCrowd, ReplayPolicy, seek_pad, spread_starts
+from ghost import GhostRace, load_ghosts
+from hitbox import PLAYER_IMAGE, image_hit_box
+from hud import FrameGraph, Hud
+from layers import RenderLayers
+from leaderboard import Leaderboard, Run
+from lander import Lander
+from replay import Replay, check_replay, save_replay
+from mapcache import load_map
+from multiplayer import DEFAULT_PORT, EMPTY, CRASHED, ClientThread
+from particles import ParticlePool, exhaust, explosion
+from profiler import FrameProfiler, FrameRateMeter
+from streaming import ChunkStreamer, terrain_shapes
+from terrain import TerrainIndex
+from trajectory import TrajectoryPredictor
+
+# Best games on the map raced as ghosts, and how see-through they are
+GHOSTS = 10
+GHOST_ALPHA = 90
+
+# Share of the asked for frame rate a game must draw at to not be warned about
+FRAME_RATE_TOLERANCE = 0.9
 
-SCREEN_TITLE = "Lunar Lander"
-
-# How big are our image tiles?
-SPRITE_IMAGE_SIZE = 64
-
-# Scale sprites up or down
-SPRITE_SCALING_PLAYER = 0.5
-SPRITE_SCALING_TILES = 0.25
-
-# Scaled sprite size for tiles
-SPRITE_SIZE = int(SPRITE_IMAGE_SIZE * SPRITE_SCALING_PLAYER)
-
-# Size of grid to show on screen, in number of tiles
-SCREEN_GRID_WIDTH = 25
-SCREEN_GRID_HEIGHT = 20
-
-# Size of screen to show, in pixels
-SCREEN_WIDTH = SPRITE_SIZE * SCREEN_GRID_WIDTH
-SCREEN_HEIGHT = SPRITE_SIZE * SCREEN_GRID_HEIGHT
-
-# --- Physics forces. Higher number, faster accelerating.
-
-# Gravity
-GRAVITY = 10
-
-# Damping - Amount of speed lost per second
-DEFAULT_DAMPING = 1.0
-PLAYER_DAMPING = 0.4
-
-# Friction between objects
-PLAYER_FRICTION = 1.0
-WALL_FRICTION = 0.7
-
-# Mass (defaults to 1)
-PLAYER_MASS = 2.0
-
-# Keep player from going too fast
-PLAYER_MAX_HORIZONTAL_SPEED = 450
-PLAYER_MAX_VERTICAL_SPEED = 450
-
-#Player Movement Force
-PLAYER_MOVE_FORCE = 65
 
 class GameWindow(arcade.Window):
     """ Main Window """
 
-    def __init__(self, width, height, title):
+    def __init__(self, width, height, title, tick_rate=TICK_RATE, replay=None, autopilot=False,
+                 leaderboard=None, player=None, frame_rate=FRAME_RATE):
         """ Create the variables """
 
-        # Init the parent class
-        super().__init__(width, height, title)
+        # Init the parent class. pyglet draws the window after every update
+        # it schedules, so updating at the frame rate draws at the frame rate.
+        super().__init__(width, height, title, update_rate=1 / frame_rate)
+        # Without this a flip waits for the display, and frames can't be
+        # drawn faster than it refreshes
+        self.set_vsync(False)
+        self.frame_rate = frame_rate
+        # Frames actually drawn per second, to check against frame_rate
+        self.frame_rate_meter = FrameRateMeter()
+
+        # Physics runs in fixed ticks. Frame time piles up in the
+        # accumulator and is spent one tick at a time.
+        self.tick_rate = tick_rate
+        self.time_step = 1 / tick_rate
+        self.time_accumulator = 0.0
 
          # Physics engine
         self.physics_engine = Optional[arcade.PymunkPhysicsEngine]
@@ -65,12 +74,80 @@ class GameWindow(arcade.Window):
         # MM: Lander object
         self.lander = Lander()
         self.output_service = OutputService()
-        self.input_service = InputService()
+
+        # Play back a recorded game instead of reading the keyboard
+        if replay is not None:
+            self.input_service = ReplayInputService(replay)
+        elif autopilot:
+            self.input_service = AutopilotInputService(Autopilot(tick_rate=tick_rate), self.lander_state)
+        else:
+            self.input_service = InputService()
+
+        # Keys held on every tick of the current game
+        self.recording: Optional[Replay] = None
+
+        # Where finished games are scored, and who is flying
+        self.leaderboard: Optional[Leaderboard] = leaderboard
+        self.player = "autopilot" if autopilot else player
+        self.map_digest = None
+        # Best score on this map before this game, None if there is none
+        self.best_score = None
+
+        # Ghosts of the best games on this map, raced against unless G
+        # hides them, and the lander's position on every tick of this game
+        self.ghosts = GhostRace([])
+        self.show_ghosts = True
+        self.ghost_path = []
+        self.ticks = 0
+
+        # What the lander touched during the current tick, filled in by
+        # the physics engine's collision handlers
+        self.collision_events = []
+
+        # Loads the parts of the map near the lander
+        self.streamer: Optional[ChunkStreamer] = None
+        # Chunk -> physics shapes of every loaded chunk. Its sprites live
+        # in the chunk's render layer.
+        self.terrain_chunks = {}
+
+        self.camera: Optional[Camera] = None
+
+        # Times the phases of every frame. Off unless the frame graph is
+        # showing (F3) or frames are being recorded.
+        self.profiler = FrameProfiler()
+        self.frame_graph = FrameGraph(self.profiler, width - 360, height - 130, budget=1 / frame_rate,
+                                      meter=self.frame_rate_meter)
+
+        # Where the lander falls to without thrust, shown with T
+        self.trajectory: Optional[TrajectoryPredictor] = None
+        self.show_trajectory = False
 
     def setup(self):
         """ Set up everything with the game """
 
         self.output_service.setup()
+        self.trajectory = TrajectoryPredictor(self.output_service.terrain, time_step=self.time_step)
+        self.camera = Camera(self.width, self.height,
+                             self.output_service.tile_map.pixel_width,
+                             self.output_service.tile_map.pixel_height)
+
+        self.map_digest = self.output_service.tile_map.digest
+        if isinstance(self.input_service, ReplayInputService):
+            check_replay(self.input_service.replay, self.output_service.map_name, self.tick_rate)
+            self.output_service.player_sprite.position = self.input_service.replay.start
+            self.recording = None
+        else:
+            self.recording = Replay(self.map_digest, start=self.output_service.player_sprite.position,
+                                    tick_rate=self.tick_rate)
+        # Read now, so ending the game never waits for the database
+        if self.leaderboard is not None:
+            top = self.leaderboard.top(self.map_digest, GHOSTS)
+            self.best_score = top[0][1] if top else None
+            self.ghosts.close()
+            self.ghosts = load_ghosts([replay_file for _, _, _, _, replay_file, _ in top], self.map_digest)
+        self.output_service.add_ghosts(len(self.ghosts))
+        self.ghost_path = []
+        self.ticks = 0
 
         # --- Pymunk Physics Engine Setup ---
 
@@ -90,7 +167,9 @@ class GameWindow(arcade.Window):
                                                          gravity=gravity)
         
         
-        # Add the player.
+        # Add the player. Its hit box is set from the image the same way
+        # the headless simulation gets it, so both collide alike.
+        self.output_service.player_sprite.set_hit_box(image_hit_box(PLAYER_IMAGE))
         self.physics_engine.add_sprite(self.output_service.player_sprite,
                                        friction=PLAYER_FRICTION,
                                        mass=PLAYER_MASS,
@@ -99,72 +178,466 @@ class GameWindow(arcade.Window):
                                        max_horizontal_velocity=PLAYER_MAX_HORIZONTAL_SPEED,
                                        max_vertical_velocity=PLAYER_MAX_VERTICAL_SPEED)
 
-        # Create the crash zones.
-        self.physics_engine.add_sprite_list(self.output_service.wall_list,
-                                            friction=WALL_FRICTION,
-                                            collision_type="crash",
-                                            body_type=arcade.PymunkPhysicsEngine.STATIC)
-
-        # Create the Landing Zones
-        self.physics_engine.add_sprite_list(self.output_service.platform_list,  friction=WALL_FRICTION, collision_type="land", body_type=arcade.PymunkPhysicsEngine.STATIC) 
+        # Let pymunk tell us about contacts instead of searching the tile lists
+        self.physics_engine.add_collision_handler("player", "crash", begin_handler=self.on_crash)
+        self.physics_engine.add_collision_handler("player", "land", begin_handler=self.on_land)
+
+        # Create the crash and landing zones near the lander. The rest of
+        # the map is streamed in and out as it flies.
+        self.terrain_chunks = {}
+        self.streamer = ChunkStreamer(self.output_service.tile_map, self.load_chunk, self.unload_chunk)
+        self.streamer.update(*self.output_service.player_sprite.position)
+
+    def load_chunk(self, chunk):
+        """ Make the sprites and physics shapes of one chunk of the map """
+        shapes = []
+        for layer_name, collision_type in ((CRASH_LAYER, "crash"), (LAND_LAYER, "land")):
+            tiles = list(self.streamer.chunk_tiles(chunk, layer_name))
+            self.output_service.add_tiles(tiles, chunk)
+            shapes += self.add_terrain(tiles, collision_type)
+        self.terrain_chunks[chunk] = shapes
+
+    def unload_chunk(self, chunk):
+        """ Drop the sprites and physics shapes of a chunk left behind """
+        shapes = self.terrain_chunks.pop(chunk)
+        self.output_service.drop_chunk(chunk)
+        if shapes:
+            self.physics_engine.space.remove(*shapes)
+
+    def add_terrain(self, tiles, collision_type):
+        """
+        Add (col, row, tile_id) tiles to the physics engine, with the same
+        shapes the headless simulation makes: square tiles next to each
+        other become one big box, and tiles with other shapes, like slopes,
+        keep their hit boxes. Returns the shapes that were added.
+        """
+        if collision_type not in self.physics_engine.collision_types:
+            self.physics_engine.collision_types.append(collision_type)
+        collision_type_id = self.physics_engine.collision_types.index(collision_type)
+
+        space = self.physics_engine.space
+        shapes = terrain_shapes(space.static_body, self.output_service.tile_map, tiles, collision_type_id)
+        if shapes:
+            space.add(*shapes)
+        return shapes
 
     def on_key_press(self, key, modifiers):
         """Called whenever a key is pressed. """
+        if key == arcade.key.F3:
+            self.toggle_frame_graph()
+            return
+        if key == arcade.key.T:
+            self.show_trajectory = not self.show_trajectory
+            return
+        if key == arcade.key.G:
+            self.show_ghosts = not self.show_ghosts
+            return
         self.input_service.key_input(key, modifiers)
+
+    def toggle_frame_graph(self):
+        """ Show or hide the frame time graph, timing frames only while it shows """
+        self.frame_graph.visible = not self.frame_graph.visible
+        if self.frame_graph.visible:
+            self.profiler.enable()
+        else:
+            self.profiler.disable()
     
     def on_key_release(self, key, modifiers):
         self.input_service.key_release(key, modifiers)
    
     def on_update(self, delta_time):
         """ Movement and game logic """
+        self.profiler.begin_frame()
+        self.time_accumulator += delta_time
+        steps = 0
+        while self.time_accumulator >= self.time_step and steps < MAX_CATCH_UP_STEPS:
+            self.fixed_update()
+            self.time_accumulator -= self.time_step
+            steps += 1
+
+        # Too far behind, drop the rest instead of trying to catch up
+        if self.time_accumulator >= self.time_step:
+            self.time_accumulator %= self.time_step
+
+    def fixed_update(self):
+        """ Advance the game by one physics tick """
+        fuel_used = FUEL_BURN_RATE * self.time_step
+        profiler = self.profiler
         if self.output_service.game_over == False:    
-            if self.input_service.right and self.lander._fuel > 0:
-                force = (PLAYER_MOVE_FORCE, 0)
-                self.physics_engine.apply_force(self.output_service.player_sprite, force)
-                self.lander._fuel -= 1
-            elif self.input_service.left and self.lander._fuel > 0:
-                force = (-PLAYER_MOVE_FORCE, 0)
-                self.physics_engine.apply_force(self.output_service.player_sprite, force)
-                self.lander._fuel -= 1
-            elif self.input_service.up and self.lander._fuel > 0:
-                force = (0, PLAYER_MOVE_FORCE)
-                self.physics_engine.apply_force(self.output_service.player_sprite, force)
-                self.lander._fuel -= 1
+            with profiler.phase("input"):
+                self.input_service.next_tick()
+                if self.recording is not None:
+                    self.recording.record(self.input_service.right, self.input_service.left, self.input_service.up)
+
+            with profiler.phase("forces"):
+                direction = self.apply_thrust(fuel_used)
+            if direction is not None:
+                with profiler.phase("particles"):
+                    _, velocity, _ = self.lander_state()
+                    self.output_service.emit_exhaust(direction, velocity)
 
-        # MM: Check for collision with ground
-        self.output_service.wall_hit()
-        self.output_service.platform_hit(self.lander)
         # MM: Update state of lander
         # Moving objects in physics engine
-        self.physics_engine.step()
+        with profiler.phase("physics"):
+            self.collision_events = []
+            self.output_service.save_position()
+            self.physics_engine.step(self.time_step)
+        if not self.output_service.game_over:
+            self.ticks += 1
+            self.ghost_path.append(self.output_service.player_sprite.position)
+        with profiler.phase("streaming"):
+            self.streamer.update(*self.output_service.player_sprite.position)
+        if self.show_trajectory and not self.output_service.game_over:
+            with profiler.phase("trajectory"):
+                position, velocity, _ = self.lander_state()
+                self.trajectory.update(position, velocity)
+        with profiler.phase("particles"):
+            self.output_service.particles.update(self.time_step)
+
+        # MM: Check for collision with ground
+        with profiler.phase("collisions"):
+            if "crash" in self.collision_events:
+                self.output_service.wall_hit()
+            if "land" in self.collision_events:
+                self.output_service.platform_hit(self.lander)
+            if self.output_service.game_over:
+                self.save_recording()
+
+    def apply_thrust(self, fuel_used):
+        """
+        Push the lander the way the held keys say, while fuel lasts.
+        Returns the way it was pushed, (x, y), or None.
+        """
+        if self.input_service.right and self.lander._fuel > 0:
+            direction = (1, 0)
+        elif self.input_service.left and self.lander._fuel > 0:
+            direction = (-1, 0)
+        elif self.input_service.up and self.lander._fuel > 0:
+            direction = (0, 1)
+        else:
+            return None
+        force = (direction[0] * PLAYER_MOVE_FORCE, direction[1] * PLAYER_MOVE_FORCE)
+        self.physics_engine.apply_force(self.output_service.player_sprite, force)
+        self.lander.burn_fuel(fuel_used)
+        return direction
+
+    def lander_state(self):
+        """ Position, velocity and fuel of the lander, for the autopilot """
+        body = self.physics_engine.get_physics_object(self.output_service.player_sprite).body
+        return tuple(body.position), tuple(body.velocity), self.lander._fuel
+
+    def record_collision(self, event):
+        """ Remember what the lander touched, once per tick """
+        if event not in self.collision_events:
+            self.collision_events.append(event)
+
+    def on_crash(self, player_sprite, wall_sprite, arbiter, space, data):
+        self.record_collision("crash")
+        return True
+
+    def on_land(self, player_sprite, platform_sprite, arbiter, space, data):
+        self.record_collision("land")
+        return True
+
+    def save_recording(self):
+        """
+        Save the finished game's replay next to the game. With a
+        leaderboard, its writer thread saves the replay along with the
+        score, so the game doesn't wait for the disk.
+        """
+        if self.recording is None:
+            return
+        if self.output_service.landed:
+            self.recording.score = self.output_service.points
+        self.recording.end, _, _ = self.lander_state()
+        replay_directory = os.path.join(self.output_service.directory, "replays")
+        if self.leaderboard is not None:
+            ticks = len(self.recording)
+            self.leaderboard.submit(Run(self.map_digest, self.recording.score, self.lander._fuel, ticks,
+                                        ticks * self.time_step, self.output_service.landed,
+                                        player=self.player, replay=self.recording,
+                                        replay_directory=replay_directory, ghost=self.ghost_path))
+            if self.output_service.landed and (self.best_score is None or
+                                               self.output_service.points > self.best_score):
+                self.output_service.new_best = True
+        else:
+            save_replay(self.recording, replay_directory)
+        self.recording = None
 
     def on_draw(self):
         """ Draw everything """
         
         arcade.start_render()
-        self.output_service.wall_list.draw()
-        self.output_service.platform_list.draw()
+        profiler = self.profiler
+        self.frame_rate_meter.tick()
+
+        # Draw the lander part way between the last two physics ticks
+        blend = self.time_accumulator / self.time_step
+        self.camera.follow(*self.output_service.lander_position(blend))
+
+        # The world, only the chunks on screen
+        self.camera.use()
+        with profiler.phase("terrain"):
+            self.output_service.draw_terrain(self.camera.visible_chunks(self.streamer))
+        if self.show_trajectory and not self.output_service.game_over:
+            with profiler.phase("trajectory"):
+                self.output_service.draw_trajectory(self.trajectory)
+        if self.show_ghosts and len(self.ghosts):
+            with profiler.phase("ghosts"):
+                # As far into their games as the lander being drawn is into this one
+                seconds = (self.ticks - 1 + blend) * self.time_step
+                self.output_service.draw_ghosts(self.ghosts.positions(seconds))
+        with profiler.phase("particles"):
+            self.output_service.draw_particles()
+        with profiler.phase("lander"):
+            self.output_service.draw_lander(self.lander, blend)
+
+        # The HUD, in screen pixels
+        self.camera.use_screen()
+        with profiler.phase("hud"):
+            self.output_service.draw_fuel(self.lander)
+            self.output_service.draw_altitude(self.lander)
+            self.output_service.draw_result()
+            self.output_service.draw_hud()
+        if self.frame_graph.visible:
+            self.frame_graph.draw()
+        profiler.end_frame()
+
+
+
+class CrowdWindow(arcade.Window):
+    """
+    Hundreds of landers at once, flown by the AI or by replays, for stress
+    tests and for watching a race. The terrain is one baked layer and the
+    landers are one SpriteList, so drawing them is two draw calls.
+    """
+
+    def __init__(self, width, height, title, count, replays=()):
+        super().__init__(width, height, title)
+        self.time_step = 1 / TICK_RATE
+        self.time_accumulator = 0.0
+
+        # AI landers come first, then one lander per replay
+        self.ai_count = count
+        self.replays = list(replays)
+        self.replay_policy: Optional[ReplayPolicy] = None
+
+        self.crowd: Optional[LanderCrowd] = None
+        self.lander_list: Optional[arcade.SpriteList] = None
+        self.layers: Optional[RenderLayers] = None
+        self.hud: Optional[Hud] = None
+        self.camera: Optional[Camera] = None
+        # Landers that were still flying when last drawn
+        self.drawn_active = None
+
+        self.assets: AssetCache = get_assets()
+        self.profiler = FrameProfiler()
+        self.frame_graph = FrameGraph(self.profiler, width - 360, height - 130, budget=1 / FRAME_RATE)
+        arcade.set_background_color(arcade.color.BLACK)
 
-        self.output_service.draw_lander(self.lander)
-        self.output_service.draw_fuel(self.lander)
-        self.output_service.draw_altitude(self.lander)
-        self.output_service.wall_hit()
-        self.output_service.platform_hit(self.lander)
+    def setup(self):
+        directory = os.path.dirname(__file__)
+        map_name = os.path.join(directory, MAP_FILE_NAME)
+        tile_map = load_map(map_name, SPRITE_SCALING_TILES)
+        for replay in self.replays:
+            # The crowd always runs at TICK_RATE
+            check_replay(replay, map_name, TICK_RATE)
+
+        count = self.ai_count + len(self.replays)
+        positions = spread_starts(count)
+        if self.replays:
+            self.replay_policy = ReplayPolicy(self.replays)
+            positions[self.ai_count:] = self.replay_policy.starts
+        self.crowd = LanderCrowd(count, tile_map)
+        self.crowd.setup(positions)
+
+        self.layers = baked_map(self.assets, tile_map)
+        self.lander_list = lander_sprites(self.assets, count)
+        for index, sprite in enumerate(self.lander_list):
+            sprite.position = tuple(positions[index])
+            if index >= self.ai_count:
+                # Replays in orange, to tell them from the AI
+                sprite.color = arcade.color.ORANGE
+        self.drawn_active = self.crowd.active
+
+        self.camera = Camera(self.width, self.height, tile_map.pixel_width, tile_map.pixel_height)
+
+        self.hud = Hud()
+        self.hud.add("flying", 12, 600, arcade.csscolor.WHITE, 14)
+        self.hud.add("landed", 140, 600, arcade.csscolor.LIME_GREEN, 14)
+        self.hud.add("crashed", 270, 600, arcade.csscolor.RED, 14)
+        self.hud.add("best", 400, 600, arcade.csscolor.WHITE, 14)
+
+    def crowd_keys(self, crowd):
+        """ Keys of every lander: the AI's, then the replays' """
+        keys = seek_pad(crowd)
+        if self.replay_policy is not None:
+            keys[self.ai_count:] = self.replay_policy(crowd)
+        return keys
 
-        
-class Lander:
-    """The Ship the Player controls
-        Stereotype: 
-            Structurer, Service Provider, Information Holder
+    def on_key_press(self, key, modifiers):
+        if key == arcade.key.F3:
+            self.frame_graph.visible = not self.frame_graph.visible
+            if self.frame_graph.visible:
+                self.profiler.enable()
+            else:
+                self.profiler.disable()
+
+    def on_update(self, delta_time):
+        self.profiler.begin_frame()
+        self.time_accumulator += delta_time
+        steps = 0
+        while self.time_accumulator >= self.time_step and steps < MAX_CATCH_UP_STEPS:
+            with self.profiler.phase("policy"):
+                keys = self.crowd_keys(self.crowd)
+            with self.profiler.phase("physics"):
+                self.crowd.step(keys)
+            self.time_accumulator -= self.time_step
+            steps += 1
+        if self.time_accumulator >= self.time_step:
+            self.time_accumulator %= self.time_step
+
+    def on_draw(self):
+        arcade.start_render()
+        crowd = self.crowd
+        active = crowd.active
+
+        # Watch the landers still flying
+        if active.any():
+            self.camera.follow(*crowd.position[active].mean(axis=0))
+        self.camera.use()
+
+        with self.profiler.phase("terrain"):
+            self.layers.draw()
+        with self.profiler.phase("landers"):
+            # Only landers that were flying can have moved
+            sprites = self.lander_list
+            for index in np.flatnonzero(self.drawn_active).tolist():
+                sprites[index].position = tuple(crowd.position[index])
+                if crowd.crashed[index]:
+                    sprites[index].alpha = 0
+            self.drawn_active = active
+            sprites.draw()
+
+        self.camera.use_screen()
+        with self.profiler.phase("hud"):
+            self.hud.show("flying", f"Flying: {active.sum()}")
+            self.hud.show("landed", f"Landed: {crowd.landed.sum()}")
+            self.hud.show("crashed", f"Crashed: {crowd.crashed.sum()}")
+            self.hud.show("best", f"Best: {crowd.points.max():.0f}")
+            self.hud.draw()
+        if self.frame_graph.visible:
+            self.frame_graph.draw()
+        self.profiler.end_frame()
+
+
+class NetworkWindow(arcade.Window):
+    """
+    A player of a multiplayer server. Keys go to the server every tick, and
+    every lander is drawn where the server's latest snapshot has it.
     """
-    def __init__(self):
-        self._fuel = 500
-        self._has_crashed = False
 
-    def get_fuel(self):
-        return self._fuel
+    def __init__(self, width, height, title, host, port=DEFAULT_PORT):
+        super().__init__(width, height, title)
+        self.time_step = 1 / TICK_RATE
+        self.time_accumulator = 0.0
+        self.input_service = InputService()
+        self.network = ClientThread(host, port)
+
+        self.assets: AssetCache = get_assets()
+        self.layers: Optional[RenderLayers] = None
+        self.lander_list: Optional[arcade.SpriteList] = None
+        self.camera: Optional[Camera] = None
+        self.hud: Optional[Hud] = None
+        arcade.set_background_color(arcade.color.BLACK)
+
+    def setup(self):
+        map_name = os.path.join(os.path.dirname(__file__), MAP_FILE_NAME)
+        tile_map = load_map(map_name, SPRITE_SCALING_TILES)
+        self.layers = baked_map(self.assets, tile_map)
+        self.lander_list = lander_sprites(self.assets, len(self.network.landers))
+        for index, sprite in enumerate(self.lander_list):
+            if index != self.network.slot:
+                # Other players in gray, to tell them from yourself
+                sprite.color = arcade.color.GRAY
+        self.camera = Camera(self.width, self.height, tile_map.pixel_width, tile_map.pixel_height)
+
+        self.hud = Hud()
+        self.hud.add("fuel", 12, 600, arcade.csscolor.WHITE, 18)
+        self.hud.add("players", 165, 600, arcade.csscolor.WHITE, 18)
+        self.hud.add("ping", 330, 600, arcade.csscolor.WHITE, 18)
+
+    def on_key_press(self, key, modifiers):
+        self.input_service.key_input(key, modifiers)
+
+    def on_key_release(self, key, modifiers):
+        self.input_service.key_release(key, modifiers)
+
+    def on_update(self, delta_time):
+        self.time_accumulator += delta_time
+        steps = 0
+        while self.time_accumulator >= self.time_step and steps < MAX_CATCH_UP_STEPS:
+            self.network.send_input(self.input_service.right, self.input_service.left, self.input_service.up)
+            self.time_accumulator -= self.time_step
+            steps += 1
+        if self.time_accumulator >= self.time_step:
+            self.time_accumulator %= self.time_step
+
+    def on_draw(self):
+        arcade.start_render()
+        landers = self.network.landers
+        own = landers[self.network.slot]
+        self.camera.follow(own[0], own[1])
+        self.camera.use()
+        self.layers.draw()
+
+        for index, sprite in enumerate(self.lander_list):
+            x, y, _, _, _, state = landers[index]
+            if state == EMPTY or state == CRASHED:
+                if sprite.alpha != 0:
+                    sprite.alpha = 0
+                continue
+            if sprite.alpha != 255:
+                sprite.alpha = 255
+            if sprite.position != (x, y):
+                sprite.position = (x, y)
+        self.lander_list.draw()
+
+        self.camera.use_screen()
+        self.hud.show("fuel", f"Fuel: {(own[4] / 10) * 2:.1f}%")
+        self.hud.show("players", f"Players: {int((landers[:, 5] != EMPTY).sum())}")
+        if self.network.round_trip is not None:
+            self.hud.show("ping", f"Ping: {self.network.round_trip * 1000:.0f} ms")
+        self.hud.draw()
+
+    def on_close(self):
+        self.network.close()
+        super().on_close()
+
+
+def baked_map(assets, tile_map):
+    """ Render layers with the whole map baked into one texture """
+    terrain = []
+    for layer_name in (CRASH_LAYER, LAND_LAYER):
+        for col, row, tile_id in tile_map.tiles(layer_name):
+            sprite = assets.sprite(tile_map.textures[tile_id], SPRITE_SCALING_TILES)
+            sprite.center_x = (col + 0.5) * tile_map.tile_size
+            sprite.center_y = (row + 0.5) * tile_map.tile_size
+            terrain.append(sprite)
+    layers = RenderLayers()
+    layers.add_static("terrain", terrain)
+    return layers
+
+
+def lander_sprites(assets, count):
+    """ One SpriteList of count lander sprites """
+    lander_file = os.path.join(os.path.dirname(__file__), "lander.png")
+    sprite_list = arcade.SpriteList()
+    for _ in range(count):
+        sprite_list.append(assets.sprite(lander_file, SPRITE_SCALING_PLAYER))
+    return sprite_list
+
 
-    
 class InputService:
 
     def __init__(self):
@@ -187,6 +660,50 @@ class InputService:
             self.left = False
         elif key == arcade.key.UP:
             self.up = False
+
+    def next_tick(self):
+        """ Called at the start of every physics tick """
+        pass
+
+
+class ReplayInputService(InputService):
+    """ Holds the keys of a recorded game, one tick at a time """
+
+    def __init__(self, replay):
+        super().__init__()
+        self.replay = replay
+        self.tick = 0
+
+    def key_input(self, key, modifiers):
+        pass
+
+    def key_release(self, key, modifiers):
+        pass
+
+    def next_tick(self):
+        self.right, self.left, self.up = self.replay.keys_at(self.tick)
+        self.tick += 1
+
+
+class AutopilotInputService(InputService):
+    """ Holds the keys the autopilot picks from the lander's state """
+
+    def __init__(self, autopilot, lander_state):
+        super().__init__()
+        self.autopilot = autopilot
+        self.lander_state = lander_state
+
+    def key_input(self, key, modifiers):
+        pass
+
+    def key_release(self, key, modifiers):
+        pass
+
+    def next_tick(self):
+        self.right, self.left, self.up = self.autopilot.next_keys(*self.lander_state())
+
+    def close(self):
+        self.autopilot.close()
     
 
 class OutputService:
@@ -194,11 +711,28 @@ class OutputService:
     def __init__(self):
         self.player_sprite: Optional[arcade.Sprite] = None
         self.player_list: Optional[arcade.SpriteList] = None
-        self.wall_list: Optional[arcade.SpriteList] = None
-        self.platform_list: Optional[arcade.SpriteList] = None
+        # Translucent landers of the ghosts being raced
+        self.ghost_list: Optional[arcade.SpriteList] = None
+        self.hud: Optional[Hud] = None
+        self.terrain: Optional[TerrainIndex] = None
+        self.tile_map = None
+        # Terrain of every loaded chunk, baked into one texture each
+        self.layers = RenderLayers()
+        # Every image the game draws, each loaded once per process
+        self.assets: AssetCache = get_assets()
+        # Where the lander was before the last physics tick
+        self.previous_position = None
+        # Exhaust and explosions. They fall slower than the lander and
+        # slow down as they spread.
+        self.particles = ParticlePool(gravity=GRAVITY / 4, drag=0.5)
         arcade.set_background_color(arcade.color.BLACK)
         
         self.game_over = False
+        self.crashed = False
+        self.landed = False
+        self.points = 0
+        # The landing beat every score on the leaderboard
+        self.new_best = False
 
     def setup(self):
         # Create Sprite Lists
@@ -206,71 +740,234 @@ class OutputService:
         
         # Read in Map
         self.directory = os.path.dirname(__file__)
-        map_name = os.path.join(self.directory, "moon.tmx")
-        my_map = arcade.tilemap.read_tmx(map_name)
+        self.map_name = os.path.join(self.directory, MAP_FILE_NAME)
+        # The compiled map cache saves parsing the TMX file every time
+        my_map = load_map(self.map_name, SPRITE_SCALING_TILES)
         
-        # Read in the map layers
-        self.wall_list = arcade.tilemap.process_layer(my_map, 'CRASH', SPRITE_SCALING_TILES)
-        self.platform_list = arcade.tilemap.process_layer(my_map, 'LAND', SPRITE_SCALING_TILES)
+        self.tile_map = my_map
+
+        # GameWindow streams the map's tiles into a render layer per chunk
+        # as the lander gets near
+        self.layers = RenderLayers()
+        self.particles.clear()
+        self.layers.add_particles("particles", self.particles)
+
+        # Grid of the solid tiles, for finding the ground under the lander
+        self.terrain = TerrainIndex(my_map)
         
         # Create player sprite
         file_name = os.path.join(self.directory, "lander.png")
-        self.player_sprite = arcade.Sprite(file_name, SPRITE_SCALING_PLAYER)
+        self.player_sprite = self.assets.sprite(file_name, SPRITE_SCALING_PLAYER)
 
         # Set player location
-        grid_x = 12
-        grid_y = 15
+        grid_x = PLAYER_START_GRID_X
+        grid_y = PLAYER_START_GRID_Y
         self.player_sprite.center_x = SPRITE_SIZE * grid_x + SPRITE_SIZE / 2
         self.player_sprite.center_y = SPRITE_SIZE * grid_y + SPRITE_SIZE / 2
         
         # Add to player sprite list
         self.player_list.append(self.player_sprite)
-
-    def draw_lander(self, lander):
+        self.previous_position = None
+
+        # HUD text, rendered only when it changes
+        self.hud = Hud()
+        self.hud.add("fuel", 12, 600, arcade.csscolor.WHITE, 18)
+        self.hud.add("altitude", 165, 600, arcade.csscolor.WHITE, 18)
+        self.hud.add("lose", 330, 330, arcade.csscolor.RED, 24)
+        self.hud.add("win", 330, 355, arcade.csscolor.LIME_GREEN, 24)
+        self.hud.add("points", 335, 330, arcade.csscolor.LIME_GREEN, 24)
+        self.hud.add("best", 335, 305, arcade.csscolor.GOLD, 18)
+
+    def add_tiles(self, tiles, chunk):
+        """
+        Make sprites for (col, row, tile_id) tiles of a chunk and add them
+        to the chunk's static render layer, so only chunks on screen are
+        drawn, each as one baked quad.
+        """
+        name = ("terrain", chunk)
+        layer = self.layers[name] if name in self.layers else self.layers.add_static(name)
+
+        sprites = []
+        for col, row, tile_id in tiles:
+            sprite = self.assets.sprite(self.tile_map.textures[tile_id], SPRITE_SCALING_TILES)
+            sprite.center_x = (col + 0.5) * self.tile_map.tile_size
+            sprite.center_y = (row + 0.5) * self.tile_map.tile_size
+            sprites.append(sprite)
+        layer.extend(sprites)
+        return sprites
+
+    def drop_chunk(self, chunk):
+        """ Forget the render layer of an unloaded chunk """
+        self.layers.remove(("terrain", chunk))
+
+    def draw_terrain(self, chunks):
+        """ Draw the tiles of the given chunks """
+        self.layers.draw(("terrain", chunk) for chunk in chunks)
+
+    def save_position(self):
+        """ Remember where the lander is before the physics moves it """
+        self.previous_position = self.player_sprite.position
+
+    def lander_position(self, blend=1.0):
+        """
+        Where to draw the lander: blend of the way from its last position
+        to its current one, so motion stays smooth when physics ticks
+        slower than frames are drawn.
+        """
+        current_x, current_y = self.player_sprite.position
+        if self.previous_position is None:
+            return current_x, current_y
+        previous_x, previous_y = self.previous_position
+        return (previous_x + (current_x - previous_x) * blend,
+                previous_y + (current_y - previous_y) * blend)
+
+    def draw_lander(self, lander, blend=1.0):
+        """ Draw the lander at its blended position """
+        current_position = self.player_sprite.position
+        self.player_sprite.position = self.lander_position(blend)
         self.player_list.draw()
+        # Collisions still use the real physics position
+        self.player_sprite.position = current_position
     
-    def draw_explosion(self, lander):
-        pass
+    def add_ghosts(self, count):
+        """ Make a translucent lander sprite for each of count ghosts """
+        self.ghost_list = arcade.SpriteList()
+        file_name = os.path.join(self.directory, "lander.png")
+        for _ in range(count):
+            sprite = self.assets.sprite(file_name, SPRITE_SCALING_PLAYER)
+            sprite.alpha = GHOST_ALPHA
+            self.ghost_list.append(sprite)
+
+    def draw_ghosts(self, positions):
+        """ Draw the ghosts at their (x, y) positions, in one batch """
+        for sprite, position in zip(self.ghost_list, positions):
+            sprite.position = position
+        self.ghost_list.draw()
+
+    def draw_trajectory(self, trajectory):
+        """ Draw where the lander falls to, and mark what it would hit """
+        if len(trajectory.points) > 1:
+            arcade.draw_line_strip(list(trajectory.points), arcade.color.GRAY)
+        if trajectory.impact is not None:
+            x, y, layer_name = trajectory.impact
+            color = arcade.csscolor.LIME_GREEN if layer_name == LAND_LAYER else arcade.csscolor.RED
+            arcade.draw_circle_outline(x, y, 6, color, 2)
+
+    def emit_exhaust(self, direction, velocity):
+        """ Exhaust out of the nozzle opposite the way the lander is pushed """
+        sprite = self.player_sprite
+        x = sprite.center_x - direction[0] * sprite.width / 2
+        y = sprite.center_y - direction[1] * sprite.height / 2
+        exhaust(self.particles, x, y, direction, velocity)
+
+    def draw_particles(self):
+        """ Exhaust and explosions, in one draw call """
+        self.layers.draw(["particles"])
 
     def draw_fuel(self, lander):
         if lander._fuel > 0:
-            fuel_text = f"Fuel: {(lander._fuel/10)*2}%"
-            arcade.draw_text(fuel_text, 12, 600, arcade.csscolor.WHITE, 18)
+            fuel_text = f"Fuel: {(lander._fuel/10)*2:.1f}%"
+            self.hud.show("fuel", fuel_text, arcade.csscolor.WHITE)
         else:
             fuel_text = f"Fuel: Empty!"
-            arcade.draw_text(fuel_text, 12, 600, arcade.csscolor.RED, 18)
+            self.hud.show("fuel", fuel_text, arcade.csscolor.RED)
 
     def draw_altitude(self, lander):
-        altitude = self.player_sprite.center_y
+        # Height above the ground right under the lander
+        ground = self.terrain.ground_below(self.player_sprite.center_x, self.player_sprite.center_y)
+        altitude = max(self.player_sprite.bottom - (ground or 0), 0)
         altitude_text = f"Altitude: {altitude:.0f}"
-        arcade.draw_text(altitude_text, 165, 600, arcade.csscolor.WHITE, 18)
+        self.hud.show("altitude", altitude_text)
     
     def wall_hit(self):
-        wall_hit = arcade.check_for_collision_with_list(self.player_sprite, self.wall_list)
-        lose_text = "You Died"
-
-        if wall_hit:
-            self.player_sprite.remove_from_sprite_lists()
-            arcade.draw_text(lose_text, 330, 330, arcade.csscolor.RED, 24)
-            self.game_over = True
+        """ The lander touched a crash zone """
+        if not self.crashed:
+            explosion(self.particles, self.player_sprite.center_x, self.player_sprite.center_y)
+        self.player_sprite.remove_from_sprite_lists()
+        self.game_over = True
+        self.crashed = True
 
     def platform_hit(self, lander):
-        platform_check = arcade.check_for_collision_with_list(self.player_sprite, self.platform_list)
-        win_text = f"You Landed!"
-        points = lander._fuel * 2
-        points_text = f"Points: {points}"
-        
-        if platform_check:
-            arcade.draw_text(win_text, 330, 355, arcade.csscolor.LIME_GREEN, 24)
-            arcade.draw_text(points_text, 335, 330, arcade.csscolor.LIME_GREEN, 24)
-            self.game_over = True
-        
+        """ The lander touched a landing zone """
+        if not self.landed:
+            self.points = lander._fuel * 2
+        self.game_over = True
+        self.landed = True
+
+    def draw_result(self):
+        """ Tell the player how the game ended """
+        if self.crashed:
+            lose_text = "You Died"
+            self.hud.show("lose", lose_text)
+        if self.landed:
+            win_text = f"You Landed!"
+            points_text = f"Points: {self.points:.0f}"
+            self.hud.show("win", win_text)
+            self.hud.show("points", points_text)
+            if self.new_best:
+                self.hud.show("best", "New best on this map!")
+
+    def draw_hud(self):
+        """ Draw all the HUD text in one batch """
+        self.hud.draw()
+
         
 def main():
-    """ Main method """
-    window = GameWindow(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
+    """ Main method. Pass a replay file to watch it instead of playing. """
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("replays", nargs="*", metavar="replay",
+                        help="replay file to watch, or several to race each other")
+    parser.add_argument("--crowd", type=int, default=0, metavar="LANDERS",
+                        help="watch this many AI landers at once, along with any replays")
+    parser.add_argument("--autopilot", action="store_true", help="let the autopilot fly")
+    parser.add_argument("--player", help="name to put on the leaderboard")
+    parser.add_argument("--connect", metavar="HOST[:PORT]", help="play on a multiplayer server")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="save the time of every frame's phases as .csv, .json or .trace.json")
+    parser.add_argument("--tick-rate", type=int, metavar="HZ",
+                        help=f"physics ticks per second, {TICK_RATE} or the replay's rate if not given")
+    parser.add_argument("--frame-rate", type=int, default=FRAME_RATE, metavar="HZ",
+                        help="frames drawn per second, the lander is drawn between ticks")
+    args = parser.parse_args()
+    if args.tick_rate is not None and args.tick_rate <= 0:
+        parser.error("--tick-rate must be above 0")
+    if args.frame_rate <= 0:
+        parser.error("--frame-rate must be above 0")
+
+    if args.connect:
+        host, _, port = args.connect.partition(":")
+        window = NetworkWindow(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, host, int(port or DEFAULT_PORT))
+        window.setup()
+        arcade.run()
+        return
+
+    replays = [Replay.load(file_name) for file_name in args.replays]
+    if args.crowd or len(replays) > 1:
+        window = CrowdWindow(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, args.crowd, replays)
+        window.setup()
+        arcade.run()
+        return
+
+    replay = replays[0] if replays else None
+    tick_rate = args.tick_rate or (replay.tick_rate if replay is not None else TICK_RATE)
+    leaderboard = Leaderboard() if replay is None else None
+    window = GameWindow(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, tick_rate=tick_rate, replay=replay,
+                        autopilot=args.autopilot, leaderboard=leaderboard, player=args.player,
+                        frame_rate=args.frame_rate)
     window.setup()
+    if args.profile:
+        window.profiler.start_recording()
     arcade.run()
+    drawn = window.frame_rate_meter.average()
+    if drawn and drawn < window.frame_rate * FRAME_RATE_TOLERANCE:
+        print(f"Drew {drawn:.0f} frames per second, asked for {window.frame_rate}", file=sys.stderr)
+    if isinstance(window.input_service, AutopilotInputService):
+        window.input_service.close()
+    window.ghosts.close()
+    if leaderboard is not None:
+        leaderboard.close()
+    if args.profile:
+        window.profiler.save(args.profile)
 
 if __name__ == "__main__":
     main()
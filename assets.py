@@ -0,0 +1,163 @@
+"""
+Textures and sounds, loaded once and shared.
+
+An AssetCache loads an asset the first time it is asked for and keeps it,
+so later games reuse it instead of decoding the file again. It keeps up to
+a budget of bytes (decoded pixels for textures, file size for sounds) and
+forgets the least recently used assets past that. It counts hits, misses
+and evictions to show how well the budget fits.
+
+preload() loads assets on a background thread, e.g. while an
+instructions page is up. Asking for an asset that is still preloading
+waits for that load instead of starting another.
+
+Textures are decoded with PIL and only reach the GPU when first drawn, so
+they can be loaded off the main thread. The hit box of every texture is
+worked out there too, as arcade would otherwise do it when the first
+sprite is made.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import arcade
+from arcade.resources import resolve_resource_path
+
+# Most bytes of assets kept at once
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+
+def _texture_bytes(texture):
+    return texture.width * texture.height * 4
+
+
+def _load_texture(file_name):
+    texture = arcade.load_texture(file_name)
+    # Worked out now, not when the first sprite is made
+    texture.hit_box_points
+    return texture, _texture_bytes(texture)
+
+
+def _load_spritesheet(file_name, sprite_width, sprite_height, columns, count):
+    textures = arcade.load_spritesheet(file_name, sprite_width, sprite_height, columns, count)
+    return textures, sum(_texture_bytes(texture) for texture in textures)
+
+
+def _load_sound(file_name):
+    sound = arcade.load_sound(file_name)
+    return sound, os.path.getsize(resolve_resource_path(file_name))
+
+
+class AssetCache:
+    """ Assets by name, least recently used dropped past a byte budget """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        # key -> (asset, bytes), most recently used last
+        self.assets = OrderedDict()
+        self.size = 0
+        # Assets found loaded or preloading, and assets loaded on the spot
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> Future of assets being preloaded
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _get(self, key, load, *args):
+        """ The asset under key, loading it with load(*args) if it isn't kept """
+        with self.lock:
+            entry = self.assets.get(key)
+            if entry is not None:
+                self.assets.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            future = self.loading.get(key)
+            if future is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if future is not None:
+            return future.result()
+        asset, size = load(*args)
+        self._keep(key, asset, size)
+        return asset
+
+    def _keep(self, key, asset, size):
+        with self.lock:
+            old = self.assets.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.assets[key] = (asset, size)
+            self.size += size
+            # Never drop the asset just loaded, even if it is over budget
+            while self.size > self.budget and len(self.assets) > 1:
+                _, (_, dropped_size) = self.assets.popitem(last=False)
+                self.size -= dropped_size
+                self.evictions += 1
+
+    def texture(self, file_name):
+        return self._get(("texture", file_name), _load_texture, file_name)
+
+    def spritesheet(self, file_name, sprite_width, sprite_height, columns, count):
+        """ Frames cut from a sprite sheet, as a list of textures """
+        args = (file_name, sprite_width, sprite_height, columns, count)
+        return self._get(("spritesheet",) + args, _load_spritesheet, *args)
+
+    def sound(self, file_name):
+        return self._get(("sound", file_name), _load_sound, file_name)
+
+    def sprite(self, file_name, scale=1, sprite_class=arcade.Sprite):
+        """ A new sprite drawn with a cached texture """
+        sprite = sprite_class(scale=scale)
+        sprite.texture = self.texture(file_name)
+        return sprite
+
+    def preload(self, textures=(), spritesheets=(), sounds=()):
+        """
+        Load assets on a background thread. spritesheets holds the
+        arguments of spritesheet() for each sheet.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="assets")
+        requests = ([(("texture", file_name), _load_texture, (file_name,)) for file_name in textures] +
+                    [(("spritesheet",) + tuple(sheet), _load_spritesheet, tuple(sheet)) for sheet in spritesheets] +
+                    [(("sound", file_name), _load_sound, (file_name,)) for file_name in sounds])
+        with self.lock:
+            for key, load, args in requests:
+                if key not in self.assets and key not in self.loading:
+                    self.loading[key] = self.executor.submit(self._preload, key, load, args)
+
+    def _preload(self, key, load, args):
+        try:
+            asset, size = load(*args)
+            self._keep(key, asset, size)
+            return asset
+        finally:
+            with self.lock:
+                del self.loading[key]
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"assets": len(self.assets), "bytes": self.size, "budget": self.budget,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": self.hits / requests if requests else 0.0}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+# One cache for the whole game, so every window and restart shares it
+_cache = None
+
+
+def get_assets():
+    global _cache
+    if _cache is None:
+        _cache = AssetCache()
+    return _cache
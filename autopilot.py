@@ -0,0 +1,244 @@
+"""
+Monte Carlo autopilot for MoonLander.py.
+
+Every few ticks the autopilot samples a couple of thousand thrust plans,
+flies all of them at once from the lander's state with BatchSimulation,
+and keeps the one that scores best: touching a LAND tile, softly, with
+the most fuel left. Plans are held keys (nothing, right, left or up, like
+InputService) that change every SEGMENT_TICKS ticks. Part of every batch
+is the last best plan and small changes to it, so a good plan is kept
+and refined instead of found again from scratch.
+
+Planning takes longer than a frame, so it runs in a worker process while
+the lander keeps flying its current plan. A new plan is made for where
+the lander will be once it has flown the ticks it is already committed
+to: those ticks are simulated with the current plan's keys first, and
+the new plan takes over right after them.
+
+Run `python autopilot.py [games]` to see how it scores with no window,
+as a baseline for players' scores.
+"""
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+from constants import STARTING_FUEL, PLAYER_IMAGE_HEIGHT, SPRITE_SCALING_PLAYER, LAND_LAYER, TICK_RATE
+from batch import BatchSimulation
+from mapcache import load_map
+from simulation import (DEFAULT_MAP, THRUST_RIGHT, THRUST_LEFT, THRUST_UP,
+                        LanderSimulation, unpack_keys)
+
+# Plans sampled for every decision, and how far ahead they fly
+CANDIDATES = 2048
+HORIZON_TICKS = 240
+
+# Ticks a plan holds the same keys for
+SEGMENT_TICKS = 15
+
+# Ticks between new plans. Planning has this long to finish.
+REPLAN_TICKS = 15
+
+# Keys a plan segment can hold, and how often each is picked
+ACTIONS = np.array([0, THRUST_RIGHT, THRUST_LEFT, THRUST_UP], dtype=np.uint8)
+ACTION_WEIGHTS = [0.4, 0.15, 0.15, 0.3]
+
+# Share of the candidates made by changing the last best plan
+MUTATED_SHARE = 0.25
+
+# Scoring. A landing beats anything else, the fuel it leaves decides
+# between landings and every pixel per second of touchdown speed costs
+# this much.
+LANDING_BONUS = 10000
+CRASH_PENALTY = -10000
+SPEED_PENALTY = 5
+# Plans that are still flying at the end score by how close they got to a
+# landing pad and how slowly they are moving
+DISTANCE_PENALTY = 2
+
+PLAYER_HALF_HEIGHT = PLAYER_IMAGE_HEIGHT * SPRITE_SCALING_PLAYER / 2
+
+
+class Planner:
+    """ Picks the best of many random thrust plans """
+
+    def __init__(self, tile_map, candidates=CANDIDATES, horizon=HORIZON_TICKS, seed=None,
+                 tick_rate=TICK_RATE):
+        self.candidates = candidates
+        self.horizon = horizon
+        self.segments = -(-horizon // SEGMENT_TICKS)
+        # Rollouts tick at the game's rate, or the plans don't fit the game
+        self.batch = BatchSimulation(candidates, tile_map, tick_rate=tick_rate)
+        self.rng = np.random.default_rng(seed)
+
+        # Where the lander sits when it rests on each landing pad
+        self.pads = np.array([((left + right) / 2, top + PLAYER_HALF_HEIGHT)
+                              for left, bottom, right, top in tile_map.merged_rects(LAND_LAYER)])
+
+    def sample(self, previous=None):
+        """ (candidates, horizon) array of keys, one plan per row """
+        segments = self.rng.choice(ACTIONS, size=(self.candidates, self.segments), p=ACTION_WEIGHTS)
+        plans = np.repeat(segments, SEGMENT_TICKS, axis=1)[:, :self.horizon]
+        if previous is not None:
+            previous = np.frombuffer(previous, dtype=np.uint8)[:self.horizon]
+            mutated = max(1, int(self.candidates * MUTATED_SHARE))
+            plans[:mutated, :len(previous)] = previous
+            plans[:mutated, len(previous):] = 0
+            # Keep the first one as it is, change one segment of the others
+            rows = np.arange(1, mutated)
+            starts = self.rng.integers(0, self.segments, size=len(rows)) * SEGMENT_TICKS
+            actions = self.rng.choice(ACTIONS, size=len(rows), p=ACTION_WEIGHTS)
+            for offset in range(SEGMENT_TICKS):
+                columns = np.minimum(starts + offset, self.horizon - 1)
+                plans[rows, columns] = actions
+        return plans
+
+    def score(self):
+        """ How good the end state of every rollout is """
+        batch = self.batch
+        impact_speed = np.hypot(batch.impact_velocity[:, 0], batch.impact_velocity[:, 1])
+        speed = np.hypot(batch.velocity[:, 0], batch.velocity[:, 1])
+
+        if len(self.pads):
+            offsets = batch.position[:, None, :] - self.pads[None, :, :]
+            distance = np.hypot(offsets[..., 0], offsets[..., 1]).min(axis=1)
+        else:
+            distance = np.zeros(batch.count)
+
+        flying = -distance * DISTANCE_PENALTY - speed * SPEED_PENALTY + batch.fuel
+        scores = np.where(batch.landed, LANDING_BONUS + batch.fuel * 2 - impact_speed * SPEED_PENALTY, flying)
+        scores = np.where(batch.crashed | batch.out_of_bounds, CRASH_PENALTY - distance, scores)
+        return scores
+
+    def plan(self, position, velocity, fuel, committed=b"", previous=None):
+        """
+        Best plan for a lander in this state, to start once it has flown
+        the committed keys. Returns (plan as bytes, its score).
+        """
+        plans = self.sample(previous)
+        batch = self.batch
+        batch.reset(position, velocity)
+        batch.fuel[:] = fuel
+
+        # Every candidate flies the ticks already decided the same way
+        for keys in committed:
+            batch.step(np.uint8(keys))
+        for tick in range(self.horizon):
+            if not batch.active.any():
+                break
+            batch.step(plans[:, tick])
+
+        scores = self.score()
+        best = int(np.argmax(scores))
+        return plans[best].tobytes(), float(scores[best])
+
+
+# The planner of a worker process
+_planner = None
+
+
+def _start_worker(map_name, candidates, horizon, tick_rate):
+    global _planner
+    _planner = Planner(load_map(map_name), candidates, horizon, tick_rate=tick_rate)
+
+
+def _plan_in_worker(state):
+    return _planner.plan(*state)
+
+
+class Autopilot:
+    """
+    Flies a lander. Call next_keys every tick with the lander's state to
+    get the keys to hold for that tick. tick_rate must be the game's.
+    """
+
+    def __init__(self, map_name=DEFAULT_MAP, candidates=CANDIDATES, horizon=HORIZON_TICKS,
+                 replan_ticks=REPLAN_TICKS, processes=1, seed=None, tick_rate=TICK_RATE):
+        self.horizon = horizon
+        self.replan_ticks = replan_ticks
+        self.score = None
+
+        # With no worker processes, plans are made on the spot
+        if processes:
+            self.planner = None
+            self.executor = ProcessPoolExecutor(processes, initializer=_start_worker,
+                                                initargs=(map_name, candidates, horizon, tick_rate))
+        else:
+            self.planner = Planner(load_map(map_name), candidates, horizon, seed, tick_rate)
+            self.executor = None
+
+        # Keys to hold from the next tick on
+        self.plan = None
+        # Plan being made, and ticks until it takes over
+        self.pending = None
+        self.ticks_until_switch = 0
+
+    def _submit(self, state):
+        if self.executor is not None:
+            return self.executor.submit(_plan_in_worker, state)
+        future = Future()
+        future.set_result(self.planner.plan(*state))
+        return future
+
+    def reset(self):
+        """ Forget the current plan, for a new game """
+        if self.pending is not None:
+            self.pending.cancel()
+        self.plan = None
+        self.pending = None
+
+    def next_keys(self, position, velocity, fuel):
+        """ (right, left, up) to hold for the next tick """
+        if self.plan is None:
+            # Nothing to fly yet: wait for a first plan from here
+            self.plan, self.score = self._submit((position, velocity, fuel)).result()
+
+        if self.pending is not None and self.ticks_until_switch == 0:
+            if self.pending.done():
+                self.plan, self.score = self.pending.result()
+            else:
+                # Too slow: the plan is for a moment that has passed, so
+                # keep flying the old one and ask again
+                self.pending.cancel()
+            self.pending = None
+
+        if self.pending is None:
+            committed = self.plan[:self.replan_ticks]
+            previous = self.plan[self.replan_ticks:]
+            self.pending = self._submit((position, velocity, fuel, committed, previous))
+            self.ticks_until_switch = self.replan_ticks
+
+        keys = self.plan[0] if self.plan else 0
+        self.plan = self.plan[1:]
+        self.ticks_until_switch -= 1
+        return unpack_keys(keys)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+def fly(simulation, autopilot, max_ticks=60 * 60):
+    """ Play one headless game with the autopilot and return its score """
+    autopilot.reset()
+    return simulation.run(lambda sim: autopilot.next_keys(sim.position, sim.velocity, sim.lander._fuel),
+                          max_ticks)
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    simulation = LanderSimulation()
+    autopilot = Autopilot(processes=0)
+    scores = []
+    for game in range(games):
+        simulation.setup()
+        score = fly(simulation, autopilot)
+        scores.append(score)
+        result = "landed" if simulation.landed else "crashed" if simulation.crashed else "timed out"
+        print(f"Game {game + 1}: {result}, {score:.0f} points in {simulation.ticks} ticks")
+    print(f"Average {sum(scores) / len(scores):.0f} points of {STARTING_FUEL * 2} possible")
+
+
+if __name__ == "__main__":
+    main()
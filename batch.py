@@ -0,0 +1,169 @@
+"""
+Vectorized Lunar Lander simulation.
+
+Advances many landers at once with NumPy instead of one pymunk space per
+game. Landers don't touch each other and the terrain is a tile grid, so
+the whole update is a handful of array operations per tick.
+
+The integration follows pymunk's order (positions with the old velocity,
+then velocities) with the same gravity, force, mass, damping and speed
+caps as the game. Collisions use the box around the lander's hit box
+against the CRASH and LAND tile grids, so slopes count as whole tiles, and
+a lander stops as soon as it touches either.
+"""
+import numpy as np
+
+from constants import (SPRITE_SCALING_PLAYER,
+                       GRAVITY, DEFAULT_DAMPING, PLAYER_MASS,
+                       PLAYER_MAX_HORIZONTAL_SPEED, PLAYER_MAX_VERTICAL_SPEED,
+                       PLAYER_MOVE_FORCE, STARTING_FUEL, TICK_RATE, FUEL_BURN_RATE,
+                       CRASH_LAYER, LAND_LAYER)
+from hitbox import player_hit_box
+from simulation import DEFAULT_MAP, THRUST_RIGHT, THRUST_LEFT, THRUST_UP, start_position
+from mapcache import load_map
+
+MAX_SPEED = np.array([PLAYER_MAX_HORIZONTAL_SPEED, PLAYER_MAX_VERTICAL_SPEED])
+
+# Bits of the contact grid
+CRASH_CONTACT = 1
+LAND_CONTACT = 2
+
+
+class BatchSimulation:
+    """ Many independent games of Lunar Lander stepped together """
+
+    def __init__(self, count, tile_map=None, map_name=DEFAULT_MAP, damping=DEFAULT_DAMPING,
+                 tick_rate=TICK_RATE):
+        self.count = count
+        self.tile_map = tile_map if tile_map is not None else load_map(map_name)
+
+        # Length of one tick, and the fuel a tick of thrust burns
+        self.time_step = 1 / tick_rate
+        self.fuel_per_tick = FUEL_BURN_RATE * self.time_step
+
+        # The game registers the lander with the engine's default damping,
+        # so that is what we use unless told otherwise.
+        self.damping = damping ** self.time_step
+
+        # Solid cells of each layer, indexed [row, col] with row 0 at the bottom
+        self.crash_grid = np.array(self.tile_map.layers[CRASH_LAYER]) != 0
+        self.land_grid = np.array(self.tile_map.layers[LAND_LAYER]) != 0
+
+        # Box around the lander's hit box, relative to its center
+        points = player_hit_box(SPRITE_SCALING_PLAYER)
+        self.box = (min(x for x, _ in points), min(y for _, y in points),
+                    max(x for x, _ in points), max(y for _, y in points))
+
+        # Both layers as *_CONTACT bits, with a border of empty cells so
+        # boxes off the map can be clamped onto it instead of masked out
+        self.contact_grid = np.pad(self.crash_grid * np.uint8(CRASH_CONTACT) |
+                                   self.land_grid * np.uint8(LAND_CONTACT), 1)
+
+        self.position = None
+        self.velocity = None
+        self.fuel = None
+        self.crashed = None
+        self.landed = None
+        # Velocity each lander had when it crashed or landed
+        self.impact_velocity = None
+        self.ticks = 0
+
+        self.reset()
+
+    def reset(self, position=None, velocity=None):
+        """ Start every game over, by default from the game's start position """
+        self.position = np.empty((self.count, 2))
+        self.position[:] = position if position is not None else start_position()
+        self.velocity = np.zeros((self.count, 2))
+        if velocity is not None:
+            self.velocity[:] = velocity
+        self.fuel = np.full(self.count, STARTING_FUEL, dtype=float)
+        self.crashed = np.zeros(self.count, dtype=bool)
+        self.landed = np.zeros(self.count, dtype=bool)
+        self.impact_velocity = np.zeros((self.count, 2))
+        self.ticks = 0
+
+    @property
+    def active(self):
+        """ Landers that haven't crashed or landed yet """
+        return ~(self.crashed | self.landed)
+
+    @property
+    def score(self):
+        """ Points each game would show: fuel left times two on a landing """
+        return np.where(self.landed, self.fuel * 2, 0)
+
+    @property
+    def out_of_bounds(self):
+        x = self.position[:, 0]
+        return (x < 0) | (x > self.tile_map.pixel_width) | (self.position[:, 1] < 0)
+
+    def step(self, keys):
+        """
+        Advance every game one tick. keys holds one THRUST_* bitmask per
+        lander; like InputService only one thruster fires, right first.
+        """
+        keys = np.asarray(keys)
+        active = self.active
+        can_thrust = active & (self.fuel > 0)
+
+        right = can_thrust & ((keys & THRUST_RIGHT) != 0)
+        left = can_thrust & ~right & ((keys & THRUST_LEFT) != 0)
+        up = can_thrust & ~right & ~left & ((keys & THRUST_UP) != 0)
+        self.fuel -= (right | left | up) * self.fuel_per_tick
+        np.maximum(self.fuel, 0, out=self.fuel)
+
+        acceleration = np.empty((self.count, 2))
+        acceleration[:, 0] = (right.astype(float) - left) * (PLAYER_MOVE_FORCE / PLAYER_MASS)
+        acceleration[:, 1] = up * (PLAYER_MOVE_FORCE / PLAYER_MASS) - GRAVITY
+
+        # Positions move with last tick's velocity, then velocities update.
+        # Stopped landers have no velocity left, so they stay put.
+        self.position += self.velocity * self.time_step
+
+        velocity = self.velocity * self.damping
+        velocity += acceleration * self.time_step
+        np.maximum(velocity, -MAX_SPEED, out=velocity)
+        np.minimum(velocity, MAX_SPEED, out=velocity)
+        velocity[~active] = 0
+        self.velocity = velocity
+
+        contacts = self._contacts()
+        self.crashed |= active & ((contacts & CRASH_CONTACT) != 0)
+        self.landed |= active & ((contacts & LAND_CONTACT) != 0)
+        stopped = active & ~self.active
+        self.impact_velocity[stopped] = velocity[stopped]
+        velocity[stopped] = 0
+        self.ticks += 1
+
+    def _contacts(self):
+        """ *_CONTACT bits of the solid cells each lander's box overlaps """
+        grid = self.contact_grid
+        last_row = grid.shape[0] - 1
+        last_col = grid.shape[1] - 1
+        tile_size = self.tile_map.tile_size
+        x = self.position[:, 0]
+        y = self.position[:, 1]
+
+        # The lander is smaller than a tile, so its box covers at most 2x2
+        # cells. One is added to skip the border.
+        def cells(low, high, last):
+            low = np.floor(low / tile_size).astype(np.int64) + 1
+            high = np.floor(high / tile_size).astype(np.int64) + 1
+            np.clip(low, 0, last, out=low)
+            np.clip(high, 0, last, out=high)
+            return low, high
+
+        box_left, box_bottom, box_right, box_top = self.box
+        left, right = cells(x + box_left, x + box_right, last_col)
+        bottom, top = cells(y + box_bottom, y + box_top, last_row)
+        return grid[bottom, left] | grid[bottom, right] | grid[top, left] | grid[top, right]
+
+    def run(self, policy, max_ticks):
+        """
+        Play every game until they all end or max_ticks pass. policy is
+        called with the batch every tick and returns the keys array.
+        """
+        while self.ticks < max_ticks and self.active.any():
+            self.step(policy(self))
+        return self.score
@@ -0,0 +1,274 @@
+"""
+Headless benchmarks for the Lunar Lander game.
+
+Measures the parts that run without a window:
+
+  * simulation: physics ticks per second of LanderSimulation on moon.tmx
+  * map_load: reading moon.tmx, and loading it again from the map cache
+  * terrain: TerrainIndex queries and physics ticks on synthetic maps from
+    25x20 up to 2000x200 tiles, to show how collision cost grows with
+    map size
+  * batch: lander ticks per second of BatchSimulation rollouts
+
+Every benchmark is run several times and reported as percentiles of the
+time one operation takes. Save the results as a baseline and compare
+later runs against it to catch slowdowns:
+
+    python benchmark.py --save .benchmarks/baseline.json
+    python benchmark.py --compare .benchmarks/baseline.json
+
+Comparing exits with status 1 if any median got slower than the
+tolerance allows.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+from constants import SPRITE_SIZE, CRASH_LAYER, LAND_LAYER
+from batch import BatchSimulation
+from mapcache import load_map
+from simulation import DEFAULT_MAP, THRUST_RIGHT, THRUST_LEFT, THRUST_UP, LanderSimulation
+from terrain import TileMap, TerrainIndex, read_map
+
+# Map sizes, in tiles, for the terrain benchmarks
+MAP_SIZES = [(25, 20), (100, 50), (500, 100), (2000, 200)]
+
+# A median this much slower than the baseline counts as a regression
+DEFAULT_TOLERANCE = 0.15
+
+# Operations timed together in one sample, and samples per benchmark
+SIMULATION_TICKS = 600
+QUERIES = 2000
+BATCH_SIZE = 1024
+BATCH_TICKS = 100
+SAMPLES = 15
+
+
+def percentile(values, fraction):
+    """ Value below which a fraction of the sorted values fall """
+    values = sorted(values)
+    index = fraction * (len(values) - 1)
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def measure(function, operations, samples):
+    """
+    Time function, which does `operations` operations, `samples` times.
+    Returns percentiles of the seconds per operation and operations per
+    second at the median.
+    """
+    # One untimed run so caches and lazy loading don't count
+    function()
+    times = []
+    for _ in range(samples):
+        start_time = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start_time) / operations)
+    median = percentile(times, 0.5)
+    return {"min": min(times),
+            "p50": median,
+            "p90": percentile(times, 0.9),
+            "p99": percentile(times, 0.99),
+            "max": max(times),
+            "per_second": 1 / median if median else float("inf")}
+
+
+def hover(simulation):
+    """ Thrust up while falling fast, so games last and cover some ground """
+    return False, False, simulation.velocity[1] < -40
+
+
+def synthetic_map(width, height, seed=0):
+    """
+    A map of rolling hills: CRASH tiles under the ground line with flat LAND
+    pads on top every so often.
+    """
+    rng = random.Random(seed)
+    crash = np.zeros((height, width), dtype=np.uint32)
+    land = np.zeros((height, width), dtype=np.uint32)
+
+    ground = height // 4
+    col = 0
+    while col < width:
+        ground = max(1, min(height // 2, ground + rng.randint(-2, 2)))
+        pad = rng.random() < 0.15
+        run = rng.randint(3, 6) if pad else 1
+        for pad_col in range(col, min(col + run, width)):
+            crash[:ground, pad_col] = 1
+            if pad:
+                land[ground, pad_col] = 2
+        col += run
+
+    # Both tiles fill their square, so there are no images to read hit boxes from
+    return TileMap(width, height, SPRITE_SIZE, {CRASH_LAYER: crash, LAND_LAYER: land},
+                   {1: "crash.png", 2: "land.png"}, shapes={1: None, 2: None})
+
+
+def bench_simulation(samples):
+    simulation = LanderSimulation()
+
+    def run():
+        simulation.setup()
+        for _ in range(SIMULATION_TICKS):
+            # Keep ticking over the same ground once the game ends
+            if simulation.game_over:
+                simulation.setup()
+            simulation.step(*hover(simulation))
+
+    return {"simulation.tick": measure(run, SIMULATION_TICKS, samples)}
+
+
+def bench_map_load(samples):
+    return {"map_load.tmx": measure(lambda: read_map(DEFAULT_MAP), 1, samples),
+            "map_load.cached": measure(lambda: load_map(DEFAULT_MAP), 1, samples)}
+
+
+def bench_terrain(samples):
+    results = {}
+    for width, height in MAP_SIZES:
+        tile_map = synthetic_map(width, height)
+        name = f"terrain.{width}x{height}"
+        results[f"{name}.index"] = measure(lambda: TerrainIndex(tile_map), 1, max(3, samples // 3))
+
+        index = TerrainIndex(tile_map)
+        rng = random.Random(1)
+        pixel_width = tile_map.pixel_width
+        pixel_height = tile_map.pixel_height
+        points = [(rng.uniform(0, pixel_width), rng.uniform(0, pixel_height)) for _ in range(QUERIES)]
+        # Segments as long as a few ticks of fast flight
+        segments = [(x, y, x + rng.uniform(-200, 200), y + rng.uniform(-200, 200)) for x, y in points]
+
+        def at_point():
+            for x, y in points:
+                index.at_point(x, y)
+
+        def query_rect():
+            for x, y in points:
+                index.query_rect(x - 13, y - 13, x + 13, y + 13)
+
+        def cast_segment():
+            for segment in segments:
+                index.cast_segment(*segment)
+
+        results[f"{name}.at_point"] = measure(at_point, QUERIES, samples)
+        results[f"{name}.query_rect"] = measure(query_rect, QUERIES, samples)
+        results[f"{name}.cast_segment"] = measure(cast_segment, QUERIES, samples)
+
+        # Physics ticks, with the terrain streamed in around the lander
+        simulation = LanderSimulation(tile_map)
+        start = (pixel_width / 2, tile_map.height * 3 / 4 * SPRITE_SIZE)
+
+        def step():
+            simulation.setup(position=start)
+            for _ in range(SIMULATION_TICKS):
+                if simulation.game_over:
+                    simulation.setup(position=start)
+                simulation.step(*hover(simulation))
+
+        results[f"{name}.tick"] = measure(step, SIMULATION_TICKS, samples)
+    return results
+
+
+def bench_batch(samples):
+    batch = BatchSimulation(BATCH_SIZE)
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, (THRUST_RIGHT | THRUST_LEFT | THRUST_UP) + 1,
+                        size=(BATCH_TICKS, BATCH_SIZE), dtype=np.uint8)
+
+    def run():
+        batch.reset()
+        for tick_keys in keys:
+            batch.step(tick_keys)
+
+    return {"batch.lander_tick": measure(run, BATCH_TICKS * BATCH_SIZE, samples)}
+
+
+BENCHMARKS = {"simulation": bench_simulation,
+              "map_load": bench_map_load,
+              "terrain": bench_terrain,
+              "batch": bench_batch}
+
+
+def run_benchmarks(names=None, samples=SAMPLES):
+    results = {}
+    for name in names or BENCHMARKS:
+        results.update(BENCHMARKS[name](samples))
+    return {"python": platform.python_version(),
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results}
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Names of benchmarks whose median got slower than the tolerance allows """
+    regressions = []
+    for name, result in results["results"].items():
+        old = baseline["results"].get(name)
+        if old is not None and result["p50"] > old["p50"] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def report(results, baseline=None):
+    for name, result in results["results"].items():
+        line = (f"{name:36} p50 {format_time(result['p50']):>10}  p90 {format_time(result['p90']):>10}  "
+                f"p99 {format_time(result['p99']):>10}  {result['per_second']:>14,.0f}/s")
+        old = baseline["results"].get(name) if baseline else None
+        if old is not None:
+            line += f"  {result['p50'] / old['p50'] - 1:+.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Lunar Lander benchmarks")
+    parser.add_argument("benchmarks", nargs="*", metavar="BENCHMARK",
+                        help=f"benchmarks to run, all of them by default: {', '.join(BENCHMARKS)}")
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="slowdown of a median that counts as a regression")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = run_benchmarks(args.benchmarks, args.samples)
+    report(results, baseline)
+
+    if args.save:
+        if os.path.dirname(args.save):
+            os.makedirs(os.path.dirname(args.save), exist_ok=True)
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        for name in regressions:
+            print(f"REGRESSION {name}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Scrolling camera for the Lunar Lander game.
+
+The camera keeps the lander inside a margin of the screen, scrolling only
+when it gets closer to an edge than that, and never shows past the edges
+of the map. World drawing happens with the camera's viewport and HUD
+drawing with a fixed screen viewport, so HUD positions never move.
+"""
+import arcade
+
+from constants import (LEFT_VIEWPORT_MARGIN, RIGHT_VIEWPORT_MARGIN,
+                       BOTTOM_VIEWPORT_MARGIN, TOP_VIEWPORT_MARGIN)
+
+
+class Camera:
+    """ Follows a point and knows which part of the world is on screen """
+
+    def __init__(self, width, height, world_width, world_height):
+        self.width = width
+        self.height = height
+        self.world_width = world_width
+        self.world_height = world_height
+        self.left = 0
+        self.bottom = 0
+
+    @property
+    def right(self):
+        return self.left + self.width
+
+    @property
+    def top(self):
+        return self.bottom + self.height
+
+    def follow(self, x, y):
+        """ Scroll just enough to keep a point inside the margins """
+        left = self.left
+        bottom = self.bottom
+
+        if x < left + LEFT_VIEWPORT_MARGIN:
+            left = x - LEFT_VIEWPORT_MARGIN
+        elif x > left + self.width - RIGHT_VIEWPORT_MARGIN:
+            left = x - self.width + RIGHT_VIEWPORT_MARGIN
+        if y < bottom + BOTTOM_VIEWPORT_MARGIN:
+            bottom = y - BOTTOM_VIEWPORT_MARGIN
+        elif y > bottom + self.height - TOP_VIEWPORT_MARGIN:
+            bottom = y - self.height + TOP_VIEWPORT_MARGIN
+
+        # Stay on the map, and on whole pixels so tiles don't shimmer
+        self.left = int(max(0, min(left, self.world_width - self.width)))
+        self.bottom = int(max(0, min(bottom, self.world_height - self.height)))
+
+    def visible(self, left, bottom, right, top):
+        """ True if a box in world pixels is at least partly on screen """
+        return left < self.right and right > self.left and bottom < self.top and top > self.bottom
+
+    def visible_chunks(self, streamer):
+        """ Loaded chunks of a ChunkStreamer that overlap the screen """
+        size = streamer.chunk_size * streamer.tile_map.tile_size
+        chunks = []
+        for chunk_col, chunk_row in streamer.loaded:
+            left = chunk_col * size
+            bottom = chunk_row * size
+            if self.visible(left, bottom, left + size, bottom + size):
+                chunks.append((chunk_col, chunk_row))
+        return chunks
+
+    def use(self):
+        """ Draw the world from where the camera is """
+        arcade.set_viewport(self.left, self.right, self.bottom, self.top)
+
+    def use_screen(self):
+        """ Draw in screen pixels, for the HUD """
+        arcade.set_viewport(0, self.width, 0, self.height)
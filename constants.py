@@ -0,0 +1,95 @@
+"""
+Shared constants for the Lunar Lander game.
+
+These live outside MoonLander.py so the headless simulation can use the
+same numbers without importing arcade.
+"""
+
+SCREEN_TITLE = "Lunar Lander"
+
+# How big are our image tiles?
+SPRITE_IMAGE_SIZE = 64
+
+# Scale sprites up or down
+SPRITE_SCALING_PLAYER = 0.5
+SPRITE_SCALING_TILES = 0.25
+
+# Scaled sprite size for tiles
+SPRITE_SIZE = int(SPRITE_IMAGE_SIZE * SPRITE_SCALING_PLAYER)
+
+# Size of grid to show on screen, in number of tiles
+SCREEN_GRID_WIDTH = 25
+SCREEN_GRID_HEIGHT = 20
+
+# Size of screen to show, in pixels
+SCREEN_WIDTH = SPRITE_SIZE * SCREEN_GRID_WIDTH
+SCREEN_HEIGHT = SPRITE_SIZE * SCREEN_GRID_HEIGHT
+
+# How many pixels to keep as a minimum margin between the lander
+# and the edge of the screen before the camera scrolls.
+LEFT_VIEWPORT_MARGIN = 250
+RIGHT_VIEWPORT_MARGIN = 250
+BOTTOM_VIEWPORT_MARGIN = 150
+TOP_VIEWPORT_MARGIN = 150
+
+# Size of lander.png before scaling, in pixels
+PLAYER_IMAGE_WIDTH = 50
+PLAYER_IMAGE_HEIGHT = 52
+
+# Where the lander starts, in grid cells
+PLAYER_START_GRID_X = 12
+PLAYER_START_GRID_Y = 15
+
+# --- Physics forces. Higher number, faster accelerating.
+
+# Gravity
+GRAVITY = 10
+
+# Damping - Amount of speed lost per second
+DEFAULT_DAMPING = 1.0
+PLAYER_DAMPING = 0.4
+
+# Friction between objects
+PLAYER_FRICTION = 1.0
+WALL_FRICTION = 0.7
+
+# Mass (defaults to 1)
+PLAYER_MASS = 2.0
+
+# Keep player from going too fast
+PLAYER_MAX_HORIZONTAL_SPEED = 450
+PLAYER_MAX_VERTICAL_SPEED = 450
+
+#Player Movement Force
+PLAYER_MOVE_FORCE = 65
+
+# Fuel the lander starts with
+STARTING_FUEL = 500
+
+# Fuel used per second while a thruster fires
+FUEL_BURN_RATE = 60
+
+# Physics ticks per second. The game runs physics at this rate no matter
+# how fast frames are drawn.
+TICK_RATE = 60
+
+# Frames drawn per second, unless the game is told otherwise
+FRAME_RATE = 60
+
+# Length of one physics tick, in seconds
+PHYSICS_TIME_STEP = 1 / TICK_RATE
+
+# Fuel used by one tick of thrust
+FUEL_PER_TICK = FUEL_BURN_RATE * PHYSICS_TIME_STEP
+
+# Most physics ticks to run in one frame when catching up after a slow one.
+# Time beyond that is dropped so a slow frame can't snowball.
+MAX_CATCH_UP_STEPS = 5
+
+# Bump whenever a change above would make old replays play out differently
+CONSTANTS_VERSION = 1
+
+# Names of the map and its layers
+MAP_FILE_NAME = "moon.tmx"
+CRASH_LAYER = "CRASH"
+LAND_LAYER = "LAND"
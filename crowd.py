@@ -0,0 +1,284 @@
+"""
+Many landers flying at once in one pymunk space.
+
+Each lander is a pymunk body, but everything else about it lives in
+arrays indexed by lander number: position, velocity, fuel, whether it
+crashed or landed, and its points. Landers share a shape filter group so
+they fly through each other and only hit the terrain, which is the whole
+map as static shapes, the same ones the game uses.
+
+Who flies them is up to a policy: a function called every tick with the
+crowd that returns one THRUST_* bitmask per lander, like
+BatchSimulation. seek_pad flies every lander towards the nearest landing
+pad, and ReplayPolicy plays recorded games.
+
+Run `python crowd.py [landers]` to time a crowd with no window.
+"""
+import sys
+import time
+
+import numpy as np
+import pymunk
+
+from constants import (SPRITE_SIZE, SPRITE_SCALING_PLAYER, PLAYER_IMAGE_HEIGHT,
+                       GRAVITY, DEFAULT_DAMPING, PLAYER_MASS,
+                       PLAYER_MAX_HORIZONTAL_SPEED, PLAYER_MAX_VERTICAL_SPEED,
+                       PLAYER_MOVE_FORCE, STARTING_FUEL, PHYSICS_TIME_STEP, FUEL_PER_TICK,
+                       CRASH_LAYER, LAND_LAYER)
+from mapcache import load_map
+from simulation import (DEFAULT_MAP, PLAYER_COLLISION_TYPE, CRASH_COLLISION_TYPE, LAND_COLLISION_TYPE,
+                        THRUST_RIGHT, THRUST_LEFT, THRUST_UP, player_shape, start_position)
+from streaming import terrain_shapes
+
+# Shape filter group every lander is in, so landers never hit each other
+LANDER_GROUP = 1
+
+# Landers start this far apart at most, around the game's start position
+START_SPREAD = 8 * SPRITE_SIZE
+
+PLAYER_HALF_HEIGHT = PLAYER_IMAGE_HEIGHT * SPRITE_SCALING_PLAYER / 2
+MAX_SPEED = np.array([PLAYER_MAX_HORIZONTAL_SPEED, PLAYER_MAX_VERTICAL_SPEED])
+
+
+def spread_starts(count, seed=None):
+    """ Start positions spread around the game's start position """
+    rng = np.random.default_rng(seed)
+    positions = np.empty((count, 2))
+    positions[:] = start_position()
+    positions[:, 0] += rng.uniform(-START_SPREAD, START_SPREAD, count)
+    positions[:, 1] += rng.uniform(-SPRITE_SIZE, SPRITE_SIZE, count)
+    return positions
+
+
+class LanderCrowd:
+    """ Many landers over one map, stepped together """
+
+    def __init__(self, count, tile_map=None, map_name=DEFAULT_MAP):
+        self.count = count
+        self.tile_map = tile_map if tile_map is not None else load_map(map_name)
+
+        # Where a lander sits when it rests on each landing pad: x, y
+        self.pads = np.array([((left + right) / 2, top + PLAYER_HALF_HEIGHT)
+                              for left, bottom, right, top in self.tile_map.merged_rects(LAND_LAYER)])
+
+        self.space: pymunk.Space = None
+        self.bodies = []
+        self.shapes = []
+        self.position = None
+        self.velocity = None
+        self.fuel = None
+        self.crashed = None
+        self.landed = None
+        # Landers out of play: not in the space and not flying
+        self.parked = None
+        self.points = None
+        # Per lander multiplier for AI policies, so the crowd doesn't fly in step
+        self.temper = None
+        # Landers that touched the ground during the current tick
+        self.stopping = []
+        self.ticks = 0
+
+    def setup(self, positions=None, seed=None):
+        """ Start every lander over, spread around the start by default """
+        rng = np.random.default_rng(seed)
+        if positions is None:
+            positions = spread_starts(self.count, rng)
+
+        self.space = pymunk.Space()
+        self.space.gravity = (0, -GRAVITY)
+        self.space.damping = DEFAULT_DAMPING
+        # Lots of same sized shapes: a spatial hash beats the default tree
+        self.space.use_spatial_hash(SPRITE_SIZE * 2, self.count * 4)
+
+        # The whole map, with the same shapes as the game
+        for layer_name, collision_type in ((CRASH_LAYER, CRASH_COLLISION_TYPE),
+                                           (LAND_LAYER, LAND_COLLISION_TYPE)):
+            self.space.add(*terrain_shapes(self.space.static_body, self.tile_map,
+                                           self.tile_map.tiles(layer_name), collision_type))
+
+        lander_filter = pymunk.ShapeFilter(group=LANDER_GROUP)
+        self.bodies = []
+        self.shapes = []
+        for index in range(self.count):
+            body = pymunk.Body(PLAYER_MASS, float("inf"))
+            body.position = tuple(positions[index])
+            shape = player_shape(body)
+            shape.filter = lander_filter
+            shape.lander_index = index
+            self.space.add(body, shape)
+            self.bodies.append(body)
+            self.shapes.append(shape)
+
+        handler = self.space.add_collision_handler(PLAYER_COLLISION_TYPE, CRASH_COLLISION_TYPE)
+        handler.begin = self._on_crash
+        handler = self.space.add_collision_handler(PLAYER_COLLISION_TYPE, LAND_COLLISION_TYPE)
+        handler.begin = self._on_land
+
+        self.position = np.array(positions, dtype=float)
+        self.velocity = np.zeros((self.count, 2))
+        self.fuel = np.full(self.count, STARTING_FUEL, dtype=float)
+        self.crashed = np.zeros(self.count, dtype=bool)
+        self.landed = np.zeros(self.count, dtype=bool)
+        self.parked = np.zeros(self.count, dtype=bool)
+        self.points = np.zeros(self.count)
+        self.temper = rng.uniform(0.7, 1.3, self.count)
+        self.stopping = []
+        self.ticks = 0
+
+    def _on_crash(self, arbiter, space, data):
+        index = arbiter.shapes[0].lander_index
+        if self.active[index]:
+            self.crashed[index] = True
+            self.stopping.append(index)
+        return True
+
+    def _on_land(self, arbiter, space, data):
+        index = arbiter.shapes[0].lander_index
+        if self.active[index]:
+            self.landed[index] = True
+            self.points[index] = self.fuel[index] * 2
+            self.stopping.append(index)
+        return True
+
+    @property
+    def active(self):
+        """ Landers that haven't crashed or landed yet """
+        return ~(self.crashed | self.landed | self.parked)
+
+    def park(self, index):
+        """ Take a lander out of play until it respawns """
+        body = self.bodies[index]
+        if body.space is not None:
+            self.space.remove(body, self.shapes[index])
+        self.parked[index] = True
+        self.velocity[index] = 0
+
+    def respawn(self, index, position):
+        """ Put one lander back in play at a position, with a full tank """
+        body = self.bodies[index]
+        body.position = tuple(position)
+        body.velocity = (0, 0)
+        body.force = (0, 0)
+        if body.space is None:
+            self.space.add(body, self.shapes[index])
+        self.position[index] = position
+        self.velocity[index] = 0
+        self.fuel[index] = STARTING_FUEL
+        self.crashed[index] = False
+        self.landed[index] = False
+        self.parked[index] = False
+        self.points[index] = 0
+
+    def step(self, keys):
+        """
+        Advance every lander one tick. keys holds one THRUST_* bitmask per
+        lander; like InputService only one thruster fires, right first.
+        """
+        keys = np.asarray(keys)
+        can_thrust = self.active & (self.fuel > 0)
+        right = can_thrust & ((keys & THRUST_RIGHT) != 0)
+        left = can_thrust & ~right & ((keys & THRUST_LEFT) != 0)
+        up = can_thrust & ~right & ~left & ((keys & THRUST_UP) != 0)
+        thrusting = right | left | up
+        self.fuel -= thrusting * FUEL_PER_TICK
+        np.maximum(self.fuel, 0, out=self.fuel)
+
+        force_x = (right.astype(float) - left) * PLAYER_MOVE_FORCE
+        force_y = up * float(PLAYER_MOVE_FORCE)
+        bodies = self.bodies
+        for index in np.flatnonzero(thrusting).tolist():
+            bodies[index].apply_force_at_local_point((force_x[index], force_y[index]), (0, 0))
+
+        self.space.step(PHYSICS_TIME_STEP)
+
+        self.position[:] = [body.position for body in bodies]
+        self.velocity[:] = [body.velocity for body in bodies]
+
+        # Same speed caps as the game. A velocity callback per body would
+        # cost more than the rest of the step, so the few landers over the
+        # cap are slowed after it instead: they move with the capped
+        # velocity next tick either way.
+        over = np.flatnonzero((np.abs(self.velocity) > MAX_SPEED).any(axis=1))
+        if len(over):
+            np.clip(self.velocity, -MAX_SPEED, MAX_SPEED, out=self.velocity)
+            for index in over.tolist():
+                bodies[index].velocity = tuple(self.velocity[index])
+
+        # Landers that touched down or left the map stop where they are
+        x = self.position[:, 0]
+        lost = self.active & ((x < 0) | (x > self.tile_map.pixel_width) | (self.position[:, 1] < 0))
+        for index in np.flatnonzero(lost).tolist():
+            self.crashed[index] = True
+            self.stopping.append(index)
+        for index in self.stopping:
+            self.space.remove(bodies[index], self.shapes[index])
+            self.velocity[index] = 0
+        self.stopping = []
+        self.ticks += 1
+
+    def run(self, policy, max_ticks):
+        """ Fly until every lander has stopped or max_ticks pass """
+        while self.ticks < max_ticks and self.active.any():
+            self.step(policy(self))
+        return self.points
+
+
+def seek_pad(crowd):
+    """
+    Simple AI for a whole crowd: drift over the nearest landing pad, then
+    come down slower the closer the ground gets.
+    """
+    if not len(crowd.pads):
+        return np.where(crowd.velocity[:, 1] < -40, THRUST_UP, 0).astype(np.uint8)
+
+    x = crowd.position[:, 0]
+    y = crowd.position[:, 1]
+    velocity_x = crowd.velocity[:, 0]
+    velocity_y = crowd.velocity[:, 1]
+    nearest = np.abs(x[:, None] - crowd.pads[None, :, 0]).argmin(axis=1)
+    pad_x = crowd.pads[nearest, 0]
+    pad_y = crowd.pads[nearest, 1]
+
+    wanted_velocity_x = np.clip((pad_x - x) * 0.5, -60, 60) * crowd.temper
+    wanted_velocity_y = -np.clip((y - pad_y) * 0.3, 10, 80) * crowd.temper
+
+    keys = np.where(velocity_x < wanted_velocity_x - 10, THRUST_RIGHT,
+                    np.where(velocity_x > wanted_velocity_x + 10, THRUST_LEFT, 0))
+    # Falling too fast matters more than drifting
+    keys = np.where(velocity_y < wanted_velocity_y, THRUST_UP, keys)
+    return keys.astype(np.uint8)
+
+
+class ReplayPolicy:
+    """ Plays one recorded game per lander """
+
+    def __init__(self, replays):
+        self.replays = replays
+        length = max((len(replay) for replay in replays), default=0)
+        self.keys = np.zeros((len(replays), length + 1), dtype=np.uint8)
+        for index, replay in enumerate(replays):
+            self.keys[index, :len(replay)] = np.frombuffer(bytes(replay.keys), dtype=np.uint8)
+
+    @property
+    def starts(self):
+        return np.array([replay.start for replay in self.replays], dtype=float)
+
+    def __call__(self, crowd):
+        # Past the end of every replay, nothing is held
+        return self.keys[:, min(crowd.ticks, self.keys.shape[1] - 1)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    crowd = LanderCrowd(count)
+    crowd.setup(seed=0)
+    start_time = time.perf_counter()
+    crowd.run(seek_pad, 60 * 60)
+    elapsed = time.perf_counter() - start_time
+    print(f"{count} landers: {crowd.landed.sum()} landed, {crowd.crashed.sum()} crashed, "
+          f"{crowd.active.sum()} still flying after {crowd.ticks} ticks")
+    print(f"{crowd.ticks / elapsed:.0f} ticks per second, best score {crowd.points.max():.0f}")
+
+
+if __name__ == "__main__":
+    main()
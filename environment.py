@@ -0,0 +1,202 @@
+"""
+Reset/step environment around the headless Lunar Lander simulation, for
+training controllers.
+
+LanderEnv plays one game. VectorLanderEnv spreads many games over worker
+processes, which write their observations straight into shared memory so
+nothing but a short command goes through the pipes each step.
+"""
+import multiprocessing
+import os
+import random
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from constants import SPRITE_SIZE, LAND_LAYER
+from simulation import DEFAULT_MAP, LanderSimulation, start_position, unpack_keys
+from mapcache import load_map
+
+# x, y, velocity x, velocity y, fuel, distance to the nearest landing tile
+OBSERVATION_SIZE = 6
+
+# How far from the normal start a seeded game may begin, in pixels
+START_JITTER = 4 * SPRITE_SIZE
+
+# Longest game before it is cut off, in ticks
+DEFAULT_MAX_TICKS = 60 * 60
+
+# Rewards
+CRASH_REWARD = -100
+DISTANCE_REWARD = 0.1
+
+
+class LanderEnv:
+    """ One game of Lunar Lander with reset(seed) and step(action) """
+
+    def __init__(self, tile_map=None, max_ticks=DEFAULT_MAX_TICKS):
+        self.simulation = LanderSimulation(tile_map)
+        self.max_ticks = max_ticks
+        self.random = random.Random()
+        self.distance = self.landing_distance()
+
+    def reset(self, seed=None):
+        """ Start a new game and return its first observation """
+        if seed is not None:
+            self.random.seed(seed)
+        x, y = start_position()
+        x += self.random.uniform(-START_JITTER, START_JITTER)
+        self.simulation.setup(position=(x, y))
+        self.distance = self.landing_distance()
+        return self.observation()
+
+    def step(self, action):
+        """
+        Play one tick. action is a THRUST_* bitmask standing in for the
+        InputService keys. Returns (observation, reward, done, info).
+        """
+        simulation = self.simulation
+        simulation.step(*unpack_keys(action))
+
+        # Reward getting closer to a landing tile, then the landing itself
+        distance = self.landing_distance()
+        reward = (self.distance - distance) * DISTANCE_REWARD
+        self.distance = distance
+
+        if simulation.landed:
+            reward += simulation.score
+        elif simulation.crashed or simulation.out_of_bounds:
+            reward += CRASH_REWARD
+
+        done = simulation.game_over or simulation.out_of_bounds or simulation.ticks >= self.max_ticks
+        info = {"landed": simulation.landed, "crashed": simulation.crashed, "ticks": simulation.ticks}
+        return self.observation(), reward, done, info
+
+    def landing_distance(self):
+        """ Distance from the lander to the closest landing tile """
+        x, y = self.simulation.body.position
+        return self.simulation.terrain.nearest_distance(x, y, LAND_LAYER)
+
+    def observation(self):
+        x, y = self.simulation.body.position
+        velocity_x, velocity_y = self.simulation.body.velocity
+        return (x, y, velocity_x, velocity_y, self.simulation.lander._fuel, self.distance)
+
+
+class _SharedBuffers:
+    """ Observation, action, reward and done arrays in shared memory """
+
+    LAYOUT = (("observations", np.float64, (OBSERVATION_SIZE,)),
+              ("actions", np.uint8, ()),
+              ("rewards", np.float64, ()),
+              ("dones", np.bool_, ()))
+
+    def __init__(self, count, names=None):
+        self.memory = []
+        for index, (name, dtype, shape) in enumerate(self.LAYOUT):
+            shape = (count,) + shape
+            if names is None:
+                size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+                memory = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                memory = shared_memory.SharedMemory(name=names[index])
+            self.memory.append(memory)
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=memory.buf))
+
+    @property
+    def names(self):
+        return [memory.name for memory in self.memory]
+
+    def close(self, unlink=False):
+        for name, _, _ in self.LAYOUT:
+            setattr(self, name, None)
+        for memory in self.memory:
+            memory.close()
+            if unlink:
+                memory.unlink()
+
+
+def _worker(connection, start, stop, count, names, max_ticks):
+    """ Run games start..stop of a VectorLanderEnv until told to close """
+    buffers = _SharedBuffers(count, names)
+    tile_map = load_map(DEFAULT_MAP)
+    envs = [LanderEnv(tile_map, max_ticks) for _ in range(start, stop)]
+
+    while True:
+        command, seed = connection.recv()
+        if command == "reset":
+            for index, env in enumerate(envs, start):
+                buffers.observations[index] = env.reset(None if seed is None else seed + index)
+        elif command == "step":
+            for index, env in enumerate(envs, start):
+                observation, reward, done, _ = env.step(int(buffers.actions[index]))
+                # Finished games start over right away so every slot stays busy
+                if done:
+                    observation = env.reset()
+                buffers.observations[index] = observation
+                buffers.rewards[index] = reward
+                buffers.dones[index] = done
+        elif command == "close":
+            break
+        connection.send(None)
+
+    buffers.close()
+    connection.close()
+
+
+class VectorLanderEnv:
+    """ Many LanderEnvs sharded across a pool of worker processes """
+
+    def __init__(self, count, processes=None, max_ticks=DEFAULT_MAX_TICKS):
+        self.count = count
+        processes = min(processes or os.cpu_count() or 1, count)
+        self.buffers = _SharedBuffers(count)
+
+        self.connections = []
+        self.processes = []
+        bounds = np.linspace(0, count, processes + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, daemon=True,
+                                              args=(child, int(start), int(stop), count,
+                                                    self.buffers.names, max_ticks))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def _send(self, command, seed=None):
+        for connection in self.connections:
+            connection.send((command, seed))
+        for connection in self.connections:
+            connection.recv()
+
+    def reset(self, seed=None):
+        """ Start every game over. Game i is seeded with seed + i. """
+        self._send("reset", seed)
+        return self.buffers.observations.copy()
+
+    def step(self, actions):
+        """
+        Play one tick of every game. Games that end are reset, and their
+        done flag is set for this step. Returns (observations, rewards, dones).
+        """
+        self.buffers.actions[:] = actions
+        self._send("step")
+        return (self.buffers.observations.copy(), self.buffers.rewards.copy(),
+                self.buffers.dones.copy())
+
+    def close(self):
+        if self.processes:
+            for connection in self.connections:
+                connection.send(("close", None))
+            for process in self.processes:
+                process.join()
+            self.processes = []
+            self.buffers.close(unlink=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
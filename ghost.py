@@ -0,0 +1,175 @@
+"""
+Ghosts: where the lander was on every tick of a past game, to race against.
+
+A ghost file is a short header followed by the lander's center on every
+tick as two float32s, so tick n is always at the same offset. The header
+keeps the tick rate the game ran at, and ghosts are drawn by time, so a
+ghost races the player in step whatever rate either was played at. Ghosts are
+opened with mmap and each frame reads the two ticks it draws straight
+from the mapping: nothing is parsed when a ghost loads, and only the
+pages of the ticks being drawn are ever read in, however long the game
+was.
+
+Games save their ghost next to their replay, with the same name and the
+.llg extension. `python ghost.py replays/*.llr` makes ghosts for replays
+that don't have one, by playing them through the headless simulation.
+"""
+import math
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from constants import TICK_RATE
+from replay import REPLAY_EXTENSION, Replay, check_replay
+from simulation import LanderSimulation, unpack_keys
+
+MAGIC = b"LLGH"
+FORMAT_VERSION = 2
+GHOST_EXTENSION = ".llg"
+
+# magic, format version, map hash, ticks, tick rate
+HEADER = struct.Struct("<4sB16sIH")
+# Version 1 had no tick rate and was always played at TICK_RATE
+HEADER_V1 = struct.Struct("<4sB16sI")
+# Padded so the positions start 8 byte aligned
+HEADER_SIZE = 32
+# x, y of one tick
+POSITION = struct.Struct("<2f")
+
+
+def ghost_file_name(replay_file):
+    """ Where the ghost of a replay file is kept """
+    return os.path.splitext(replay_file)[0] + GHOST_EXTENSION
+
+
+def write_ghost(file_name, map_digest, positions, tick_rate=TICK_RATE):
+    """ Save (x, y) lander positions, one per tick of a game played at tick_rate """
+    positions = np.asarray(positions, dtype="<f4").reshape(-1, 2)
+    # Write to a temporary name first so a half written ghost is never loaded
+    temporary_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(temporary_name, "wb") as ghost_file:
+        ghost_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, map_digest, len(positions), tick_rate).ljust(HEADER_SIZE, b"\0"))
+        ghost_file.write(positions.tobytes())
+    os.replace(temporary_name, file_name)
+
+
+class Ghost:
+    """ A ghost file, mapped into memory """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with open(file_name, "rb") as ghost_file:
+            self.mapping = mmap.mmap(ghost_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mapping) < HEADER_SIZE:
+            self.mapping.close()
+            raise ValueError("Ghost is shorter than its header")
+        magic, format_version, self.map_digest, self.ticks = HEADER_V1.unpack_from(self.mapping)
+        if magic != MAGIC:
+            self.mapping.close()
+            raise ValueError("Not a Lunar Lander ghost")
+        if format_version == 1:
+            self.tick_rate = TICK_RATE
+        elif format_version == FORMAT_VERSION:
+            self.tick_rate = HEADER.unpack_from(self.mapping)[4]
+        else:
+            self.mapping.close()
+            raise ValueError(f"Unsupported ghost format version {format_version}")
+        if self.tick_rate == 0:
+            self.mapping.close()
+            raise ValueError("Ghost has no tick rate")
+        if self.ticks == 0 or len(self.mapping) < HEADER_SIZE + self.ticks * POSITION.size:
+            self.mapping.close()
+            raise ValueError(f"Ghost is shorter than its {self.ticks} ticks")
+
+    def __len__(self):
+        return self.ticks
+
+    def position(self, tick):
+        """ (x, y) on a tick, where it ended after the last one """
+        tick = max(0, min(tick, self.ticks - 1))
+        return POSITION.unpack_from(self.mapping, HEADER_SIZE + tick * POSITION.size)
+
+    def position_at(self, seconds):
+        """ (x, y) a time into the game, between the ticks around it """
+        # Tick n is where the lander was once n + 1 ticks had passed
+        tick = seconds * self.tick_rate - 1
+        previous = math.floor(tick)
+        blend = tick - previous
+        previous_x, previous_y = self.position(previous)
+        x, y = self.position(previous + 1)
+        return previous_x + (x - previous_x) * blend, previous_y + (y - previous_y) * blend
+
+    def close(self):
+        self.mapping.close()
+
+
+class GhostRace:
+    """
+    Several ghosts flown together. Ghosts that have finished stay where
+    they ended.
+    """
+
+    def __init__(self, ghosts):
+        self.ghosts = list(ghosts)
+
+    def __len__(self):
+        return len(self.ghosts)
+
+    def positions(self, seconds):
+        """ (x, y) of every ghost a time into the game """
+        return [ghost.position_at(seconds) for ghost in self.ghosts]
+
+    def close(self):
+        for ghost in self.ghosts:
+            ghost.close()
+        self.ghosts = []
+
+
+def load_ghosts(replay_files, map_digest):
+    """ Ghosts of the replay files that have one for this map """
+    ghosts = []
+    for replay_file in replay_files:
+        if not replay_file:
+            continue
+        try:
+            ghost = Ghost(ghost_file_name(replay_file))
+        except (OSError, ValueError, struct.error):
+            continue
+        if ghost.map_digest != map_digest:
+            ghost.close()
+            continue
+        ghosts.append(ghost)
+    return GhostRace(ghosts)
+
+
+def make_ghost(replay_file, simulation=None):
+    """ Play a replay headless and save its ghost """
+    replay = Replay.load(replay_file)
+    check_replay(replay)
+    if simulation is None:
+        simulation = LanderSimulation()
+    simulation.setup(position=replay.start, tick_rate=replay.tick_rate)
+    positions = []
+    for keys in replay.keys:
+        if simulation.game_over:
+            break
+        simulation.step(*unpack_keys(keys))
+        positions.append(simulation.position)
+    file_name = ghost_file_name(replay_file)
+    write_ghost(file_name, replay.map_digest, positions, replay.tick_rate)
+    return file_name
+
+
+def main():
+    simulation = LanderSimulation()
+    for replay_file in sys.argv[1:]:
+        if not replay_file.endswith(REPLAY_EXTENSION) or os.path.exists(ghost_file_name(replay_file)):
+            continue
+        print(make_ghost(replay_file, simulation))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Hit boxes worked out from images, without arcade.
+
+arcade gives a sprite a hit box by trimming the transparent edges and
+corners off its image (its "Simple" hit box). The physics shapes of the
+lander and of the tiles come from here instead, so GameWindow and the
+headless simulation build exactly the same shapes from the same images
+and a game plays out the same in both.
+"""
+import functools
+import os
+
+import numpy as np
+from PIL import Image
+
+PLAYER_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lander.png")
+
+# Share of its square a tile's hit box must cover to count as a full square
+SQUARE_COVERAGE = 0.95
+
+
+def read_alpha(file_name):
+    """ Alpha of every pixel of an image, indexed [row, col] with row 0 at the top """
+    with Image.open(file_name) as image:
+        return np.array(image.convert("RGBA").getchannel("A"))
+
+
+def simple_hit_box(alpha):
+    """
+    Points around the solid pixels of an image, relative to its center
+    and with y up, the same as arcade's "Simple" hit box
+    """
+    height, width = alpha.shape
+    solid = alpha != 0
+    columns = np.flatnonzero(solid.any(axis=0))
+    rows = np.flatnonzero(solid.any(axis=1))
+    if len(rows) == 0:
+        return ()
+    left, right = int(columns[0]), int(columns[-1])
+    top, bottom = int(rows[0]), int(rows[-1])
+
+    def corner_offset(start_x, start_y, x_direction, y_direction):
+        # Grow a triangle from the corner while it is all transparent
+        offset = 0
+        while True:
+            x = start_x
+            y = start_y + offset * y_direction
+            for _ in range(offset + 1):
+                if not (0 <= x < width and 0 <= y < height) or solid[y, x]:
+                    return offset
+                y -= y_direction
+                x += x_direction
+            offset += 1
+
+    top_left = corner_offset(left, top, 1, 1)
+    top_right = corner_offset(right, top, -1, 1)
+    bottom_left = corner_offset(left, bottom, 1, -1)
+    bottom_right = corner_offset(right, bottom, -1, -1)
+
+    def centered(x, y):
+        return x - width / 2, (height - y) - height / 2
+
+    points = [centered(left, bottom + 1 - bottom_left)]
+    if bottom_left:
+        points.append(centered(left + bottom_left, bottom + 1))
+    points.append(centered(right + 1 - bottom_right, bottom + 1))
+    if bottom_right:
+        points.append(centered(right + 1, bottom + 1 - bottom_right))
+    points.append(centered(right + 1, top + top_right))
+    if top_right:
+        points.append(centered(right + 1 - top_right, top))
+    points.append(centered(left + top_left, top))
+    if top_left:
+        points.append(centered(left, top + top_left))
+    return tuple(dict.fromkeys(points))
+
+
+@functools.lru_cache(maxsize=None)
+def image_hit_box(file_name):
+    """ Hit box of an image at its own size, worked out once per image """
+    return simple_hit_box(read_alpha(file_name))
+
+
+def scale_points(points, scale):
+    return tuple((x * scale, y * scale) for x, y in points)
+
+
+@functools.lru_cache(maxsize=None)
+def tile_hit_box(file_name, size):
+    """
+    Hit box of a tile image drawn size pixels wide, or None if it fills
+    its whole square
+    """
+    alpha = read_alpha(file_name)
+    points = scale_points(simple_hit_box(alpha), size / alpha.shape[1])
+    return None if is_square(points, size) else points
+
+
+def player_hit_box(scale):
+    """ The lander's hit box at a sprite scale """
+    return scale_points(image_hit_box(PLAYER_IMAGE), scale)
+
+
+def is_square(points, size):
+    """ True if a hit box fills the whole of a size x size square """
+    area = 0
+    for index, (x1, y1) in enumerate(points):
+        x2, y2 = points[(index + 1) % len(points)]
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2 >= SQUARE_COVERAGE * size * size
@@ -0,0 +1,175 @@
+"""
+Heads up display text that is only rendered when it changes.
+
+arcade.draw_text builds a text image every time it is called. A HudText
+keeps the texture for what it is showing and only makes a new one when
+the text or color changes, and Hud draws every element with one
+SpriteList.draw() call.
+
+FrameGraph draws the recent frame times of a profiler.FrameProfiler.
+"""
+from collections import OrderedDict
+
+import arcade
+
+# How many rendered strings to keep around. Enough for every HUD value a
+# game flips between, small enough that a changing readout can't grow it
+# without bound.
+TEXTURE_CACHE_SIZE = 256
+
+_texture_cache = OrderedDict()
+
+
+def text_texture(text, color, font_size):
+    """ Texture of a line of text, shared by everything that shows it """
+    key = (text, tuple(color), font_size)
+    texture = _texture_cache.get(key)
+    if texture is None:
+        image = arcade.get_text_image(text, color, font_size)
+        texture = arcade.Texture(f"hud-{text}-{color}-{font_size}", image)
+        _texture_cache[key] = texture
+        if len(_texture_cache) > TEXTURE_CACHE_SIZE:
+            _texture_cache.popitem(last=False)
+    else:
+        _texture_cache.move_to_end(key)
+    return texture
+
+
+class HudText:
+    """ One line of text at a fixed spot on the screen """
+
+    def __init__(self, sprite_list, x, y, color, font_size):
+        self.sprite_list = sprite_list
+        self.x = x
+        self.y = y
+        self.color = color
+        self.font_size = font_size
+        self.text = None
+        self.sprite = arcade.Sprite()
+
+    def show(self, text, color=None):
+        """ Show text, rendering it only if it differs from what is shown """
+        color = color or self.color
+        if text != self.text or color != self.color:
+            self.text = text
+            self.color = color
+            self.sprite.texture = text_texture(text, color, self.font_size)
+            self.move_to(self.x, self.y)
+        # Sprites join the batch once they have a texture to draw
+        if not self.sprite.sprite_lists:
+            self.sprite_list.append(self.sprite)
+        if self.sprite.alpha != 255:
+            self.sprite.alpha = 255
+
+    def hide(self):
+        if self.sprite.alpha != 0:
+            self.sprite.alpha = 0
+
+    def move_to(self, x, y):
+        """ Place the bottom left corner of the text """
+        self.x = x
+        self.y = y
+        if self.text is not None:
+            self.sprite.left = x
+            self.sprite.bottom = y
+
+
+class Hud:
+    """ All the HUD text of a game, drawn in one batch """
+
+    def __init__(self):
+        self.sprite_list = arcade.SpriteList()
+        self.elements = {}
+
+    def add(self, name, x, y, color, font_size):
+        element = HudText(self.sprite_list, x, y, color, font_size)
+        self.elements[name] = element
+        return element
+
+    def __getitem__(self, name):
+        return self.elements[name]
+
+    def show(self, name, text, color=None):
+        self.elements[name].show(text, color)
+
+    def hide(self, name):
+        self.elements[name].hide()
+
+    def hide_all(self):
+        for element in self.elements.values():
+            element.hide()
+
+    def draw(self):
+        self.sprite_list.draw()
+
+
+# Line colors of the frame graph's phases, in the order they show up
+GRAPH_COLORS = [arcade.color.ORANGE, arcade.color.SKY_BLUE, arcade.color.LIME_GREEN,
+                arcade.color.VIOLET, arcade.color.YELLOW, arcade.color.PINK]
+
+# Frames between updates of the graph's labels, so the numbers are
+# readable and don't make a new text texture every frame
+LABEL_INTERVAL = 30
+
+
+class FrameGraph:
+    """ Recent frame times of a FrameProfiler, one line per phase """
+
+    def __init__(self, profiler, x, y, width=240, height=80, budget=1 / 60, meter=None):
+        self.profiler = profiler
+        # FrameRateMeter of the frames drawn, shown next to the frame time
+        self.meter = meter
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        # One frame's worth of time. The graph shows up to twice that.
+        self.budget = budget
+        self.labels = Hud()
+        self.frames_drawn = 0
+        self.visible = False
+
+    def _points(self, values):
+        scale = self.height / (self.budget * 2)
+        step = self.width / max(self.profiler.history.maxlen - 1, 1)
+        return [(self.x + index * step, self.y + min(value * scale, self.height))
+                for index, value in enumerate(values)]
+
+    def _update_labels(self):
+        history = self.profiler.history
+        label_y = self.y + self.height - 12
+        average = sum(seconds for seconds, _ in history) / len(history)
+        text = f"frame {average * 1000:.1f} ms"
+        if self.meter is not None:
+            text += f", {self.meter.rate():.0f} of {1 / self.budget:.0f} fps"
+        self._show_label("frame", text, arcade.color.WHITE, label_y)
+        for index, name in enumerate(self.profiler.phase_names):
+            average = sum(phases.get(name, 0.0) for _, phases in history) / len(history)
+            label_y -= 12
+            self._show_label(name, f"{name} {average * 1000:.2f} ms",
+                             GRAPH_COLORS[index % len(GRAPH_COLORS)], label_y)
+
+    def _show_label(self, name, text, color, y):
+        if name not in self.labels.elements:
+            self.labels.add(name, self.x + self.width + 6, y, color, 9)
+        self.labels.show(name, text)
+
+    def draw(self):
+        history = self.profiler.history
+        if len(history) < 2:
+            return
+
+        arcade.draw_lrtb_rectangle_filled(self.x, self.x + self.width, self.y + self.height, self.y,
+                                          (0, 0, 0, 160))
+        budget_y = self.y + self.height / 2
+        arcade.draw_line(self.x, budget_y, self.x + self.width, budget_y, arcade.color.GRAY)
+
+        arcade.draw_line_strip(self._points([seconds for seconds, _ in history]), arcade.color.WHITE)
+        for index, name in enumerate(self.profiler.phase_names):
+            arcade.draw_line_strip(self._points([phases.get(name, 0.0) for _, phases in history]),
+                                   GRAPH_COLORS[index % len(GRAPH_COLORS)])
+
+        if self.frames_drawn % LABEL_INTERVAL == 0:
+            self._update_labels()
+        self.frames_drawn += 1
+        self.labels.draw()
@@ -0,0 +1,22 @@
+"""
+The lander the player flies. Kept free of arcade so it can be shared by
+the game window and the headless simulation.
+"""
+from constants import STARTING_FUEL
+
+
+class Lander:
+    """The Ship the Player controls
+        Stereotype: 
+            Structurer, Service Provider, Information Holder
+    """
+    def __init__(self):
+        self._fuel = STARTING_FUEL
+        self._has_crashed = False
+
+    def get_fuel(self):
+        return self._fuel
+
+    def burn_fuel(self, amount):
+        """ Use up fuel, never going below empty """
+        self._fuel = max(self._fuel - amount, 0)
@@ -0,0 +1,244 @@
+"""
+Render layers that only redraw what changes.
+
+Terrain never moves during a game, yet drawing it as sprites costs one
+quad per tile every frame. A StaticLayer bakes its sprites once into a
+single texture and draws that as one quad. It bakes again only when it is
+marked dirty, which happens when sprites are added or removed, i.e. when
+the map changes. A DynamicLayer draws its SpriteList as usual, for things
+that move. A ParticleLayer draws a ParticlePool as points in one draw
+call, straight from the pool's arrays.
+
+RenderLayers keeps layers by name and draws them in the order they were
+added.
+"""
+import itertools
+
+import arcade
+from arcade.gl import BufferDescription
+import numpy as np
+from PIL import Image
+
+# Gives every baked texture its own name so arcade never reuses an old one
+_bake_count = itertools.count()
+
+
+def _sprite_image(sprite, images):
+    """ A sprite's texture scaled (and turned) to how it is drawn """
+    width = max(1, round(sprite.width))
+    height = max(1, round(sprite.height))
+    key = (sprite.texture.name, width, height, sprite.angle)
+    image = images.get(key)
+    if image is None:
+        image = sprite.texture.image.convert("RGBA")
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.BILINEAR)
+        if sprite.angle:
+            image = image.rotate(sprite.angle, Image.BILINEAR, expand=True)
+        images[key] = image
+    return image
+
+
+def bake_sprites(sprites, name="layer"):
+    """
+    Draw sprites into one image. Returns a sprite showing that image in
+    their place, or None if there is nothing to draw.
+    """
+    images = {}
+    placed = []
+    for sprite in sprites:
+        if sprite.texture is None or sprite.alpha == 0:
+            continue
+        image = _sprite_image(sprite, images)
+        left = round(sprite.center_x - image.width / 2)
+        top = round(sprite.center_y + image.height / 2)
+        placed.append((image, left, top))
+    if not placed:
+        return None
+
+    left = min(image_left for image, image_left, image_top in placed)
+    right = max(image_left + image.width for image, image_left, image_top in placed)
+    top = max(image_top for image, image_left, image_top in placed)
+    bottom = min(image_top - image.height for image, image_left, image_top in placed)
+
+    # Images count rows down from the top, the screen counts up
+    canvas = Image.new("RGBA", (right - left, top - bottom), (0, 0, 0, 0))
+    for image, image_left, image_top in placed:
+        canvas.alpha_composite(image, (image_left - left, top - image_top))
+
+    baked = arcade.Sprite()
+    baked.texture = arcade.Texture(f"baked-{name}-{next(_bake_count)}", canvas)
+    baked.center_x = (left + right) / 2
+    baked.center_y = (bottom + top) / 2
+    return baked
+
+
+class StaticLayer:
+    """ Sprites that don't move, drawn from one baked texture """
+
+    def __init__(self, name, sprites=None):
+        self.name = name
+        self.sprites = list(sprites or [])
+        self.dirty = True
+        self.baked = arcade.SpriteList()
+
+    def add(self, sprite):
+        self.sprites.append(sprite)
+        self.dirty = True
+
+    def extend(self, sprites):
+        self.sprites.extend(sprites)
+        self.dirty = True
+
+    def remove(self, sprite):
+        self.sprites.remove(sprite)
+        self.dirty = True
+
+    def mark_dirty(self):
+        """ Bake again before the next draw """
+        self.dirty = True
+
+    def bake(self):
+        self.baked = arcade.SpriteList()
+        sprite = bake_sprites(self.sprites, self.name)
+        if sprite is not None:
+            self.baked.append(sprite)
+        self.dirty = False
+
+    def draw(self):
+        if self.dirty:
+            self.bake()
+        self.baked.draw()
+
+
+class DynamicLayer:
+    """ Sprites that move, drawn as they are every frame """
+
+    def __init__(self, name, sprite_list):
+        self.name = name
+        self.sprite_list = sprite_list
+
+    def mark_dirty(self):
+        pass
+
+    def draw(self):
+        self.sprite_list.draw()
+
+
+PARTICLE_VERTEX_SHADER = """
+#version 330
+
+uniform Projection {
+    uniform mat4 matrix;
+} proj;
+
+in vec2 in_position;
+in vec4 in_color;
+in float in_size;
+
+out vec4 v_color;
+
+void main() {
+    gl_Position = proj.matrix * vec4(in_position, 0.0, 1.0);
+    gl_PointSize = in_size;
+    v_color = in_color;
+}
+"""
+
+PARTICLE_FRAGMENT_SHADER = """
+#version 330
+
+in vec4 v_color;
+out vec4 out_color;
+
+void main() {
+    // Round, soft edged points
+    float distance = length(gl_PointCoord - vec2(0.5));
+    if (distance > 0.5) {
+        discard;
+    }
+    out_color = vec4(v_color.rgb, v_color.a * (1.0 - distance * 2.0));
+}
+"""
+
+
+class ParticleLayer:
+    """
+    The live particles of a ParticlePool, drawn as glowing points. The
+    GPU buffer holds the whole pool and gets the live part every frame.
+    """
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        ctx = arcade.get_window().ctx
+        self.program = ctx.program(vertex_shader=PARTICLE_VERTEX_SHADER,
+                                   fragment_shader=PARTICLE_FRAGMENT_SHADER)
+        self.buffer = ctx.buffer(reserve=pool.vertices.nbytes, usage="stream")
+        self.geometry = ctx.geometry([BufferDescription(self.buffer, "2f 4f1 f",
+                                                        ["in_position", "in_color", "in_size"],
+                                                        normalized=["in_color"])])
+
+    def mark_dirty(self):
+        pass
+
+    def draw(self):
+        count = self.pool.count
+        if not count:
+            return
+        self.buffer.write(self.pool.vertices[:count].view(np.uint8))
+        ctx = self.program.ctx
+        ctx.enable(ctx.BLEND, ctx.PROGRAM_POINT_SIZE)
+        ctx.blend_func = ctx.BLEND_ADDITIVE
+        self.geometry.render(self.program, mode=ctx.POINTS, vertices=count)
+        ctx.blend_func = ctx.BLEND_DEFAULT
+        ctx.disable(ctx.PROGRAM_POINT_SIZE)
+
+
+class RenderLayers:
+    """ Named layers drawn in the order they were added """
+
+    def __init__(self):
+        self.layers = {}
+
+    def add_static(self, name, sprites=None):
+        layer = StaticLayer(name, sprites)
+        self.layers[name] = layer
+        return layer
+
+    def add_dynamic(self, name, sprite_list):
+        layer = DynamicLayer(name, sprite_list)
+        self.layers[name] = layer
+        return layer
+
+    def add_particles(self, name, pool):
+        layer = ParticleLayer(name, pool)
+        self.layers[name] = layer
+        return layer
+
+    def __getitem__(self, name):
+        return self.layers[name]
+
+    def __contains__(self, name):
+        return name in self.layers
+
+    def remove(self, name):
+        self.layers.pop(name, None)
+
+    def clear(self):
+        self.layers.clear()
+
+    def mark_dirty(self, name=None):
+        """ Bake one layer again, or all of them when the map changes """
+        layers = [self.layers[name]] if name is not None else self.layers.values()
+        for layer in layers:
+            layer.mark_dirty()
+
+    def draw(self, names=None):
+        """ Draw every layer, or only the named ones """
+        if names is None:
+            layers = self.layers.values()
+        else:
+            layers = [self.layers[name] for name in names if name in self.layers]
+        for layer in layers:
+            layer.draw()
@@ -0,0 +1,295 @@
+"""
+Scores of finished games, kept in SQLite.
+
+Every game that ends is one row in the runs table: who flew it, a hash of
+the map, the score, the fuel left, how long it took and the replay file it
+was saved to, with its ghost next to it. A second table keeps each player's best landing per map, so
+the top scores are read straight off an index instead of grouping every
+run. A third counts the players whose best falls on each whole point of
+score, so a rank adds up at most a thousand counts and the players in
+one point, however many players there are.
+
+The game must not wait for the disk when it ends, so submit() only puts
+the run on a queue. A writer thread saves the replay and ghost, then writes
+every run waiting on the queue in one transaction. The database is in WAL
+mode, so the game can read the leaderboard while the writer is writing.
+
+Run `python leaderboard.py` to see the best scores on moon.tmx, or
+`python leaderboard.py --bench` to time the queries on a large board.
+"""
+import argparse
+import getpass
+import os
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from ghost import ghost_file_name, write_ghost
+from replay import save_replay
+from simulation import DEFAULT_MAP
+from terrain import map_hash
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "leaderboard.db")
+
+# Longest the writer waits for more runs before writing what it has, and
+# most runs written in one transaction
+FLUSH_SECONDS = 0.25
+BATCH_SIZE = 256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    player TEXT NOT NULL,
+    map_hash BLOB NOT NULL,
+    score REAL NOT NULL,
+    fuel REAL NOT NULL,
+    ticks INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    landed INTEGER NOT NULL,
+    replay TEXT,
+    finished REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS best (
+    map_hash BLOB NOT NULL,
+    player TEXT NOT NULL,
+    score REAL NOT NULL,
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    PRIMARY KEY (map_hash, player)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS best_by_score ON best (map_hash, score DESC, run_id);
+CREATE TABLE IF NOT EXISTS score_counts (
+    map_hash BLOB NOT NULL,
+    points INTEGER NOT NULL,
+    players INTEGER NOT NULL,
+    PRIMARY KEY (map_hash, points)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_by_player ON runs (player, finished);
+"""
+
+INSERT_RUN = """
+INSERT INTO runs (player, map_hash, score, fuel, ticks, seconds, landed, replay, finished)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SET_BEST = "INSERT OR REPLACE INTO best (map_hash, player, score, run_id) VALUES (?, ?, ?, ?)"
+
+COUNT_SCORE = """
+INSERT INTO score_counts (map_hash, points, players) VALUES (?1, ?2, ?3)
+ON CONFLICT (map_hash, points) DO UPDATE SET players = players + ?3
+"""
+
+TOP = """
+SELECT best.player, best.score, runs.fuel, runs.seconds, runs.replay, runs.finished
+FROM best JOIN runs ON runs.id = best.run_id
+WHERE best.map_hash = ?
+ORDER BY best.score DESC, best.run_id
+LIMIT ?
+"""
+
+PLAYER_BEST = "SELECT score, run_id FROM best WHERE map_hash = ? AND player = ?"
+
+# Players ahead of a score: on a higher whole point, higher on the same
+# point, or as high but earlier
+AHEAD = """
+SELECT (SELECT COALESCE(SUM(players), 0) FROM score_counts WHERE map_hash = ?1 AND points > ?4) +
+       (SELECT COUNT(*) FROM best WHERE map_hash = ?1 AND score > ?2 AND score < ?4 + 1) +
+       (SELECT COUNT(*) FROM best WHERE map_hash = ?1 AND score = ?2 AND run_id < ?3)
+"""
+
+
+def connect(file_name):
+    """ A connection to the leaderboard, with the tables made if missing """
+    connection = sqlite3.connect(file_name)
+    connection.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode a commit is safe from corruption without a sync, it can
+    # only lose the last few runs if the computer loses power
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def default_player():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "player"
+
+
+class Run:
+    """ One finished game """
+
+    def __init__(self, map_digest, score, fuel, ticks, seconds, landed,
+                 player=None, replay=None, replay_directory=None, ghost=None):
+        self.map_digest = map_digest
+        self.score = score
+        self.fuel = fuel
+        self.ticks = ticks
+        self.seconds = seconds
+        self.landed = landed
+        self.player = player or default_player()
+        # The replay, and where to save it. The writer saves it and keeps
+        # its file name.
+        self.replay = replay
+        self.replay_directory = replay_directory
+        # The lander's position on every tick, saved next to the replay
+        self.ghost = ghost
+        self.replay_file = None
+        self.finished = time.time()
+
+
+class Leaderboard:
+    """ Best scores per map, written on a background thread """
+
+    def __init__(self, file_name=DEFAULT_DATABASE):
+        self.file_name = file_name
+        # Reads are on the thread that made the leaderboard, writes on the
+        # writer thread, each with its own connection
+        self.connection = connect(file_name)
+        self.queue = queue.Queue()
+        self.written = 0
+        self.error = None
+        self.writer = threading.Thread(target=self._write_runs, name="leaderboard", daemon=True)
+        self.writer.start()
+
+    def submit(self, run):
+        """ Store a finished game. Returns at once; the writer does the rest. """
+        self.queue.put(run)
+
+    def flush(self):
+        """ Wait until every submitted run is written """
+        self.queue.join()
+
+    def close(self):
+        """ Write what is left and stop the writer """
+        self.queue.put(None)
+        self.writer.join()
+        self.connection.close()
+
+    def _write_runs(self):
+        connection = connect(self.file_name)
+        running = True
+        while running:
+            runs = [self.queue.get()]
+            # Wait a little for more, so many runs share a transaction
+            deadline = time.monotonic() + FLUSH_SECONDS
+            while runs[-1] is not None and len(runs) < BATCH_SIZE:
+                try:
+                    runs.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if runs[-1] is None:
+                runs.pop()
+                running = False
+            try:
+                self._write(connection, runs)
+            except Exception as error:
+                # Losing a score must not take the game down with it
+                self.error = error
+                print(f"Leaderboard: could not save {len(runs)} runs: {error}", file=sys.stderr)
+            for _ in range(len(runs) + (not running)):
+                self.queue.task_done()
+        connection.close()
+
+    def _write(self, connection, runs):
+        for run in runs:
+            if run.replay is not None and run.replay_directory is not None:
+                run.replay_file = save_replay(run.replay, run.replay_directory)
+                if run.ghost is not None:
+                    write_ghost(ghost_file_name(run.replay_file), run.map_digest, run.ghost,
+                                run.replay.tick_rate)
+        with connection:
+            for run in runs:
+                cursor = connection.execute(INSERT_RUN, (
+                    run.player, run.map_digest, run.score, run.fuel, run.ticks,
+                    run.seconds, int(run.landed), run.replay_file, run.finished))
+                if run.landed:
+                    self._update_best(connection, run, cursor.lastrowid)
+        self.written += len(runs)
+
+    def _update_best(self, connection, run, run_id):
+        """ Keep a player's best landing, the earliest one on a tie """
+        old = connection.execute(PLAYER_BEST, (run.map_digest, run.player)).fetchone()
+        if old is not None and run.score <= old[0]:
+            return
+        if old is not None:
+            connection.execute(COUNT_SCORE, (run.map_digest, int(old[0]), -1))
+        connection.execute(COUNT_SCORE, (run.map_digest, int(run.score), 1))
+        connection.execute(SET_BEST, (run.map_digest, run.player, run.score, run_id))
+
+    def top(self, map_digest, count=10):
+        """ Best landing of the count best players on a map, best first """
+        return self.connection.execute(TOP, (map_digest, count)).fetchall()
+
+    def best(self, map_digest, player=None):
+        """ A player's best score on a map, None if they never landed there """
+        row = self.connection.execute(PLAYER_BEST, (map_digest, player or default_player())).fetchone()
+        return row[0] if row else None
+
+    def rank(self, map_digest, player=None):
+        """ A player's place on a map, 1 for the best, None if they never landed there """
+        row = self.connection.execute(PLAYER_BEST, (map_digest, player or default_player())).fetchone()
+        if row is None:
+            return None
+        score, run_id = row
+        ahead = self.connection.execute(AHEAD, (map_digest, score, run_id, int(score))).fetchone()[0]
+        return ahead + 1
+
+
+def bench(players=100000, queries=1000):
+    """ Fill a new board with random players and time its queries """
+    rng = random.Random(0)
+    digest = map_hash(DEFAULT_MAP)
+    directory = tempfile.TemporaryDirectory()
+    leaderboard = Leaderboard(os.path.join(directory.name, "bench.db"))
+    start_time = time.perf_counter()
+    for number in range(players):
+        fuel = rng.uniform(0, 500)
+        leaderboard.submit(Run(digest, fuel * 2, fuel, 600, 10.0, True, player=f"player{number}"))
+    submitted = time.perf_counter() - start_time
+    leaderboard.flush()
+    written = time.perf_counter() - start_time
+    print(f"{players} runs: submitted in {submitted * 1e6 / players:.2f} us each, "
+          f"all written after {written:.2f} s")
+
+    names = [f"player{rng.randrange(players)}" for _ in range(queries)]
+    for name, query in (("top 10", lambda player: leaderboard.top(digest, 10)),
+                        ("rank", lambda player: leaderboard.rank(digest, player))):
+        times = []
+        for player in names:
+            query_start = time.perf_counter()
+            query(player)
+            times.append(time.perf_counter() - query_start)
+        times.sort()
+        print(f"{name}: median {times[len(times) // 2] * 1e3:.3f} ms, "
+              f"p99 {times[int(len(times) * 0.99)] * 1e3:.3f} ms")
+    leaderboard.close()
+    directory.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Best scores of MoonLander.py")
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--map", default=DEFAULT_MAP, help="map to show the scores of")
+    parser.add_argument("--top", type=int, default=10, metavar="N")
+    parser.add_argument("--bench", metavar="PLAYERS", type=int, nargs="?", const=100000,
+                        help="time the queries on a new board of this many players")
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.bench)
+        return
+
+    leaderboard = Leaderboard(args.database)
+    for place, (player, score, fuel, seconds, replay_file, finished) in enumerate(
+            leaderboard.top(map_hash(args.map), args.top), 1):
+        day = time.strftime("%Y-%m-%d", time.localtime(finished))
+        print(f"{place:3}. {player:20} {score:6.0f}  {seconds:6.1f} s  {day}  {replay_file or ''}")
+    leaderboard.close()
+
+
+if __name__ == "__main__":
+    main()
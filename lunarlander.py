@@ -2,6 +2,10 @@
 import arcade
 import math
 
+from assets import get_assets
+from hud import Hud
+from layers import RenderLayers
+
 SPRITE_SCALING = 0.5
 
 SCREEN_WIDTH = 1000
@@ -27,6 +31,13 @@ INSTRUCTIONS_PAGE_1 = 1
 GAME_RUNNING = 2
 GAME_OVER = 3
 
+# Images and sounds, loaded on first use and kept between games
+PLAYER_IMAGE = ":resources:images/space_shooter/playerShip3_orange.png"
+WALL_IMAGE = ":resources:images/tiles/grassMid.png"
+# Sprite sheet, frame width and height, columns and frames
+EXPLOSION_SHEET = (":resources:images/spritesheets/explosion.png", 256, 256, 16, 60)
+HIT_SOUND = ":resources:sounds/explosion2.wav"
+
 
 class Explosion(arcade.Sprite):
     """ This class creates an explosion animation """
@@ -52,7 +63,7 @@ class Explosion(arcade.Sprite):
 class Player(arcade.Sprite):
     """ Player class """
 
-    def __init__(self, image, scale):
+    def __init__(self, image=None, scale=1):
         """ Set up the player """
 
         # Call the parent init
@@ -93,19 +104,16 @@ class MyGame(arcade.Window):
         self.moving_wall_list = None
         self.floor_list = None
         self.explosions_list = None
-        self.explosion_texture_list = []
 
-        columns = 16
-        count = 60
-        sprite_width = 256
-        sprite_height = 256
-        file_name = ":resources:images/spritesheets/explosion.png"
+        # Layers to draw, the non-moving walls baked into one texture
+        self.layers = None
 
-        # Load the explosions from a sprite sheet
-        self.explosion_texture_list = arcade.load_spritesheet(
-            file_name, sprite_width, sprite_height, columns, count)
-        self.hit_sound = arcade.sound.load_sound(
-            ":resources:sounds/explosion2.wav")
+        # Textures and sounds are shared by every game. The explosion and
+        # its sound load in the background while the instructions show.
+        self.assets = get_assets()
+        self.assets.preload(textures=[PLAYER_IMAGE, WALL_IMAGE],
+                            spritesheets=[EXPLOSION_SHEET],
+                            sounds=[HIT_SOUND])
 
         self.player_list = None
 
@@ -120,12 +128,18 @@ class MyGame(arcade.Window):
         # Start 'state' will be showing the first page of instructions.
         self.current_state = INSTRUCTIONS_PAGE_0
         self.instructions = []
-        texture = arcade.load_texture("game_over_PNG57.png")
+        texture = self.assets.texture("game_over_PNG57.png")
         self.instructions.append(texture)
 
-        texture = arcade.load_texture("275-2755358_play-again-button-png-clip-art.png")
+        texture = self.assets.texture("275-2755358_play-again-button-png-clip-art.png")
         self.instructions.append(texture)
 
+        # Text on the screen, rendered only when it changes
+        self.hud = Hud()
+        self.hud.add("distance", 10, 20, arcade.color.WHITE, 14)
+        self.hud.add("game_over", 240, 400, arcade.color.WHITE, 54)
+        self.hud.add("restart", 310, 300, arcade.color.WHITE, 24)
+
     def setup(self):
         """ Set up the game and initialize the variables. """
 
@@ -136,26 +150,24 @@ class MyGame(arcade.Window):
         self.player_list = arcade.SpriteList()
         self.explosions_list = arcade.SpriteList()
         self.floor_list = arcade.SpriteList()
+        self.layers = RenderLayers()
 
         # Set up the player
-        self.player_sprite = Player(
-            ":resources:images/space_shooter/playerShip3_orange.png", SPRITE_SCALING)
+        self.player_sprite = self.assets.sprite(PLAYER_IMAGE, SPRITE_SCALING, Player)
         self.player_sprite.center_x = 500
         self.player_sprite.center_y = 600
         self.player_list.append(self.player_sprite)
 
         # Create floor
         for i in range(30):
-            wall = arcade.Sprite(
-                ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+            wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
             wall.bottom = 0
             wall.center_x = i * GRID_PIXEL_SIZE
             self.static_wall_list.append(wall)
             self.floor_list.append(wall)
 
         # Create platform side to side
-        wall = arcade.Sprite(
-            ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+        wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
         wall.center_y = 2 * GRID_PIXEL_SIZE
         wall.center_x = 5 * GRID_PIXEL_SIZE
 
@@ -163,16 +175,14 @@ class MyGame(arcade.Window):
         self.moving_wall_list.append(wall)
 
         # Create platform side to side
-        wall = arcade.Sprite(
-            ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+        wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
         wall.center_y = 2 * GRID_PIXEL_SIZE
         wall.center_x = 8 * GRID_PIXEL_SIZE
 
         self.all_wall_list.append(wall)
         self.moving_wall_list.append(wall)
 
-        wall = arcade.Sprite(
-            ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+        wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
         wall.center_y = 4 * GRID_PIXEL_SIZE
         wall.center_x = 7 * GRID_PIXEL_SIZE
 
@@ -180,16 +190,14 @@ class MyGame(arcade.Window):
         self.moving_wall_list.append(wall)
 
         # second one
-        wall = arcade.Sprite(
-            ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+        wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
         wall.center_y = 6 * GRID_PIXEL_SIZE
         wall.center_x = 10 * GRID_PIXEL_SIZE
 
         self.all_wall_list.append(wall)
         self.moving_wall_list.append(wall)
 
-        wall = arcade.Sprite(
-            ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+        wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
         wall.center_y = 4 * GRID_PIXEL_SIZE
         wall.center_x = 9 * GRID_PIXEL_SIZE
 
@@ -197,8 +205,7 @@ class MyGame(arcade.Window):
         self.moving_wall_list.append(wall)
 
         # Create platform side to side first one
-        wall = arcade.Sprite(
-            ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+        wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
         wall.center_y = 5 * GRID_PIXEL_SIZE
         wall.center_x = 5 * GRID_PIXEL_SIZE
         # wall.boundary_left = 2 * GRID_PIXEL_SIZE
@@ -208,14 +215,20 @@ class MyGame(arcade.Window):
         self.all_wall_list.append(wall)
         self.moving_wall_list.append(wall)
 
-        wall = arcade.Sprite(
-            ":resources:images/tiles/grassMid.png", SPRITE_SCALING)
+        wall = self.assets.sprite(WALL_IMAGE, SPRITE_SCALING)
         wall.center_y = 7 * GRID_PIXEL_SIZE
         wall.center_x = 7 * GRID_PIXEL_SIZE
 
         self.all_wall_list.append(wall)
         self.moving_wall_list.append(wall)
 
+        # The walls that never move are baked into one texture. The floor
+        # is part of them, so it isn't drawn again on its own.
+        self.layers.add_static("static_walls", self.static_wall_list)
+        self.layers.add_dynamic("moving_walls", self.moving_wall_list)
+        self.layers.add_dynamic("player", self.player_list)
+        self.layers.add_dynamic("explosions", self.explosions_list)
+
         self.physics_engine = \
             arcade.PhysicsEnginePlatformer(self.player_sprite,
                                            self.floor_list,
@@ -247,10 +260,10 @@ class MyGame(arcade.Window):
         Draw "Game over" across the screen.
         """
         output = "Game Over"
-        arcade.draw_text(output, 240, 400, arcade.color.WHITE, 54)
+        self.hud.show("game_over", output)
 
         output = "Click to restart"
-        arcade.draw_text(output, 310, 300, arcade.color.WHITE, 24)
+        self.hud.show("restart", output)
 
     def draw_game(self):
         """
@@ -260,32 +273,38 @@ class MyGame(arcade.Window):
         # This command has to happen before we start drawing
 
         # Draw the sprites.
-        self.static_wall_list.draw()
-        self.moving_wall_list.draw()
-        self.floor_list.draw()
-        self.player_list.draw()
-        self.explosions_list.draw()
+        self.layers.draw()
 
         # Put the text on the screen.
         # Adjust the text position based on the viewport so that we don't
         # scroll the text too.
         distance = self.player_sprite.right
         output = f"Distance: {distance}"
-        arcade.draw_text(output, self.view_left + 10, self.view_bottom + 20,
-                         arcade.color.WHITE, 14)
+        self.hud["distance"].move_to(self.view_left + 10, self.view_bottom + 20)
+        self.hud.show("distance", output)
 
     def on_draw(self):
         arcade.start_render()
-        if self.current_state == INSTRUCTIONS_PAGE_1:
+        if self.current_state == INSTRUCTIONS_PAGE_0:
+            # The game isn't set up until the instructions are read
+            self.hud.hide_all()
+            self.draw_instructions_page(0)
+
+        elif self.current_state == INSTRUCTIONS_PAGE_1:
+            self.hud.hide_all()
             self.draw_instructions_page(1)
 
         elif self.current_state == GAME_RUNNING:
+            self.hud.hide("game_over")
+            self.hud.hide("restart")
             self.draw_game()
 
         else:
             self.draw_game()
             self.draw_game_over()
 
+        self.hud.draw()
+
 
     def on_key_press(self, key, modifiers):
         """
@@ -314,6 +333,9 @@ class MyGame(arcade.Window):
         """
         Called when the user presses a mouse button.
         """
+        if self.player_sprite is None:
+            # Still on the instructions
+            return
         if key == arcade.key.UP or key == arcade.key.DOWN:
             self.player_sprite.speed = 0
         elif key == arcade.key.LEFT or key == arcade.key.RIGHT:
@@ -332,7 +354,7 @@ class MyGame(arcade.Window):
                     walls, self.player_list)
 
                 if len(hit_list) > 0:
-                    explosion = Explosion(self.explosion_texture_list)
+                    explosion = Explosion(self.assets.spritesheet(*EXPLOSION_SHEET))
                     explosion.center_x = hit_list[0].center_x
                     explosion.center_y = hit_list[0].center_y
                     explosion.update()
@@ -344,13 +366,14 @@ class MyGame(arcade.Window):
                     player.remove_from_sprite_lists()
                     self.current_state = GAME_OVER
 
-                    arcade.sound.play_sound(self.hit_sound)
+                    arcade.sound.play_sound(self.assets.sound(HIT_SOUND))
 
 
 def main():
     """ Main method """
-    window = MyGame(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
-    window.setup()
+    # The game is set up when the instructions are done with, while the
+    # explosion and its sound preload in the background
+    MyGame(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
     arcade.run()
 
 
@@ -0,0 +1,188 @@
+"""
+Compiled map cache.
+
+Parsing a TMX file means reading its XML, the whole tileset and the CSV
+layer data. compile_map does that once and writes a binary file with:
+
+  * a small JSON header: map size, the tileset images (each listed once)
+    and the hit boxes of the tiles that don't fill their square
+  * one uint32 tile id grid per layer, stored raw so it can be memory
+    mapped instead of read
+
+load_map keeps compiled maps in a cache folder, named after a hash of the
+TMX file, and only compiles a map again when its contents change. Hashing
+means reading the whole TMX file, so an index in the cache folder keeps
+what each file hashed to under its size and modification time, and a map
+is only hashed again once those change.
+
+Run `python mapcache.py <maps>` to fill the cache ahead of time.
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+from constants import SPRITE_SCALING_TILES
+from terrain import TileMap, read_map
+
+MAGIC = b"LLMAP"
+FORMAT_VERSION = 3
+CACHE_EXTENSION = ".llmap"
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".mapcache")
+
+# Layer grids start on this boundary so they can be mapped directly
+ALIGNMENT = 64
+
+# magic, format version, header length
+PREFIX = struct.Struct("<5sBI")
+
+# Map file -> its size and modification time, map_hash and compiled files
+INDEX_NAME = "index.json"
+
+
+def _read_index(cache_directory):
+    try:
+        with open(os.path.join(cache_directory, INDEX_NAME)) as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(cache_directory, index):
+    file_name = os.path.join(cache_directory, INDEX_NAME)
+    temporary_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(temporary_name, "w") as index_file:
+        json.dump(index, index_file)
+    os.replace(temporary_name, file_name)
+
+
+def _cache_entry(map_name, scaling, cache_directory):
+    """
+    map_hash of a map file and the compiled file for a scaling, compiling
+    it if needed. The TMX file is only read when the index doesn't know it
+    as it is now.
+    """
+    map_name = os.path.abspath(map_name)
+    status = os.stat(map_name)
+    stamp = [status.st_size, status.st_mtime_ns]
+    index = _read_index(cache_directory)
+    entry = index.get(map_name)
+    if entry is None or entry["stamp"] != stamp:
+        entry = {"stamp": stamp, "digest": None, "files": {}}
+
+    key = f"{FORMAT_VERSION}:{scaling}"
+    file_name = entry["files"].get(key)
+    if file_name is not None and os.path.exists(os.path.join(cache_directory, file_name)):
+        return bytes.fromhex(entry["digest"]), os.path.join(cache_directory, file_name)
+
+    with open(map_name, "rb") as map_file:
+        data = map_file.read()
+    entry["digest"] = hashlib.sha256(data).digest()[:16].hex()
+    content_hash = hashlib.sha256(data + key.encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(map_name))[0]
+    file_name = f"{stem}-{content_hash}{CACHE_EXTENSION}"
+    if not os.path.exists(os.path.join(cache_directory, file_name)):
+        os.makedirs(cache_directory, exist_ok=True)
+        compile_map(map_name, os.path.join(cache_directory, file_name), scaling)
+
+    entry["files"][key] = file_name
+    index[map_name] = entry
+    os.makedirs(cache_directory, exist_ok=True)
+    _write_index(cache_directory, index)
+    return bytes.fromhex(entry["digest"]), os.path.join(cache_directory, file_name)
+
+
+def compile_map(map_name, file_name, scaling=SPRITE_SCALING_TILES):
+    """ Read a TMX file and write it out in the compiled format """
+    tile_map = read_map(map_name, scaling)
+    directory = os.path.dirname(map_name)
+
+    # Many tile ids can share an image, so list each image once
+    images = []
+    image_index = {}
+    textures = {}
+    for tile_id, path in sorted(tile_map.textures.items()):
+        source = os.path.relpath(path, directory) if directory else path
+        if source not in image_index:
+            image_index[source] = len(images)
+            images.append(source)
+        textures[str(tile_id)] = image_index[source]
+
+    layers = []
+    offset = 0
+    grids = []
+    shapes = {}
+    for name, rows in tile_map.layers.items():
+        grid = np.asarray(rows, dtype=np.uint32)
+        # Working out hit boxes means decoding the tile images, so it is
+        # done here once
+        for tile_id in np.unique(grid[grid != 0]).tolist():
+            shapes[str(tile_id)] = tile_map.tile_shape(tile_id)
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layers.append({"name": name, "offset": offset, "shape": grid.shape})
+        grids.append((offset, grid))
+        offset += grid.nbytes
+
+    header = json.dumps({"width": tile_map.width, "height": tile_map.height,
+                         "tile_size": tile_map.tile_size, "images": images,
+                         "textures": textures, "shapes": shapes, "layers": layers}).encode()
+    data_start = -(-(PREFIX.size + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    # Write to a temporary name first so a half written file is never loaded
+    temporary_name = f"{file_name}.{os.getpid()}.tmp"
+    with open(temporary_name, "wb") as cache_file:
+        cache_file.write(PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+        cache_file.write(header)
+        for grid_offset, grid in grids:
+            cache_file.seek(data_start + grid_offset)
+            cache_file.write(grid.tobytes())
+    os.replace(temporary_name, file_name)
+
+
+def load_compiled(file_name, base_directory=""):
+    """ Load a compiled map. Layer grids are memory mapped, not read. """
+    with open(file_name, "rb") as cache_file:
+        magic, format_version, header_length = PREFIX.unpack(cache_file.read(PREFIX.size))
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{file_name} is not a compiled map this game can read")
+        header = json.loads(cache_file.read(header_length))
+    data_start = -(-(PREFIX.size + header_length) // ALIGNMENT) * ALIGNMENT
+
+    layers = {}
+    for layer in header["layers"]:
+        layers[layer["name"]] = np.memmap(file_name, dtype=np.uint32, mode="r",
+                                          offset=data_start + layer["offset"],
+                                          shape=tuple(layer["shape"]))
+
+    images = [os.path.join(base_directory, source) for source in header["images"]]
+    textures = {int(tile_id): images[index] for tile_id, index in header["textures"].items()}
+    shapes = {int(tile_id): tuple(map(tuple, points)) if points is not None else None
+              for tile_id, points in header["shapes"].items()}
+    return TileMap(header["width"], header["height"], header["tile_size"], layers, textures, shapes)
+
+
+def load_map(map_name, scaling=SPRITE_SCALING_TILES, cache_directory=DEFAULT_CACHE_DIRECTORY):
+    """ Load a TMX file through the cache, compiling it if it changed """
+    digest, file_name = _cache_entry(map_name, scaling, cache_directory)
+    tile_map = load_compiled(file_name, os.path.dirname(map_name))
+    tile_map.digest = digest
+    return tile_map
+
+
+def map_digest(map_name, cache_directory=DEFAULT_CACHE_DIRECTORY):
+    """ map_hash of a map file, taken from the cache while the file is unchanged """
+    digest, _ = _cache_entry(map_name, SPRITE_SCALING_TILES, cache_directory)
+    return digest
+
+
+def main():
+    for map_name in sys.argv[1:]:
+        tile_map = load_map(map_name)
+        print(f"{map_name}: {tile_map.width}x{tile_map.height}, {len(tile_map.layers)} layers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+"""
+Multiplayer Lunar Lander over UDP.
+
+The server is authoritative: every player's lander flies in one
+LanderCrowd at the game's fixed tick rate. Clients only send the keys
+they hold and draw what the server says.
+
+Packets, little endian:
+
+  JOIN      client -> server  type
+  WELCOME   server -> client  type, slot, server tick
+  INPUT     client -> server  type, client tick, client time, keys,
+                              last snapshot tick received
+  SNAPSHOT  server -> client  type, tick, baseline tick, echoed client time,
+                              lander count, then per field: a bitmap of
+                              the landers whose field changed and their
+                              new values
+  LEAVE     client -> server  type
+
+A snapshot holds every lander's state quantized to a few bytes (position
+to 1/4 px, velocity to 1/8 px/s, fuel to 1/10 and whether it is flying,
+landed or crashed). It is sent as a change from the last snapshot the
+client said it got, so a field that didn't change costs one bit. A
+client whose baseline the server no longer has gets everything. Laid out
+field by field, a snapshot packs and unpacks with a few array operations
+per field, and the server packs it once for every client that has the
+same baseline. The client time of its latest input is echoed back, so
+clients can measure their round trip.
+
+Run `python multiplayer.py server` for a server, or
+`python multiplayer.py test --clients 64` to run a server and that many
+simulated clients over loopback and report bandwidth and server CPU per
+player.
+"""
+import argparse
+import asyncio
+import struct
+import threading
+import time
+
+import numpy as np
+
+from constants import TICK_RATE, PHYSICS_TIME_STEP
+from crowd import LanderCrowd, spread_starts
+from simulation import pack_keys
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 47474
+MAX_PLAYERS = 64
+
+# Server ticks between snapshots
+SNAPSHOT_INTERVAL = 2
+
+# Snapshots kept as baselines for deltas, in ticks
+HISTORY_TICKS = 64
+
+# Players silent this long are dropped, in seconds
+CLIENT_TIMEOUT = 5.0
+
+# Ticks a player waits after landing or crashing before flying again
+RESPAWN_TICKS = 3 * TICK_RATE
+
+# Packet types
+JOIN = 0
+WELCOME = 1
+INPUT = 2
+SNAPSHOT = 3
+LEAVE = 4
+
+PACKET_TYPE = struct.Struct("<B")
+WELCOME_PACKET = struct.Struct("<BBI")
+INPUT_PACKET = struct.Struct("<BIdBI")
+SNAPSHOT_HEADER = struct.Struct("<BIIdB")
+
+# Lander state fields: how much they are scaled by before rounding, how
+# they are packed and the range that packing holds
+FIELDS = ("x", "y", "velocity_x", "velocity_y", "fuel", "state")
+SCALES = np.array([4, 4, 8, 8, 10, 1])
+DTYPES = [np.dtype(dtype) for dtype in ("<u2", "<u2", "<i2", "<i2", "<u2", "u1")]
+LOWEST = np.array([0, 0, -32768, -32768, 0, 0])
+HIGHEST = np.array([65535, 65535, 32767, 32767, 65535, 255])
+
+# Flight states
+EMPTY = 0
+FLYING = 1
+LANDED = 2
+CRASHED = 3
+
+def quantize(crowd, occupied):
+    """ (landers, fields) int array of the crowd's state as it is sent """
+    state = np.where(crowd.landed, LANDED, np.where(crowd.crashed, CRASHED, FLYING))
+    state = np.where(occupied, state, EMPTY)
+    values = np.column_stack([crowd.position, crowd.velocity, crowd.fuel, state])
+    return np.clip(np.round(values * SCALES), LOWEST, HIGHEST).astype(np.int32)
+
+
+def dequantize(quantized):
+    """ (landers, fields) float array back from quantize """
+    return quantized / SCALES
+
+
+def encode_changes(current, baseline=None):
+    """ Snapshot body: current as changes from baseline, or all of it """
+    if baseline is None:
+        changed = np.ones(current.shape, dtype=bool)
+    else:
+        changed = current != baseline
+    parts = []
+    for field, dtype in enumerate(DTYPES):
+        parts.append(np.packbits(changed[:, field]).tobytes())
+        parts.append(current[changed[:, field], field].astype(dtype).tobytes())
+    return b"".join(parts)
+
+
+def encode_snapshot(tick, baseline_tick, echo_time, landers, body):
+    """ Snapshot packet with a body from encode_changes """
+    return SNAPSHOT_HEADER.pack(SNAPSHOT, tick, baseline_tick, echo_time, landers) + body
+
+
+def decode_snapshot(data, baseline):
+    """
+    Apply a snapshot packet to its baseline (a zero array for full
+    snapshots). Returns (tick, baseline tick, echoed time, new state).
+    """
+    _, tick, baseline_tick, echo_time, landers = SNAPSHOT_HEADER.unpack_from(data)
+    state = baseline.copy()
+    offset = SNAPSHOT_HEADER.size
+    bitmap_size = -(-landers // 8)
+    for field, dtype in enumerate(DTYPES):
+        bitmap = np.frombuffer(data, dtype=np.uint8, count=bitmap_size, offset=offset)
+        changed = np.unpackbits(bitmap, count=landers).astype(bool)
+        offset += bitmap_size
+        count = int(changed.sum())
+        state[:landers][changed, field] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += count * dtype.itemsize
+    return tick, baseline_tick, echo_time, state
+
+
+class Player:
+    """ What the server knows about one client """
+
+    def __init__(self, slot, address, now):
+        self.slot = slot
+        self.address = address
+        self.last_input_tick = -1
+        self.echo_time = 0.0
+        # Latest snapshot the client has, to send changes from
+        self.acked_tick = 0
+        self.last_heard = now
+        self.stopped_tick = None
+
+
+class LanderServer(asyncio.DatagramProtocol):
+    """ Runs the game and sends every player snapshots of it """
+
+    def __init__(self, tile_map=None, max_players=MAX_PLAYERS, snapshot_interval=SNAPSHOT_INTERVAL):
+        self.max_players = max_players
+        self.snapshot_interval = snapshot_interval
+        self.crowd = LanderCrowd(max_players, tile_map)
+        self.crowd.setup(seed=0)
+        for slot in range(max_players):
+            self.crowd.park(slot)
+        self.starts = spread_starts(max_players, seed=1)
+
+        self.transport = None
+        self.players = {}
+        self.slots = [None] * max_players
+        self.occupied = np.zeros(max_players, dtype=bool)
+        self.keys = np.zeros(max_players, dtype=np.uint8)
+        self.history = {}
+        self.tick = 0
+
+        # Totals for measuring cost per player
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.tick_seconds = 0.0
+        self.player_ticks = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.bytes_received += len(data)
+        if not data:
+            return
+        packet_type = data[0]
+        player = self.players.get(address)
+        if packet_type == JOIN:
+            self._join(address)
+        elif player is None:
+            return
+        elif packet_type == INPUT and len(data) >= INPUT_PACKET.size:
+            _, client_tick, client_time, keys, acked_tick = INPUT_PACKET.unpack_from(data)
+            player.last_heard = time.monotonic()
+            # Datagrams can arrive out of order: only newer input counts
+            if client_tick > player.last_input_tick:
+                player.last_input_tick = client_tick
+                player.echo_time = client_time
+                self.keys[player.slot] = keys
+            player.acked_tick = max(player.acked_tick, acked_tick)
+        elif packet_type == LEAVE:
+            self._leave(player)
+
+    def _join(self, address):
+        player = self.players.get(address)
+        if player is None:
+            if None not in self.slots:
+                return
+            slot = self.slots.index(None)
+            player = Player(slot, address, time.monotonic())
+            self.players[address] = player
+            self.slots[slot] = player
+            self.occupied[slot] = True
+            self.crowd.respawn(slot, self.starts[slot])
+        # Sent again for repeated joins, in case the first welcome was lost
+        self._send(WELCOME_PACKET.pack(WELCOME, player.slot, self.tick), address)
+
+    def _leave(self, player):
+        del self.players[player.address]
+        self.slots[player.slot] = None
+        self.occupied[player.slot] = False
+        self.keys[player.slot] = 0
+        self.crowd.park(player.slot)
+
+    def _send(self, data, address):
+        self.bytes_sent += len(data)
+        self.transport.sendto(data, address)
+
+    def step(self):
+        """ Run one tick and send snapshots when they are due """
+        start_time = time.process_time()
+        crowd = self.crowd
+        crowd.step(self.keys)
+        self.tick += 1
+
+        # Players who landed or crashed fly again after a short wait
+        now = time.monotonic()
+        for player in list(self.players.values()):
+            if now - player.last_heard > CLIENT_TIMEOUT:
+                self._leave(player)
+            elif crowd.active[player.slot]:
+                player.stopped_tick = None
+            elif player.stopped_tick is None:
+                player.stopped_tick = self.tick
+            elif self.tick - player.stopped_tick >= RESPAWN_TICKS:
+                crowd.respawn(player.slot, self.starts[player.slot])
+                player.stopped_tick = None
+
+        if self.tick % self.snapshot_interval == 0:
+            current = quantize(crowd, self.occupied)
+            self.history[self.tick] = current
+            self.history.pop(self.tick - HISTORY_TICKS, None)
+            # Most players have the same baseline, so each body is packed once
+            bodies = {}
+            for player in self.players.values():
+                baseline_tick = player.acked_tick if player.acked_tick in self.history else 0
+                body = bodies.get(baseline_tick)
+                if body is None:
+                    body = encode_changes(current, self.history.get(baseline_tick))
+                    bodies[baseline_tick] = body
+                self._send(encode_snapshot(self.tick, baseline_tick, player.echo_time,
+                                           self.max_players, body),
+                           player.address)
+
+        self.tick_seconds += time.process_time() - start_time
+        self.player_ticks += len(self.players)
+
+    async def run(self, seconds=None):
+        """ Tick at the game's rate, for a while or forever """
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        end = next_tick + seconds if seconds is not None else None
+        while end is None or next_tick < end:
+            self.step()
+            next_tick += PHYSICS_TIME_STEP
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+
+class LanderClient(asyncio.DatagramProtocol):
+    """ One player: sends keys, keeps the latest state of every lander """
+
+    def __init__(self, max_players=MAX_PLAYERS):
+        self.transport = None
+        self.slot = None
+        self.joined = asyncio.Event()
+        self.tick = 0
+        # Snapshot tick -> quantized state, kept as baselines
+        self.snapshots = {}
+        self.snapshot_tick = 0
+        self.state = np.zeros((max_players, len(FIELDS)), dtype=np.int32)
+        self.round_trip = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.bytes_received += len(data)
+        if not data:
+            return
+        if data[0] == WELCOME:
+            _, self.slot, _ = WELCOME_PACKET.unpack_from(data)
+            self.joined.set()
+        elif data[0] == SNAPSHOT:
+            baseline_tick = SNAPSHOT_HEADER.unpack_from(data)[2]
+            baseline = self.snapshots.get(baseline_tick) if baseline_tick else np.zeros_like(self.state)
+            if baseline is None:
+                return
+            tick, _, echo_time, state = decode_snapshot(data, baseline)
+            if tick <= self.snapshot_tick:
+                return
+            self.snapshots[tick] = state
+            # Baselines older than the one the server just used are no use
+            for old_tick in [old_tick for old_tick in self.snapshots if old_tick < baseline_tick]:
+                del self.snapshots[old_tick]
+            self.snapshot_tick = tick
+            self.state = state
+            if echo_time:
+                self.round_trip = time.monotonic() - echo_time
+
+    def _send(self, data):
+        self.bytes_sent += len(data)
+        self.transport.sendto(data)
+
+    async def join(self, retry_seconds=0.5, attempts=10):
+        for _ in range(attempts):
+            self._send(PACKET_TYPE.pack(JOIN))
+            try:
+                await asyncio.wait_for(self.joined.wait(), retry_seconds)
+                return self.slot
+            except asyncio.TimeoutError:
+                pass
+        raise ConnectionError("No answer from the server")
+
+    def send_input(self, right, left, up):
+        """ Send the keys held this tick """
+        self.tick += 1
+        self._send(INPUT_PACKET.pack(INPUT, self.tick, time.monotonic(), pack_keys(right, left, up),
+                                     self.snapshot_tick))
+
+    def leave(self):
+        self._send(PACKET_TYPE.pack(LEAVE))
+
+    @property
+    def landers(self):
+        """ (landers, fields) float array of the latest state """
+        return dequantize(self.state)
+
+    @property
+    def own(self):
+        """ Field values of this player's lander """
+        return self.landers[self.slot] if self.slot is not None else None
+
+
+async def connect(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """ Open a client and join a server. Returns (transport, client). """
+    loop = asyncio.get_running_loop()
+    transport, client = await loop.create_datagram_endpoint(LanderClient, remote_addr=(host, port))
+    await client.join()
+    return transport, client
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, seconds=None):
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(LanderServer, local_addr=(host, port))
+    try:
+        await server.run(seconds)
+    finally:
+        transport.close()
+    return server
+
+
+class ClientThread:
+    """
+    A LanderClient on its own event loop thread, for games whose main loop
+    isn't asyncio. Its state can be read from any thread.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=5.0):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.transport, self.client = asyncio.run_coroutine_threadsafe(
+            connect(host, port), self.loop).result(timeout)
+
+    @property
+    def slot(self):
+        return self.client.slot
+
+    @property
+    def landers(self):
+        return self.client.landers
+
+    @property
+    def round_trip(self):
+        return self.client.round_trip
+
+    def send_input(self, right, left, up):
+        self.loop.call_soon_threadsafe(self.client.send_input, right, left, up)
+
+    def close(self):
+        def stop():
+            self.client.leave()
+            self.transport.close()
+            self.loop.stop()
+        self.loop.call_soon_threadsafe(stop)
+        self.thread.join(1.0)
+
+
+def hover_keys(client):
+    """ Simulated player: thrust up while falling fast """
+    own = client.own
+    return False, False, own is not None and own[3] < -40
+
+
+async def load_test(clients=MAX_PLAYERS, seconds=10.0, host=DEFAULT_HOST):
+    """ A server and simulated clients over loopback, in one process """
+    loop = asyncio.get_running_loop()
+    server_transport, server = await loop.create_datagram_endpoint(LanderServer, local_addr=(host, 0))
+    port = server_transport.get_extra_info("sockname")[1]
+    server_task = asyncio.ensure_future(server.run())
+
+    connections = [await connect(host, port) for _ in range(clients)]
+    sent = server.bytes_sent
+    received = server.bytes_received
+    seconds_ticking = server.tick_seconds
+    player_ticks = server.player_ticks
+
+    next_tick = loop.time()
+    end = next_tick + seconds
+    while next_tick < end:
+        for _, client in connections:
+            client.send_input(*hover_keys(client))
+        next_tick += PHYSICS_TIME_STEP
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    for transport, client in connections:
+        client.leave()
+        transport.close()
+    server_task.cancel()
+    server_transport.close()
+
+    round_trips = [client.round_trip for _, client in connections if client.round_trip is not None]
+    player_ticks = server.player_ticks - player_ticks
+    return {"clients": clients,
+            "seconds": seconds,
+            "down_bytes_per_player": (server.bytes_sent - sent) / clients / seconds,
+            "up_bytes_per_player": (server.bytes_received - received) / clients / seconds,
+            "cpu_per_player_tick": (server.tick_seconds - seconds_ticking) / max(player_ticks, 1),
+            "round_trip": sum(round_trips) / len(round_trips) if round_trips else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lunar Lander multiplayer")
+    parser.add_argument("mode", choices=["server", "test"])
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--clients", type=int, default=MAX_PLAYERS)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.mode == "server":
+        print(f"Serving on {args.host}:{args.port}")
+        asyncio.run(serve(args.host, args.port))
+        return
+
+    results = asyncio.run(load_test(args.clients, args.seconds, args.host))
+    print(f"{results['clients']} clients for {results['seconds']:.0f} s over loopback")
+    print(f"  down {results['down_bytes_per_player'] / 1024:.2f} KB/s per player, "
+          f"up {results['up_bytes_per_player'] / 1024:.2f} KB/s per player")
+    print(f"  server CPU {results['cpu_per_player_tick'] * 1e6:.1f} us per player per tick")
+    if results["round_trip"] is not None:
+        print(f"  round trip {results['round_trip'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Particles for thruster exhaust and explosions.
+
+A ParticlePool holds a fixed number of particles in NumPy arrays, with the
+live ones packed at the front. Emitting writes new particles after the
+last live one, and updating moves every particle with a few array
+operations and packs the survivors to the front again. No Python object
+is made per particle, and the pool never grows: once it is full, new
+particles are dropped.
+
+Positions, colors and sizes live in one structured array laid out the
+way the GPU reads them, so drawing uploads the live part of it as it is
+(see ParticleLayer in layers.py).
+
+No arcade here, so the particles can be timed without a window:
+`python particles.py`.
+"""
+import math
+import time
+
+import numpy as np
+
+# Most particles alive at once
+MAX_PARTICLES = 8192
+
+# What the GPU gets for each particle: center, RGBA color and size in pixels
+VERTEX = np.dtype([("position", "<f4", 2), ("color", "u1", 4), ("size", "<f4")])
+
+# Exhaust: particles per tick while a thruster fires, and how they leave
+EXHAUST_PER_TICK = 12
+EXHAUST_SPEED = (60, 180)
+EXHAUST_SPREAD = math.radians(15)
+EXHAUST_LIFE = (0.2, 0.5)
+EXHAUST_COLORS = np.array([[255, 240, 180, 255], [255, 170, 60, 255], [200, 200, 255, 255]], dtype=np.uint8)
+
+# Explosion: particles in one burst, flung in every direction
+EXPLOSION_PARTICLES = 600
+EXPLOSION_SPEED = (30, 320)
+EXPLOSION_LIFE = (0.4, 1.6)
+EXPLOSION_COLORS = np.array([[255, 255, 200, 255], [255, 190, 40, 255], [255, 90, 20, 255],
+                             [120, 120, 120, 255]], dtype=np.uint8)
+
+
+class ParticlePool:
+    """ A fixed number of particles, moved all at once """
+
+    def __init__(self, capacity=MAX_PARTICLES, gravity=0.0, drag=1.0, seed=None):
+        self.capacity = capacity
+        # Pulls particles down, in pixels per second per second
+        self.gravity = gravity
+        # Share of its speed a particle keeps each second
+        self.drag = drag
+        self.rng = np.random.default_rng(seed)
+
+        self.vertices = np.zeros(capacity, dtype=VERTEX)
+        # Views into the vertices, so updating them updates what is drawn
+        self.position = self.vertices["position"]
+        self.color = self.vertices["color"]
+        self.size = self.vertices["size"]
+        self.velocity = np.zeros((capacity, 2), dtype=np.float32)
+        self.age = np.zeros(capacity, dtype=np.float32)
+        self.life = np.ones(capacity, dtype=np.float32)
+        # Alpha a particle starts with and fades from
+        self.alpha = np.zeros(capacity, dtype=np.float32)
+
+        # Particles alive, all at the front of the arrays
+        self.count = 0
+        # Particles that didn't fit, for checking the capacity
+        self.dropped = 0
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.count = 0
+
+    def emit(self, count, x, y, angle, spread, speed, life, colors, size=2.0, velocity=(0, 0)):
+        """
+        Add up to count particles at (x, y), moving at angle radians, give
+        or take spread, plus velocity. speed and life are (low, high)
+        ranges, and each particle gets a random one of the colors.
+        """
+        room = self.capacity - self.count
+        if count > room:
+            self.dropped += count - room
+            count = room
+        if count <= 0:
+            return 0
+        new = slice(self.count, self.count + count)
+        rng = self.rng
+
+        angles = angle + rng.uniform(-spread, spread, count)
+        speeds = rng.uniform(speed[0], speed[1], count)
+        self.position[new, 0] = x
+        self.position[new, 1] = y
+        self.velocity[new, 0] = np.cos(angles) * speeds + velocity[0]
+        self.velocity[new, 1] = np.sin(angles) * speeds + velocity[1]
+        self.age[new] = 0
+        self.life[new] = rng.uniform(life[0], life[1], count)
+        self.color[new] = colors[rng.integers(0, len(colors), count)]
+        self.alpha[new] = self.color[new, 3]
+        self.size[new] = size * rng.uniform(0.75, 1.25, count)
+        self.count += count
+        return count
+
+    def update(self, delta_time):
+        """ Move every live particle, fade it and drop the ones that ran out """
+        count = self.count
+        if not count:
+            return
+        position = self.position[:count]
+        velocity = self.velocity[:count]
+        age = self.age[:count]
+
+        velocity[:, 1] -= self.gravity * delta_time
+        if self.drag != 1.0:
+            velocity *= self.drag ** delta_time
+        position += velocity * delta_time
+        age += delta_time
+
+        alive = age < self.life[:count]
+        living = int(np.count_nonzero(alive))
+        if living < count:
+            # Pack the survivors to the front, in their old order
+            keep = np.flatnonzero(alive)
+            for array in (self.vertices, self.velocity, self.age, self.life, self.alpha):
+                array[:living] = array[keep]
+            self.count = count = living
+
+        # Fade out over each particle's life
+        self.color[:count, 3] = self.alpha[:count] * (1 - self.age[:count] / self.life[:count])
+
+
+def exhaust(pool, x, y, direction, velocity=(0, 0)):
+    """
+    Exhaust for a thruster pushing the lander in direction (x, y) from
+    (x, y), which is where the nozzle is. The exhaust leaves the other
+    way, carried along by the lander's own velocity.
+    """
+    angle = math.atan2(-direction[1], -direction[0])
+    return pool.emit(EXHAUST_PER_TICK, x, y, angle, EXHAUST_SPREAD, EXHAUST_SPEED, EXHAUST_LIFE,
+                     EXHAUST_COLORS, size=3.0, velocity=velocity)
+
+
+def explosion(pool, x, y, particles=EXPLOSION_PARTICLES):
+    """ A burst of particles in every direction from (x, y) """
+    return pool.emit(particles, x, y, 0.0, math.pi, EXPLOSION_SPEED, EXPLOSION_LIFE,
+                     EXPLOSION_COLORS, size=4.0)
+
+
+def main():
+    """ Time a pool of exhaust with an explosion every sixth of a second """
+    pool = ParticlePool(gravity=40, drag=0.5, seed=0)
+    ticks = 600
+    emitting = updating = 0.0
+    live = 0
+    for tick in range(ticks):
+        start_time = time.perf_counter()
+        exhaust(pool, 400, 300, (0, 1))
+        if tick % 10 == 0:
+            explosion(pool, 400, 300)
+        emitted_time = time.perf_counter()
+        pool.update(1 / 60)
+        emitting += emitted_time - start_time
+        updating += time.perf_counter() - emitted_time
+        live += len(pool)
+    print(f"{live / ticks:.0f} live particles on average, per tick {emitting / ticks * 1000:.3f} ms "
+          f"emitting and {updating / ticks * 1000:.3f} ms updating, {pool.dropped} particles dropped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Per phase frame timing.
+
+Wrap each part of a frame in `with profiler.phase("physics"):` and call
+begin_frame and end_frame around the whole frame. While the profiler is
+off, phase() hands back one shared do-nothing context, so leaving the
+calls in costs a method call and an attribute check per phase.
+
+While on, the last few seconds of frames are kept for the on-screen
+graph. While recording, every frame is kept and can be saved as CSV,
+JSON or a Chrome trace (open it in chrome://tracing or Perfetto).
+
+FrameRateMeter counts the frames actually drawn each second, to check
+them against the rate the window was asked for.
+
+No arcade here, so the headless code can be profiled the same way.
+"""
+import csv
+import json
+import time
+from collections import deque
+
+# Frames kept for the graph
+HISTORY_SIZE = 240
+
+
+class _NullPhase:
+    """ What phase() returns while the profiler is off """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    """ Times one phase and adds it to the frame being profiled """
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.add(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class FrameProfiler:
+    """ Times the phases of every frame """
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.enabled = False
+        self.recording = False
+
+        # Phase names in the order they were first seen
+        self.phase_names = []
+        # (frame seconds, {phase: seconds}) of the last few frames
+        self.history = deque(maxlen=history_size)
+        # Every frame since recording started, with its phase spans
+        self.frames = []
+
+        self.frame_start = None
+        self.phases = {}
+        self.spans = []
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        """ Stop timing, unless a recording still needs it """
+        self.enabled = self.recording
+        self.frame_start = None
+
+    def start_recording(self):
+        self.enabled = True
+        self.recording = True
+        self.frames = []
+
+    def stop_recording(self):
+        self.recording = False
+
+    def phase(self, name):
+        """ Context manager that times a phase of the current frame """
+        if not self.enabled:
+            return NULL_PHASE
+        return _Phase(self, name)
+
+    def add(self, name, start, seconds):
+        """ Count time spent in a phase. Phases can run many times a frame. """
+        if self.frame_start is None:
+            return
+        if name not in self.phases:
+            if name not in self.phase_names:
+                self.phase_names.append(name)
+            self.phases[name] = 0.0
+        self.phases[name] += seconds
+        if self.recording:
+            self.spans.append((name, start, seconds))
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.frame_start = time.perf_counter()
+        self.phases = {}
+        self.spans = []
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+        seconds = time.perf_counter() - self.frame_start
+        self.history.append((seconds, self.phases))
+        if self.recording:
+            self.frames.append({"start": self.frame_start, "seconds": seconds,
+                                "phases": self.phases, "spans": self.spans})
+        self.frame_start = None
+
+    def save(self, file_name):
+        """ Save the recorded frames, in a format picked by the file name """
+        if file_name.endswith(".csv"):
+            self.save_csv(file_name)
+        elif file_name.endswith(".trace.json") or file_name.endswith(".trace"):
+            self.save_chrome_trace(file_name)
+        else:
+            self.save_json(file_name)
+
+    def save_csv(self, file_name):
+        """ One row per frame, times in milliseconds """
+        with open(file_name, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["frame", "total"] + self.phase_names)
+            for number, frame in enumerate(self.frames):
+                writer.writerow([number, f"{frame['seconds'] * 1000:.4f}"] +
+                                [f"{frame['phases'].get(name, 0.0) * 1000:.4f}" for name in self.phase_names])
+
+    def save_json(self, file_name):
+        """ Every frame's total and phase times, in seconds """
+        with open(file_name, "w") as json_file:
+            json.dump({"phases": self.phase_names,
+                       "frames": [{"seconds": frame["seconds"], "phases": frame["phases"]}
+                                  for frame in self.frames]}, json_file)
+
+    def save_chrome_trace(self, file_name):
+        """ Frames and phases as Chrome trace complete events """
+        events = []
+        origin = self.frames[0]["start"] if self.frames else 0.0
+        for number, frame in enumerate(self.frames):
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1,
+                           "ts": (frame["start"] - origin) * 1e6, "dur": frame["seconds"] * 1e6,
+                           "args": {"frame": number}})
+            for name, start, seconds in frame["spans"]:
+                events.append({"name": name, "ph": "X", "pid": 1, "tid": 1,
+                               "ts": (start - origin) * 1e6, "dur": seconds * 1e6})
+        with open(file_name, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+
+class FrameRateMeter:
+    """ Frames drawn per second, recently and since the first frame """
+
+    def __init__(self, window=1.0, clock=time.perf_counter):
+        # Seconds of frames the recent rate is counted over
+        self.window = window
+        self.clock = clock
+        self.times = deque()
+        self.first = None
+        self.count = 0
+
+    def tick(self):
+        """ Count a frame drawn now """
+        now = self.clock()
+        if self.first is None:
+            self.first = now
+        self.count += 1
+        self.times.append(now)
+        while now - self.times[0] > self.window:
+            self.times.popleft()
+
+    def rate(self):
+        """ Frames per second over the last window, 0 until two are drawn """
+        if len(self.times) < 2:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+    def average(self):
+        """ Frames per second since the first frame """
+        if self.count < 2:
+            return 0.0
+        return (self.count - 1) / (self.times[-1] - self.first)
@@ -0,0 +1,191 @@
+"""
+Replays of Lunar Lander games.
+
+A replay is the keys held on every physics tick plus what is needed to
+start the game the same way: the seed, the start position, a hash of the
+map, the constants version and the tick rate it was played at. Keys are one byte per tick and compress
+to almost nothing, so a whole game is a few KB.
+
+Replays play back headless through LanderSimulation as fast as the CPU
+allows, or in real time with `python MoonLander.py <replay file>`. Both
+build the same collision shapes, so a replay ends where the game did;
+replays keep the lander's final position to check that.
+
+Run `python replay.py <replay files>` to check recorded scores in bulk.
+"""
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+
+from constants import CONSTANTS_VERSION, TICK_RATE
+from simulation import DEFAULT_MAP, LanderSimulation, pack_keys, start_position, unpack_keys
+from mapcache import map_digest
+
+MAGIC = b"LLRP"
+FORMAT_VERSION = 3
+REPLAY_EXTENSION = ".llr"
+
+# magic, format version, constants version, seed, map hash, start x,
+# start y, ticks, score, end x, end y, tick rate
+HEADER = struct.Struct("<4sBHQ16sddIdddH")
+# Version 2 had no tick rate and version 1 no end position either. Both
+# were always played at TICK_RATE.
+HEADER_V2 = struct.Struct("<4sBHQ16sddIddd")
+HEADER_V1 = struct.Struct("<4sBHQ16sddId")
+
+
+class Replay:
+    """ Keys held on every tick of one game """
+
+    def __init__(self, map_digest, seed=0, start=None, score=0,
+                 constants_version=CONSTANTS_VERSION, keys=None, end=None, tick_rate=TICK_RATE):
+        self.map_digest = map_digest
+        self.seed = seed
+        self.start = start if start is not None else start_position()
+        self.score = score
+        # Where the lander was when the game ended, None if not known
+        self.end = end
+        self.constants_version = constants_version
+        # Physics ticks per second the game was played at
+        self.tick_rate = tick_rate
+        self.keys = bytearray(keys or b"")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def record(self, right, left, up):
+        """ Add the keys held for the next tick """
+        self.keys.append(pack_keys(right, left, up))
+
+    def keys_at(self, tick):
+        """ (right, left, up) held on a tick, nothing once the replay runs out """
+        if tick < len(self.keys):
+            return unpack_keys(self.keys[tick])
+        return False, False, False
+
+    def to_bytes(self):
+        # NaN marks an unknown end position
+        end_x, end_y = self.end if self.end is not None else (math.nan, math.nan)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, self.constants_version, self.seed,
+                             self.map_digest, self.start[0], self.start[1],
+                             len(self.keys), self.score, end_x, end_y, self.tick_rate)
+        return header + zlib.compress(bytes(self.keys), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER_V1.size or data[:4] != MAGIC:
+            raise ValueError("Not a Lunar Lander replay")
+        format_version = data[4]
+        tick_rate = TICK_RATE
+        if format_version == 1:
+            header = HEADER_V1
+            end = None
+            (_, _, constants_version, seed, map_digest,
+             start_x, start_y, ticks, score) = header.unpack_from(data)
+        elif format_version == 2 and len(data) >= HEADER_V2.size:
+            header = HEADER_V2
+            (_, _, constants_version, seed, map_digest,
+             start_x, start_y, ticks, score, end_x, end_y) = header.unpack_from(data)
+            end = None if math.isnan(end_x) else (end_x, end_y)
+        elif format_version == FORMAT_VERSION and len(data) >= HEADER.size:
+            header = HEADER
+            (_, _, constants_version, seed, map_digest,
+             start_x, start_y, ticks, score, end_x, end_y, tick_rate) = header.unpack_from(data)
+            end = None if math.isnan(end_x) else (end_x, end_y)
+        else:
+            raise ValueError(f"Unsupported replay format version {format_version}")
+
+        keys = zlib.decompress(data[header.size:])
+        if len(keys) != ticks:
+            raise ValueError(f"Replay has {len(keys)} ticks, header says {ticks}")
+        return cls(map_digest, seed, (start_x, start_y), score, constants_version, keys, end, tick_rate)
+
+    def save(self, file_name):
+        # Write to a temporary name first so a half written replay is never loaded
+        temporary_name = f"{file_name}.{os.getpid()}.tmp"
+        with open(temporary_name, "wb") as replay_file:
+            replay_file.write(self.to_bytes())
+        os.replace(temporary_name, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, "rb") as replay_file:
+            return cls.from_bytes(replay_file.read())
+
+
+def save_replay(replay, directory):
+    """ Save a replay under a time stamped name and return its path """
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, time.strftime("%Y%m%d-%H%M%S"))
+    # Games can end in the same second, so claim the first free name
+    # before writing. O_EXCL makes two savers never get the same one.
+    number = 0
+    while True:
+        file_name = f"{stem}{f'-{number}' if number else ''}{REPLAY_EXTENSION}"
+        try:
+            os.close(os.open(file_name, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            number += 1
+    replay.save(file_name)
+    return file_name
+
+
+def check_replay(replay, map_name=DEFAULT_MAP, tick_rate=None):
+    """
+    Raise ValueError if a replay was recorded on a different map or rules,
+    or at a tick rate other than tick_rate when one is given
+    """
+    if replay.constants_version != CONSTANTS_VERSION:
+        raise ValueError(f"Replay uses constants version {replay.constants_version}, "
+                         f"this game is version {CONSTANTS_VERSION}")
+    if replay.map_digest != map_digest(map_name):
+        raise ValueError("Replay was recorded on a different map")
+    if tick_rate is not None and replay.tick_rate != tick_rate:
+        raise ValueError(f"Replay was played at {replay.tick_rate} ticks per second, not {tick_rate}")
+
+
+def play_headless(replay, simulation=None, map_name=DEFAULT_MAP):
+    """ Play a replay through the headless simulation and return it """
+    check_replay(replay, map_name)
+    if simulation is None:
+        simulation = LanderSimulation(map_name=map_name)
+    simulation.setup(position=replay.start, tick_rate=replay.tick_rate)
+
+    for keys in replay.keys:
+        if simulation.game_over:
+            break
+        simulation.step(*unpack_keys(keys))
+    return simulation
+
+
+def replays_match(replay, simulation):
+    """
+    True if a replay played headless ended like the recorded game: same
+    score, and same final position when the replay has one
+    """
+    if round(simulation.score) != round(replay.score):
+        return False
+    return replay.end is None or simulation.position == tuple(replay.end)
+
+
+def main():
+    """ Replay every file given and compare how it ended to the recorded game """
+    simulation = LanderSimulation()
+    for file_name in sys.argv[1:]:
+        replay = Replay.load(file_name)
+        start_time = time.perf_counter()
+        play_headless(replay, simulation)
+        elapsed = time.perf_counter() - start_time
+
+        speed = simulation.ticks * simulation.time_step / max(elapsed, 1e-9)
+        result = "OK" if replays_match(replay, simulation) else "MISMATCH"
+        print(f"{file_name}: {result} recorded {replay.score:.0f}, replayed {simulation.score:.0f} "
+              f"in {simulation.ticks} ticks ({speed:.0f}x real time)")
+
+
+if __name__ == "__main__":
+    main()
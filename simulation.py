@@ -0,0 +1,189 @@
+"""
+Headless Lunar Lander simulation.
+
+Runs the same physics as GameWindow in MoonLander.py, but with no window,
+no sprites and no text, so it can be stepped as fast as the CPU allows.
+"""
+import os
+
+import pymunk
+
+from constants import (SPRITE_SIZE, SPRITE_SCALING_PLAYER,
+                       PLAYER_START_GRID_X, PLAYER_START_GRID_Y,
+                       GRAVITY, DEFAULT_DAMPING, PLAYER_FRICTION,
+                       PLAYER_MASS, PLAYER_MAX_HORIZONTAL_SPEED,
+                       PLAYER_MAX_VERTICAL_SPEED, PLAYER_MOVE_FORCE,
+                       TICK_RATE, FUEL_BURN_RATE, MAP_FILE_NAME, CRASH_LAYER, LAND_LAYER)
+from hitbox import player_hit_box
+from lander import Lander
+from streaming import PhysicsChunks
+from mapcache import load_map
+from terrain import TerrainIndex
+
+# Collision types, the same ones GameWindow gives the physics engine
+PLAYER_COLLISION_TYPE = 1
+CRASH_COLLISION_TYPE = 2
+LAND_COLLISION_TYPE = 3
+
+DEFAULT_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), MAP_FILE_NAME)
+
+# Bits used when the held keys are packed into one number
+THRUST_RIGHT = 1
+THRUST_LEFT = 2
+THRUST_UP = 4
+
+
+def pack_keys(right, left, up):
+    """ Pack the right/left/up keys into a bitmask """
+    return (THRUST_RIGHT if right else 0) | (THRUST_LEFT if left else 0) | (THRUST_UP if up else 0)
+
+
+def unpack_keys(keys):
+    """ Turn a bitmask back into (right, left, up) """
+    return bool(keys & THRUST_RIGHT), bool(keys & THRUST_LEFT), bool(keys & THRUST_UP)
+
+
+def thrust_force(right, left, up):
+    """ Force the thrusters give for a set of held keys, like InputService """
+    if right:
+        return (PLAYER_MOVE_FORCE, 0)
+    elif left:
+        return (-PLAYER_MOVE_FORCE, 0)
+    elif up:
+        return (0, PLAYER_MOVE_FORCE)
+    return None
+
+
+def player_shape(body):
+    """
+    The lander's collision shape: the hit box arcade gives its sprite,
+    which GameWindow hands the physics engine
+    """
+    shape = pymunk.Poly(body, player_hit_box(SPRITE_SCALING_PLAYER))
+    shape.friction = PLAYER_FRICTION
+    shape.collision_type = PLAYER_COLLISION_TYPE
+    return shape
+
+
+def start_position():
+    """ Where the lander starts, in pixels """
+    return (SPRITE_SIZE * PLAYER_START_GRID_X + SPRITE_SIZE / 2,
+            SPRITE_SIZE * PLAYER_START_GRID_Y + SPRITE_SIZE / 2)
+
+
+class LanderSimulation:
+    """ One game of Lunar Lander that runs without an arcade.Window """
+
+    def __init__(self, tile_map=None, map_name=DEFAULT_MAP, tick_rate=TICK_RATE):
+        # The map never changes, so it is read once and shared between games
+        self.tile_map = tile_map if tile_map is not None else load_map(map_name)
+        self.terrain = TerrainIndex(self.tile_map)
+        # Length of one tick, in seconds
+        self.time_step = 1 / tick_rate
+
+        self.space: pymunk.Space = None
+        self.body: pymunk.Body = None
+        self.chunks: PhysicsChunks = None
+        self.lander: Lander = None
+        self.crashed = False
+        self.landed = False
+        self.ticks = 0
+
+        self.setup()
+
+    def setup(self, position=None, velocity=(0, 0), tick_rate=None):
+        """ Start a new game, at a new tick rate if one is given """
+        if tick_rate is not None:
+            self.time_step = 1 / tick_rate
+        self.lander = Lander()
+        self.crashed = False
+        self.landed = False
+        self.ticks = 0
+
+        self.space = pymunk.Space()
+        self.space.gravity = (0, -GRAVITY)
+        self.space.damping = DEFAULT_DAMPING
+
+        # Add the player
+        self.body = pymunk.Body(PLAYER_MASS, float("inf"))
+        self.body.position = position if position is not None else start_position()
+        self.body.velocity = velocity
+        self.body.velocity_func = self._velocity_callback
+        self.space.add(self.body, player_shape(self.body))
+
+        # Create the crash and landing zones near the lander. More are
+        # streamed in as it flies. The shapes are the ones GameWindow makes.
+        self.chunks = PhysicsChunks(self.space, self.tile_map,
+                                    [(CRASH_LAYER, CRASH_COLLISION_TYPE), (LAND_LAYER, LAND_COLLISION_TYPE)])
+        self.chunks.update(*self.body.position)
+
+        handler = self.space.add_collision_handler(PLAYER_COLLISION_TYPE, CRASH_COLLISION_TYPE)
+        handler.begin = self._on_crash
+        handler = self.space.add_collision_handler(PLAYER_COLLISION_TYPE, LAND_COLLISION_TYPE)
+        handler.begin = self._on_land
+
+    @staticmethod
+    def _velocity_callback(body, gravity, damping, dt):
+        """ Same max velocity capping as arcade.PymunkPhysicsEngine """
+        pymunk.Body.update_velocity(body, gravity, damping, dt)
+        velocity_x, velocity_y = body.velocity
+        velocity_x = max(-PLAYER_MAX_HORIZONTAL_SPEED, min(velocity_x, PLAYER_MAX_HORIZONTAL_SPEED))
+        velocity_y = max(-PLAYER_MAX_VERTICAL_SPEED, min(velocity_y, PLAYER_MAX_VERTICAL_SPEED))
+        body.velocity = velocity_x, velocity_y
+
+    def _on_crash(self, arbiter, space, data):
+        self.crashed = True
+        self.lander._has_crashed = True
+        return True
+
+    def _on_land(self, arbiter, space, data):
+        self.landed = True
+        return True
+
+    @property
+    def game_over(self):
+        return self.crashed or self.landed
+
+    @property
+    def position(self):
+        return tuple(self.body.position)
+
+    @property
+    def velocity(self):
+        return tuple(self.body.velocity)
+
+    @property
+    def out_of_bounds(self):
+        """ True once the lander has left the map and can't come back down on it """
+        x, y = self.body.position
+        return x < 0 or x > self.tile_map.pixel_width or y < 0
+
+    @property
+    def score(self):
+        """ Points the game would show, fuel left times two on a landing """
+        if self.landed:
+            return self.lander._fuel * 2
+        return 0
+
+    def step(self, right=False, left=False, up=False):
+        """ Advance one tick with the given keys held """
+        if self.game_over:
+            return
+
+        force = thrust_force(right, left, up)
+        if force is not None and self.lander._fuel > 0:
+            self.body.apply_force_at_local_point(force, (0, 0))
+            self.lander.burn_fuel(FUEL_BURN_RATE * self.time_step)
+
+        self.space.step(self.time_step)
+        self.chunks.update(*self.body.position)
+        self.ticks += 1
+
+    def run(self, controller, max_ticks):
+        """
+        Play until the game ends or max_ticks pass. controller is called
+        with the simulation every tick and returns (right, left, up).
+        """
+        while not self.game_over and self.ticks < max_ticks:
+            self.step(*controller(self))
+        return self.score
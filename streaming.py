@@ -0,0 +1,157 @@
+"""
+Chunked terrain streaming.
+
+The map is cut into square chunks of tiles. A ChunkStreamer keeps the
+chunks around a point (the lander) loaded and unloads the ones it has
+left far behind, so what is turned into sprites and physics shapes stays
+the same size however big the map is. With the map loaded from the map
+cache, the tile grids themselves are memory mapped and only the parts in
+use are read from disk.
+
+What loading a chunk means is up to the owner: it passes load and unload
+callbacks, and the streamer only decides which chunks are needed.
+"""
+import pymunk
+
+from constants import WALL_FRICTION
+from terrain import merge_cells
+
+# Chunk width and height, in tiles
+CHUNK_SIZE = 16
+
+# Chunks within this many chunks of the lander are loaded. They are only
+# unloaded once they are further than UNLOAD_RADIUS, so flying back and
+# forth over a chunk edge doesn't load and unload the same chunk.
+LOAD_RADIUS = 2
+UNLOAD_RADIUS = 3
+
+
+def terrain_shapes(body, tile_map, tiles, collision_type):
+    """
+    Static pymunk shapes for (col, row, tile_id) tiles. Tiles that fill
+    their square are merged into a few boxes. Other tiles, like slopes,
+    keep the hit box arcade would give their sprite.
+    """
+    tile_size = tile_map.tile_size
+    cells = []
+    shapes = []
+    for col, row, tile_id in tiles:
+        points = tile_map.tile_shape(tile_id)
+        if points is None:
+            cells.append((col, row))
+            continue
+        center_x = (col + 0.5) * tile_size
+        center_y = (row + 0.5) * tile_size
+        shapes.append(pymunk.Poly(body, [(center_x + x, center_y + y) for x, y in points]))
+
+    for first_col, first_row, last_col, last_row in merge_cells(cells):
+        left = first_col * tile_size
+        bottom = first_row * tile_size
+        right = (last_col + 1) * tile_size
+        top = (last_row + 1) * tile_size
+        shapes.append(pymunk.Poly(body, [(left, bottom), (right, bottom), (right, top), (left, top)]))
+
+    for shape in shapes:
+        shape.friction = WALL_FRICTION
+        shape.collision_type = collision_type
+    return shapes
+
+
+class ChunkStreamer:
+    """ Decides which chunks of a map should be loaded """
+
+    def __init__(self, tile_map, load_chunk, unload_chunk, chunk_size=CHUNK_SIZE,
+                 load_radius=LOAD_RADIUS, unload_radius=UNLOAD_RADIUS):
+        self.tile_map = tile_map
+        self.load_chunk = load_chunk
+        self.unload_chunk = unload_chunk
+        self.chunk_size = chunk_size
+        self.load_radius = load_radius
+        self.unload_radius = max(unload_radius, load_radius)
+
+        self.columns = -(-tile_map.width // chunk_size)
+        self.rows = -(-tile_map.height // chunk_size)
+        self.loaded = set()
+        self.center = None
+
+    def chunk_at(self, x, y):
+        """ Chunk holding a point in pixels """
+        size = self.chunk_size * self.tile_map.tile_size
+        return int(x // size), int(y // size)
+
+    def update(self, x, y):
+        """ Load the chunks around a point and unload far ones """
+        center = self.chunk_at(x, y)
+        # Nothing changes until the point moves into another chunk
+        if center == self.center:
+            return
+        self.center = center
+        center_col, center_row = center
+
+        for chunk in list(self.loaded):
+            if max(abs(chunk[0] - center_col), abs(chunk[1] - center_row)) > self.unload_radius:
+                self.loaded.discard(chunk)
+                self.unload_chunk(chunk)
+
+        for chunk_row in range(max(center_row - self.load_radius, 0),
+                               min(center_row + self.load_radius + 1, self.rows)):
+            for chunk_col in range(max(center_col - self.load_radius, 0),
+                                   min(center_col + self.load_radius + 1, self.columns)):
+                chunk = (chunk_col, chunk_row)
+                if chunk not in self.loaded:
+                    self.loaded.add(chunk)
+                    self.load_chunk(chunk)
+
+    def unload_all(self):
+        for chunk in list(self.loaded):
+            self.unload_chunk(chunk)
+        self.loaded.clear()
+        self.center = None
+
+    def chunk_tiles(self, chunk, layer_name):
+        """ (col, row, tile_id) of every tile of a layer inside a chunk """
+        chunk_col, chunk_row = chunk
+        first_col = chunk_col * self.chunk_size
+        first_row = chunk_row * self.chunk_size
+        last_col = min(first_col + self.chunk_size, self.tile_map.width)
+        last_row = min(first_row + self.chunk_size, self.tile_map.height)
+
+        layer = self.tile_map.layers[layer_name]
+        for row in range(first_row, last_row):
+            tile_row = layer[row]
+            for col in range(first_col, last_col):
+                tile_id = tile_row[col]
+                if tile_id:
+                    yield col, row, int(tile_id)
+
+
+class PhysicsChunks:
+    """
+    Streams a map's layers into a pymunk space as static shapes, for code
+    that has no sprites
+    """
+
+    def __init__(self, space, tile_map, layers):
+        # layers: list of (layer name, collision type)
+        self.space = space
+        self.tile_map = tile_map
+        self.layers = layers
+        self.shapes = {}
+        self.streamer = ChunkStreamer(tile_map, self.load_chunk, self.unload_chunk)
+
+    def update(self, x, y):
+        self.streamer.update(x, y)
+
+    def load_chunk(self, chunk):
+        shapes = []
+        for layer_name, collision_type in self.layers:
+            shapes += terrain_shapes(self.space.static_body, self.tile_map,
+                                     self.streamer.chunk_tiles(chunk, layer_name), collision_type)
+        if shapes:
+            self.space.add(*shapes)
+        self.shapes[chunk] = shapes
+
+    def unload_chunk(self, chunk):
+        shapes = self.shapes.pop(chunk, [])
+        if shapes:
+            self.space.remove(*shapes)
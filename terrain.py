@@ -0,0 +1,358 @@
+"""
+Terrain for the Lunar Lander game, read straight from a TMX file.
+
+arcade.tilemap needs arcade (and a window to turn tiles into sprites), so
+the headless code paths use this small reader instead. It only keeps what
+the simulation needs: the tile grids of each layer and where their images
+live.
+"""
+import base64
+import gzip
+import hashlib
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+from constants import SPRITE_SCALING_TILES, CRASH_LAYER, LAND_LAYER
+from hitbox import tile_hit_box
+
+# Tiled stores flip flags in the top three bits of every tile id
+FLIPPED_FLAGS = 0xE0000000
+
+# Widest ring of cells nearest_distance searches before it lists every tile
+# of the layer and checks them all instead
+RING_SEARCH_RADIUS = 16
+
+
+class TileMap:
+    """ Tile layers of one map. Row 0 is the bottom row, like arcade. """
+
+    def __init__(self, width, height, tile_size, layers, textures, shapes=None):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        # Layer name -> rows of tile ids (0 is empty). Lists of lists when
+        # read from TMX, 2D arrays when loaded from the map cache.
+        self.layers = layers
+        # Tile id -> image path
+        self.textures = textures
+        # Layer name -> merged boxes of the whole layer, filled in on first
+        # use. Physics merges tiles per chunk as it streams them instead.
+        self.rects = {}
+        # Tile id -> hit box around the tile's center, None for tiles that
+        # fill their square. Filled in on first use.
+        self.shapes = shapes if shapes is not None else {}
+        # map_hash of the map file, None if it didn't come from one
+        self.digest = None
+
+    @property
+    def pixel_width(self):
+        return self.width * self.tile_size
+
+    @property
+    def pixel_height(self):
+        return self.height * self.tile_size
+
+    def tile_id(self, layer_name, col, row):
+        """ Tile id at a grid cell, 0 if empty or off the map """
+        if 0 <= col < self.width and 0 <= row < self.height:
+            return self.layers[layer_name][row][col]
+        return 0
+
+    def tiles(self, layer_name):
+        """ Yield (col, row, tile_id) for every filled cell of a layer """
+        layer = self.layers[layer_name]
+        if hasattr(layer, "nonzero"):
+            # Arrays can find their filled cells without a Python loop
+            rows, cols = layer.nonzero()
+            yield from zip(cols.tolist(), rows.tolist(), layer[rows, cols].tolist())
+            return
+        for row, tile_row in enumerate(layer):
+            for col, tile_id in enumerate(tile_row):
+                if tile_id:
+                    yield col, row, tile_id
+
+    def tile_rect(self, col, row):
+        """ (left, bottom, right, top) of a grid cell in pixels """
+        left = col * self.tile_size
+        bottom = row * self.tile_size
+        return left, bottom, left + self.tile_size, bottom + self.tile_size
+
+    def cell_at(self, x, y):
+        """ Grid cell that holds a point in pixels """
+        return int(x // self.tile_size), int(y // self.tile_size)
+
+    def tile_shape(self, tile_id):
+        """
+        Hit box of a tile relative to its center, the one arcade would give
+        its sprite, or None if the tile fills its whole square
+        """
+        if tile_id not in self.shapes:
+            self.shapes[tile_id] = tile_hit_box(self.textures[tile_id], self.tile_size)
+        return self.shapes[tile_id]
+
+    def merged_rects(self, layer_name):
+        """ (left, bottom, right, top) boxes that together cover a layer """
+        if layer_name in self.rects:
+            return self.rects[layer_name]
+        rects = []
+        for first_col, first_row, last_col, last_row in merge_cells(
+                (col, row) for col, row, _ in self.tiles(layer_name)):
+            left, bottom, _, _ = self.tile_rect(first_col, first_row)
+            _, _, right, top = self.tile_rect(last_col, last_row)
+            rects.append((left, bottom, right, top))
+        self.rects[layer_name] = rects
+        return rects
+
+
+def merge_cells(cells):
+    """
+    Cover a set of (col, row) grid cells with a few rectangles. Runs of
+    cells along a row are grown upward while the rows above match.
+    Returns (first col, first row, last col, last row) for each rectangle.
+    """
+    remaining = set(cells)
+    rects = []
+    for col, row in sorted(remaining, key=lambda cell: (cell[1], cell[0])):
+        if (col, row) not in remaining:
+            continue
+        last_col = col
+        while (last_col + 1, row) in remaining:
+            last_col += 1
+        last_row = row
+        while all((run_col, last_row + 1) in remaining for run_col in range(col, last_col + 1)):
+            last_row += 1
+        for merged_row in range(row, last_row + 1):
+            for merged_col in range(col, last_col + 1):
+                remaining.discard((merged_col, merged_row))
+        rects.append((col, row, last_col, last_row))
+    return rects
+
+
+def map_hash(map_name):
+    """ First 16 bytes of the SHA-256 of a map file, to tell maps apart """
+    with open(map_name, "rb") as map_file:
+        return hashlib.sha256(map_file.read()).digest()[:16]
+
+
+def _read_layer_data(data, width, height):
+    """ Decode a <data> element into rows of tile ids, top row first """
+    encoding = data.get("encoding")
+    if encoding == "csv":
+        ids = [int(value) for value in data.text.replace("\n", "").split(",") if value.strip()]
+    elif encoding == "base64":
+        raw = base64.b64decode(data.text.strip())
+        compression = data.get("compression")
+        if compression == "zlib":
+            raw = zlib.decompress(raw)
+        elif compression == "gzip":
+            raw = gzip.decompress(raw)
+        elif compression:
+            raise ValueError(f"Unsupported layer compression: {compression}")
+        ids = [int.from_bytes(raw[i:i + 4], "little") for i in range(0, len(raw), 4)]
+    else:
+        raise ValueError(f"Unsupported layer encoding: {encoding}")
+
+    if len(ids) != width * height:
+        raise ValueError(f"Layer has {len(ids)} tiles, expected {width * height}")
+
+    ids = [tile_id & ~FLIPPED_FLAGS for tile_id in ids]
+    return [ids[row * width:(row + 1) * width] for row in range(height)]
+
+
+def read_map(map_name, scaling=SPRITE_SCALING_TILES):
+    """ Read the tile layers and tileset images of a TMX file """
+    root = ElementTree.parse(map_name).getroot()
+    directory = os.path.dirname(map_name)
+
+    width = int(root.get("width"))
+    height = int(root.get("height"))
+    tile_size = int(root.get("tilewidth")) * scaling
+
+    textures = {}
+    for tileset in root.iter("tileset"):
+        first_gid = int(tileset.get("firstgid"))
+        for tile in tileset.iter("tile"):
+            image = tile.find("image")
+            if image is not None:
+                textures[first_gid + int(tile.get("id"))] = os.path.join(directory, image.get("source"))
+
+    layers = {}
+    for layer in root.iter("layer"):
+        rows = _read_layer_data(layer.find("data"), int(layer.get("width")), int(layer.get("height")))
+        # Flip so row 0 is the bottom of the map
+        layers[layer.get("name")] = rows[::-1]
+
+    tile_map = TileMap(width, height, tile_size, layers, textures)
+    tile_map.digest = map_hash(map_name)
+    return tile_map
+
+
+class TerrainIndex:
+    """
+    Queries on the solid tiles of a map, answered from the map's own tile
+    grids.
+
+    Nothing is built up front, so making one costs the same however big
+    the map is. Point lookups read one cell per layer, and box, segment
+    and ground queries only visit the cells they cover. With a map from
+    the map cache the grids are memory mapped, so only the pages of the
+    cells visited are read.
+    """
+
+    def __init__(self, tile_map, layer_names=(CRASH_LAYER, LAND_LAYER)):
+        self.tile_map = tile_map
+        self.tile_size = tile_map.tile_size
+        self.width = tile_map.width
+        self.height = tile_map.height
+        # Earlier layers win where layers overlap
+        self.layer_names = tuple(layer_names)
+        # Tile id at (row, col) of each layer. Arrays from the map cache are
+        # read with item(), which is much faster than indexing them twice.
+        self.tile_ids = []
+        for layer_name in self.layer_names:
+            layer = tile_map.layers[layer_name]
+            self.tile_ids.append(layer.item if hasattr(layer, "item") else
+                                 lambda row, col, layer=layer: layer[row][col])
+
+        # Layer name -> list of (col, row), only made for the layers
+        # nearest_distance has had to search in full
+        self.layer_cells = {}
+
+    def layer_at(self, col, row):
+        """ Layer of the solid tile in a grid cell, None if it is empty """
+        if 0 <= col < self.width and 0 <= row < self.height:
+            for layer_name, tile_id in zip(self.layer_names, self.tile_ids):
+                if tile_id(row, col):
+                    return layer_name
+        return None
+
+    def cell_at(self, x, y):
+        return int(x // self.tile_size), int(y // self.tile_size)
+
+    def cell_rect(self, col, row):
+        left = col * self.tile_size
+        bottom = row * self.tile_size
+        return left, bottom, left + self.tile_size, bottom + self.tile_size
+
+    def at_point(self, x, y):
+        """ Layer of the solid tile under a point, None if it is empty """
+        return self.layer_at(*self.cell_at(x, y))
+
+    def query_rect(self, left, bottom, right, top):
+        """ (col, row, layer name) of every solid tile a box overlaps """
+        first_col, first_row = self.cell_at(left, bottom)
+        last_col, last_row = self.cell_at(right, top)
+        hits = []
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                layer_name = self.layer_at(col, row)
+                if layer_name is not None:
+                    hits.append((col, row, layer_name))
+        return hits
+
+    def cast_segment(self, start_x, start_y, end_x, end_y):
+        """
+        First solid tile a segment passes through, walking the grid cell by
+        cell. Returns (col, row, layer name, x, y) with the point where the
+        segment enters the tile, or None if it hits nothing.
+        """
+        size = self.tile_size
+        col, row = self.cell_at(start_x, start_y)
+        end_col, end_row = self.cell_at(end_x, end_y)
+        delta_x = end_x - start_x
+        delta_y = end_y - start_y
+        step_col = 1 if delta_x > 0 else -1
+        step_row = 1 if delta_y > 0 else -1
+
+        # How far along the segment (0 to 1) the next grid line is, and
+        # how far apart grid lines are, on each axis
+        if delta_x:
+            next_x = (col + 1 if step_col > 0 else col) * size
+            t_max_x = (next_x - start_x) / delta_x
+            t_delta_x = size / abs(delta_x)
+        else:
+            t_max_x = t_delta_x = math.inf
+        if delta_y:
+            next_y = (row + 1 if step_row > 0 else row) * size
+            t_max_y = (next_y - start_y) / delta_y
+            t_delta_y = size / abs(delta_y)
+        else:
+            t_max_y = t_delta_y = math.inf
+
+        t = 0.0
+        while True:
+            layer_name = self.layer_at(col, row)
+            if layer_name is not None:
+                return col, row, layer_name, start_x + delta_x * t, start_y + delta_y * t
+            if (col, row) == (end_col, end_row):
+                return None
+            if t_max_x < t_max_y:
+                t = t_max_x
+                t_max_x += t_delta_x
+                col += step_col
+            else:
+                t = t_max_y
+                t_max_y += t_delta_y
+                row += step_row
+            if t > 1:
+                return None
+
+    def ground_below(self, x, y):
+        """ Top of the highest solid tile under a point, None if there is none """
+        col = int(x // self.tile_size)
+        if not 0 <= col < self.width:
+            return None
+        # Tiles whose top is at or below the point, highest first
+        for row in range(min(int(y // self.tile_size), self.height) - 1, -1, -1):
+            if self.layer_at(col, row) is not None:
+                return (row + 1) * self.tile_size
+        return None
+
+    def _rect_distance(self, x, y, col, row):
+        left, bottom, right, top = self.cell_rect(col, row)
+        return math.hypot(max(left - x, 0, x - right), max(bottom - y, 0, y - top))
+
+    def nearest_distance(self, x, y, layer_name):
+        """
+        Distance from a point to the closest tile of a layer. Searches rings
+        of cells outward from the point, or checks every tile of the layer
+        once the rings get bigger than that.
+        """
+        if layer_name not in self.layer_names:
+            return math.inf
+        tile_id = self.tile_ids[self.layer_names.index(layer_name)]
+        layer_cells = self.layer_cells.get(layer_name)
+
+        center_col, center_row = self.cell_at(x, y)
+        # Rings past this one are all off the map
+        last_radius = max(abs(center_col), abs(self.width - 1 - center_col),
+                          abs(center_row), abs(self.height - 1 - center_row))
+        best = math.inf
+        radius = 0
+        while radius <= last_radius:
+            # Nothing in this ring or beyond can be closer than what we have
+            if (radius - 1) * self.tile_size > best:
+                return best
+            if layer_cells is None and radius > RING_SEARCH_RADIUS:
+                break
+            if layer_cells is not None and (2 * radius + 1) ** 2 > len(layer_cells):
+                break
+            for col in range(max(center_col - radius, 0), min(center_col + radius + 1, self.width)):
+                step = 1 if abs(col - center_col) == radius else 2 * radius
+                for row in range(center_row - radius, center_row + radius + 1, max(step, 1)):
+                    if 0 <= row < self.height and tile_id(row, col):
+                        best = min(best, self._rect_distance(x, y, col, row))
+            radius += 1
+        else:
+            return best
+
+        # The rings got too big: check every tile of the layer, listed the
+        # first time a search of this layer gets here
+        if layer_cells is None:
+            layer_cells = [(col, row) for col, row, _ in self.tile_map.tiles(layer_name)]
+            self.layer_cells[layer_name] = layer_cells
+        for col, row in layer_cells:
+            best = min(best, self._rect_distance(x, y, col, row))
+        return best
@@ -0,0 +1,45 @@
+import pytest
+
+from batch import BatchSimulation
+from simulation import LanderSimulation, pack_keys
+
+NOTHING = (False, False, False)
+RIGHT = (True, False, False)
+LEFT = (False, True, False)
+UP = (False, False, True)
+
+# Key sequences that stay clear of the ground from the start position
+FLIGHTS = [
+    [NOTHING] * 40,
+    [RIGHT] * 20 + [UP] * 20,
+    [(False, True, True)] * 40,
+    [UP, LEFT, NOTHING, (True, True, True)] * 10,
+]
+
+
+@pytest.mark.parametrize("tick_rate", [60, 30])
+def test_batch_matches_simulation_in_free_flight(tick_rate):
+    simulation = LanderSimulation(tick_rate=tick_rate)
+    batch = BatchSimulation(len(FLIGHTS), simulation.tile_map, tick_rate=tick_rate)
+    for tick in range(len(FLIGHTS[0])):
+        batch.step([pack_keys(*flight[tick]) for flight in FLIGHTS])
+
+    for index, flight in enumerate(FLIGHTS):
+        simulation.setup()
+        for keys in flight:
+            simulation.step(*keys)
+        assert not simulation.game_over
+        assert tuple(batch.position[index]) == pytest.approx(simulation.position, abs=1e-6)
+        assert tuple(batch.velocity[index]) == pytest.approx(simulation.velocity, abs=1e-6)
+        assert batch.fuel[index] == pytest.approx(simulation.lander._fuel)
+    assert batch.active.all()
+
+
+def test_batch_stops_landers_on_the_ground():
+    batch = BatchSimulation(1)
+    for _ in range(600):
+        batch.step([0])
+    assert batch.crashed[0] or batch.landed[0]
+    position = tuple(batch.position[0])
+    batch.step([pack_keys(*UP)])
+    assert tuple(batch.position[0]) == position
@@ -0,0 +1,78 @@
+import struct
+
+import pytest
+
+from ghost import (HEADER_SIZE, HEADER_V1, MAGIC, Ghost, GhostRace, ghost_file_name,
+                   load_ghosts, write_ghost)
+
+MAP = b"m" * 16
+
+
+def test_round_trip(tmp_path):
+    file_name = str(tmp_path / "a.llg")
+    write_ghost(file_name, MAP, [(1.0, 2.0), (3.0, 4.0), (5.0, 6.0)])
+    ghost = Ghost(file_name)
+    assert (ghost.map_digest, len(ghost), ghost.tick_rate) == (MAP, 3, 60)
+    assert ghost.position(1) == (3.0, 4.0)
+    # Before the first tick and after the last, it stays at the ends
+    assert ghost.position(-5) == (1.0, 2.0)
+    assert ghost.position(99) == (5.0, 6.0)
+    ghost.close()
+
+
+def test_positions_by_time_at_any_tick_rate(tmp_path):
+    # Both move 60 px a second, one ghost ticking twice as often
+    write_ghost(str(tmp_path / "fast.llg"), MAP, [(i + 1.0, 0.0) for i in range(60)], 60)
+    write_ghost(str(tmp_path / "slow.llg"), MAP, [(2 * i + 2.0, 0.0) for i in range(30)], 30)
+    race = GhostRace([Ghost(str(tmp_path / "fast.llg")), Ghost(str(tmp_path / "slow.llg"))])
+    for seconds in (0.1, 0.25, 0.5, 0.51):
+        fast, slow = race.positions(seconds)
+        assert fast == pytest.approx((seconds * 60, 0.0), abs=1e-4)
+        assert slow == pytest.approx((seconds * 60, 0.0), abs=1e-4)
+    race.close()
+
+
+def test_reads_version_1(tmp_path):
+    file_name = tmp_path / "old.llg"
+    file_name.write_bytes(HEADER_V1.pack(MAGIC, 1, MAP, 2).ljust(HEADER_SIZE, b"\0") +
+                          struct.pack("<4f", 1, 2, 3, 4))
+    ghost = Ghost(str(file_name))
+    assert (len(ghost), ghost.tick_rate, ghost.position(1)) == (2, 60, (3.0, 4.0))
+    ghost.close()
+
+
+@pytest.mark.parametrize("damage", [
+    # Shorter than the header
+    lambda data: data[:HEADER_SIZE - 1],
+    # Empty file
+    lambda data: b"",
+    # Not a ghost
+    lambda data: b"LLRP" + data[4:],
+    # Unknown format version
+    lambda data: data[:4] + b"\x63" + data[5:],
+    # Fewer positions than the header says
+    lambda data: data[:-1],
+])
+def test_rejects_damaged_files(tmp_path, damage):
+    file_name = str(tmp_path / "a.llg")
+    write_ghost(file_name, MAP, [(1.0, 2.0), (3.0, 4.0)])
+    with open(file_name, "rb") as ghost_file:
+        data = ghost_file.read()
+    with open(file_name, "wb") as ghost_file:
+        ghost_file.write(damage(data))
+    with pytest.raises(ValueError):
+        Ghost(file_name)
+
+
+def test_load_ghosts_skips_what_it_cannot_race(tmp_path):
+    good = str(tmp_path / "good.llr")
+    other_map = str(tmp_path / "other.llr")
+    damaged = str(tmp_path / "damaged.llr")
+    write_ghost(ghost_file_name(good), MAP, [(1.0, 2.0)])
+    write_ghost(ghost_file_name(other_map), b"o" * 16, [(1.0, 2.0)])
+    with open(ghost_file_name(damaged), "wb") as ghost_file:
+        ghost_file.write(MAGIC + b"\x02")
+
+    race = load_ghosts([good, other_map, damaged, str(tmp_path / "missing.llr"), None], MAP)
+    assert [ghost.file_name for ghost in race.ghosts] == [ghost_file_name(good)]
+    race.close()
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from ghost import ghost_file_name, load_ghosts
+from leaderboard import Leaderboard, Run
+from replay import Replay
+
+MAP = b"m" * 16
+OTHER_MAP = b"o" * 16
+
+
+@pytest.fixture
+def leaderboard(tmp_path):
+    leaderboard = Leaderboard(str(tmp_path / "board.db"))
+    yield leaderboard
+    leaderboard.close()
+
+
+def submit(leaderboard, player, score, landed=True, map_digest=MAP):
+    leaderboard.submit(Run(map_digest, score, score / 2, 600, 10.0, landed, player=player))
+
+
+def test_best_keeps_each_players_highest_landing(leaderboard):
+    submit(leaderboard, "ann", 300.5)
+    submit(leaderboard, "ann", 250.0)
+    submit(leaderboard, "ann", 900.0, landed=False)
+    submit(leaderboard, "bob", 120.0, landed=False)
+    leaderboard.flush()
+    assert leaderboard.best(MAP, "ann") == 300.5
+    assert leaderboard.best(MAP, "bob") is None
+    assert leaderboard.best(OTHER_MAP, "ann") is None
+
+    submit(leaderboard, "ann", 410.0)
+    leaderboard.flush()
+    assert leaderboard.best(MAP, "ann") == 410.0
+    assert leaderboard.written == 5
+
+
+def test_rank_and_top(leaderboard):
+    # ann and cy share a whole point, dee ties cy exactly but later
+    for player, score in [("ann", 500.7), ("bob", 720.0), ("cy", 500.2), ("dee", 500.2), ("eve", 80.0)]:
+        submit(leaderboard, player, score)
+    submit(leaderboard, "fay", 999.0, map_digest=OTHER_MAP)
+    leaderboard.flush()
+
+    ranks = {player: leaderboard.rank(MAP, player) for player in ("bob", "ann", "cy", "dee", "eve")}
+    assert ranks == {"bob": 1, "ann": 2, "cy": 3, "dee": 4, "eve": 5}
+    assert leaderboard.rank(MAP, "fay") is None
+    assert [row[0] for row in leaderboard.top(MAP, 3)] == ["bob", "ann", "cy"]
+
+    # Beating your own best moves you up, and whoever you passed down
+    submit(leaderboard, "eve", 800.0)
+    leaderboard.flush()
+    assert leaderboard.rank(MAP, "eve") == 1
+    assert leaderboard.rank(MAP, "bob") == 2
+    assert leaderboard.rank(MAP, "dee") == 5
+
+
+def test_replay_and_ghost_are_saved(leaderboard, tmp_path):
+    replay = Replay(MAP, keys=b"\x00\x04", tick_rate=30)
+    directory = str(tmp_path / "replays")
+    leaderboard.submit(Run(MAP, 10.0, 5.0, 2, 2 / 30, True, player="ann", replay=replay,
+                           replay_directory=directory, ghost=[(1.0, 2.0), (3.0, 4.0)]))
+    leaderboard.flush()
+    replay_file = leaderboard.top(MAP, 1)[0][4]
+    assert os.path.exists(replay_file)
+    assert os.path.exists(ghost_file_name(replay_file))
+
+    ghosts = load_ghosts([replay_file], MAP)
+    assert len(ghosts) == 1
+    assert ghosts.ghosts[0].tick_rate == 30
+    assert ghosts.positions(2 / 30) == [(3.0, 4.0)]
+    ghosts.close()
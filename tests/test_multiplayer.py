@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from multiplayer import (CRASHED, EMPTY, FLYING, LANDED, SNAPSHOT_HEADER,
+                         decode_snapshot, dequantize, encode_changes, encode_snapshot, quantize)
+
+
+def crowd(count, seed=0):
+    """ Just the arrays of a LanderCrowd that snapshots read """
+    rng = np.random.default_rng(seed)
+    return SimpleNamespace(position=rng.uniform(0, 8000, (count, 2)),
+                           velocity=rng.uniform(-450, 450, (count, 2)),
+                           fuel=rng.uniform(0, 500, count),
+                           landed=np.arange(count) % 5 == 1,
+                           crashed=np.arange(count) % 5 == 2)
+
+
+def test_quantize_keeps_state_to_its_precision():
+    landers = crowd(10)
+    occupied = np.arange(10) != 9
+    quantized = quantize(landers, occupied)
+    values = dequantize(quantized)
+    assert np.allclose(values[:, 0:2], landers.position, atol=1 / 8)
+    assert np.allclose(values[:, 2:4], landers.velocity, atol=1 / 16)
+    assert np.allclose(values[:, 4], landers.fuel, atol=1 / 20)
+    assert list(quantized[:4, 5]) == [FLYING, LANDED, CRASHED, FLYING]
+    assert quantized[9, 5] == EMPTY
+
+
+def test_full_snapshot_round_trip():
+    current = quantize(crowd(13), np.ones(13, dtype=bool))
+    packet = encode_snapshot(42, 0, 1.5, 13, encode_changes(current))
+    tick, baseline_tick, echo_time, state = decode_snapshot(packet, np.zeros_like(current))
+    assert (tick, baseline_tick, echo_time) == (42, 0, 1.5)
+    assert np.array_equal(state, current)
+
+
+def test_delta_snapshot_round_trip():
+    occupied = np.ones(13, dtype=bool)
+    landers = crowd(13)
+    baseline = quantize(landers, occupied)
+    landers.position[3] += (10, -5)
+    landers.fuel[7] -= 1
+    landers.landed[11] = True
+    current = quantize(landers, occupied)
+
+    body = encode_changes(current, baseline)
+    # Unchanged fields cost one bit, so the delta is far smaller
+    assert len(body) < len(encode_changes(current)) // 4
+    _, _, _, state = decode_snapshot(encode_snapshot(43, 42, 2.0, 13, body), baseline)
+    assert np.array_equal(state, current)
+
+
+def test_unchanged_snapshot_is_only_bitmaps():
+    current = quantize(crowd(20), np.ones(20, dtype=bool))
+    body = encode_changes(current, current)
+    assert len(body) == 6 * 3
+    packet = encode_snapshot(1, 0, 0.0, 20, body)
+    assert len(packet) == SNAPSHOT_HEADER.size + len(body)
+    assert np.array_equal(decode_snapshot(packet, current)[3], current)
@@ -0,0 +1,32 @@
+import pytest
+
+from profiler import FrameRateMeter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def draw(meter, clock, frames, rate):
+    for _ in range(frames):
+        meter.tick()
+        clock.now += 1 / rate
+
+
+def test_frame_rate_meter_follows_the_draws():
+    clock = FakeClock()
+    meter = FrameRateMeter(clock=clock)
+    assert meter.rate() == 0.0 and meter.average() == 0.0
+
+    draw(meter, clock, 300, 144)
+    assert meter.rate() == pytest.approx(144)
+    assert meter.average() == pytest.approx(144)
+
+    # The recent rate drops at once, the average over the whole game slowly
+    draw(meter, clock, 120, 30)
+    assert meter.rate() == pytest.approx(30)
+    assert 30 < meter.average() < 144
@@ -0,0 +1,98 @@
+import zlib
+
+import pytest
+
+from replay import HEADER_V2, Replay, check_replay, play_headless, replays_match, save_replay
+from simulation import DEFAULT_MAP, LanderSimulation, start_position
+from terrain import map_hash
+
+
+def record(simulation, keys, tick_rate=60):
+    """ Fly a game headless with a list of (right, left, up), recording it """
+    replay = Replay(map_hash(DEFAULT_MAP), start=start_position(), tick_rate=tick_rate)
+    simulation.setup(position=replay.start, tick_rate=tick_rate)
+    for right, left, up in keys:
+        if simulation.game_over:
+            break
+        replay.record(right, left, up)
+        simulation.step(right, left, up)
+    replay.score = simulation.score
+    replay.end = simulation.position
+    return replay
+
+
+@pytest.fixture(scope="module")
+def simulation():
+    return LanderSimulation()
+
+
+def test_bytes_round_trip():
+    replay = Replay(b"m" * 16, seed=7, start=(1.5, 2.5), score=12.0, keys=b"\x00\x01\x04", end=(3.0, 4.0))
+    loaded = Replay.from_bytes(replay.to_bytes())
+    assert (loaded.map_digest, loaded.seed, loaded.start, loaded.score, loaded.end) == \
+        (b"m" * 16, 7, (1.5, 2.5), 12.0, (3.0, 4.0))
+    assert bytes(loaded.keys) == b"\x00\x01\x04"
+    assert Replay.from_bytes(Replay(b"m" * 16).to_bytes()).end is None
+
+
+def test_tick_rate_round_trip():
+    assert Replay.from_bytes(Replay(b"m" * 16, tick_rate=30).to_bytes()).tick_rate == 30
+    # Version 2 had no tick rate, so it was played at 60
+    header = HEADER_V2.pack(b"LLRP", 2, 1, 7, b"m" * 16, 1.5, 2.5, 0, 0.0, 3.0, 4.0)
+    loaded = Replay.from_bytes(header + zlib.compress(b""))
+    assert (loaded.tick_rate, loaded.end, loaded.seed) == (60, (3.0, 4.0), 7)
+
+
+def test_rejects_other_files():
+    with pytest.raises(ValueError):
+        Replay.from_bytes(b"not a replay at all, not even close to one")
+    data = bytearray(Replay(b"m" * 16, keys=b"\x01").to_bytes())
+    data[4] = 99
+    with pytest.raises(ValueError):
+        Replay.from_bytes(bytes(data))
+
+
+@pytest.mark.parametrize("keys", [
+    # Fall straight down onto a slope
+    [(False, False, False)] * 600,
+    # Drift right into the hills
+    [(True, False, False)] * 40 + [(False, False, False)] * 600,
+    # Drift left onto a landing pad
+    [(False, True, False)] * 40 + [(False, False, False)] * 600,
+])
+def test_headless_round_trip(simulation, keys, tmp_path):
+    replay = record(simulation, keys)
+    assert simulation.game_over
+    loaded = Replay.load(save_replay(replay, str(tmp_path)))
+
+    replayed = play_headless(loaded, LanderSimulation())
+    assert replays_match(loaded, replayed)
+    assert replayed.position == replay.end
+    assert replayed.ticks == len(replay)
+
+
+def test_mismatch_is_caught(simulation):
+    replay = record(simulation, [(False, False, False)] * 600)
+    replay.end = (replay.end[0] + 0.5, replay.end[1])
+    assert not replays_match(replay, play_headless(replay, simulation))
+
+
+def test_save_replay_names_are_unique(tmp_path):
+    replay = Replay(b"m" * 16, keys=b"\x01")
+    names = {save_replay(replay, str(tmp_path)) for _ in range(5)}
+    assert len(names) == 5
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(name.split("/")[-1] for name in names)
+
+
+def test_plays_back_at_its_tick_rate(tmp_path):
+    simulation = LanderSimulation()
+    replay = record(simulation, [(False, True, False)] * 20 + [(False, False, False)] * 300, tick_rate=30)
+    assert simulation.game_over
+    loaded = Replay.load(save_replay(replay, str(tmp_path)))
+    replayed = play_headless(loaded, LanderSimulation())
+    assert replays_match(loaded, replayed)
+    assert replayed.time_step == 1 / 30
+
+    check_replay(loaded, tick_rate=30)
+    with pytest.raises(ValueError):
+        check_replay(loaded, tick_rate=60)
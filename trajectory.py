@@ -0,0 +1,96 @@
+"""
+Predicted path of the lander if no thruster fires.
+
+The path is stepped tick by tick the way the physics engine moves the
+lander (gravity, damping and the speed caps), and each tick's move is
+walked through the TerrainIndex grid to find where the bottom of the
+lander first meets a CRASH or LAND tile.
+
+Falling is deterministic, so after a tick without thrust the lander is
+exactly where the path said it would be: the path then only drops its
+first point and adds one at the end. It is worked out again from scratch
+only when the lander is somewhere else, which means a thruster fired or
+it bumped into something.
+"""
+from collections import deque
+
+from constants import (GRAVITY, DEFAULT_DAMPING, PHYSICS_TIME_STEP,
+                       PLAYER_MAX_HORIZONTAL_SPEED, PLAYER_MAX_VERTICAL_SPEED,
+                       PLAYER_IMAGE_HEIGHT, SPRITE_SCALING_PLAYER)
+
+# How far ahead to predict, in ticks
+PREDICTION_TICKS = 300
+
+# How close, in pixels and pixels per second, the lander has to be to the
+# predicted state for the path to still count
+TOLERANCE = 0.01
+
+PLAYER_HALF_HEIGHT = PLAYER_IMAGE_HEIGHT * SPRITE_SCALING_PLAYER / 2
+
+
+class TrajectoryPredictor:
+    """ Where the lander falls to, kept up to date tick by tick """
+
+    def __init__(self, terrain, ticks=PREDICTION_TICKS, damping=DEFAULT_DAMPING, time_step=PHYSICS_TIME_STEP):
+        self.terrain = terrain
+        self.ticks = ticks
+        # Length of one tick, which must be the game's for the path to match
+        self.time_step = time_step
+        self.damping = damping ** time_step
+
+        # Lander center and velocity on every predicted tick, starting now
+        self.points = deque()
+        self.velocities = deque()
+        # (x, y, layer name) where the lander's bottom meets the ground,
+        # None if it doesn't within the prediction
+        self.impact = None
+        # Times the path was worked out from scratch, for checking
+        self.rebuilds = 0
+
+    def _matches(self, index, position, velocity):
+        x, y = self.points[index]
+        velocity_x, velocity_y = self.velocities[index]
+        return (abs(x - position[0]) <= TOLERANCE and abs(y - position[1]) <= TOLERANCE and
+                abs(velocity_x - velocity[0]) <= TOLERANCE and abs(velocity_y - velocity[1]) <= TOLERANCE)
+
+    def update(self, position, velocity):
+        """ Follow the lander one tick. Returns True if the path was rebuilt. """
+        if len(self.points) > 1 and self._matches(1, position, velocity):
+            self.points.popleft()
+            self.velocities.popleft()
+            if self.impact is None:
+                self._extend(self.ticks + 1 - len(self.points))
+            return False
+
+        self.points = deque([tuple(position)])
+        self.velocities = deque([tuple(velocity)])
+        self.impact = None
+        self._extend(self.ticks)
+        self.rebuilds += 1
+        return True
+
+    def _extend(self, count):
+        """ Add up to count ticks to the end of the path, stopping at the ground """
+        x, y = self.points[-1]
+        velocity_x, velocity_y = self.velocities[-1]
+        time_step = self.time_step
+        for _ in range(count):
+            # Positions move with the old velocity, then velocities update
+            next_x = x + velocity_x * time_step
+            next_y = y + velocity_y * time_step
+            velocity_x = velocity_x * self.damping
+            velocity_y = velocity_y * self.damping - GRAVITY * time_step
+            velocity_x = max(-PLAYER_MAX_HORIZONTAL_SPEED, min(velocity_x, PLAYER_MAX_HORIZONTAL_SPEED))
+            velocity_y = max(-PLAYER_MAX_VERTICAL_SPEED, min(velocity_y, PLAYER_MAX_VERTICAL_SPEED))
+
+            hit = self.terrain.cast_segment(x, y - PLAYER_HALF_HEIGHT, next_x, next_y - PLAYER_HALF_HEIGHT)
+            if hit is not None:
+                _, _, layer_name, hit_x, hit_y = hit
+                self.impact = (hit_x, hit_y, layer_name)
+                self.points.append((hit_x, hit_y + PLAYER_HALF_HEIGHT))
+                self.velocities.append((velocity_x, velocity_y))
+                return
+
+            x, y = next_x, next_y
+            self.points.append((x, y))
+            self.velocities.append((velocity_x, velocity_y))